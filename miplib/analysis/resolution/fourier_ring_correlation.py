@@ -9,6 +9,7 @@ import numpy as np
 import os
 import miplib.data.iterators.fourier_ring_iterators as iterators
 import miplib.processing.image as imops
+import miplib.processing.ndarray as ops_array
 from miplib.data.containers.fourier_correlation_data import FourierCorrelationData, \
     FourierCorrelationDataCollection
 from miplib.data.containers.image import Image
@@ -55,15 +56,26 @@ def calculate_single_image_frc(image, args, average=True, trim=True, z_correctio
         frc_data[0].correlation["correlation"] *= 0.5
         frc_data[0].correlation["correlation"] += 0.5*frc_task.execute().correlation["correlation"]
 
-    freqs = frc_data[0].correlation["frequency"].copy()
-    
+    return _analyze_single_image_frc(frc_data, image1.spacing[0], args, z_correction)
+
+
+def _analyze_single_image_frc(frc_data, spacing, args, z_correction=1):
+    """
+    Calculate the resolution from a single image FRC curve. A correction is
+    applied to the result, to account for the checkerboard split.
+
+    :param frc_data: a FourierCorrelationDataCollection with a single curve
+    :param spacing:  the pixel size
+    :param args:     the parameters for the FRC calculation
+    :return:         the FRC result as a FourierCorrelationData object
+    """
     def func(x, a, b, c, d):
         return a * np.exp(c * (x - b)) + d
-  
+
     params = [0.95988146, 0.97979108, 13.90441896, 0.55146136]
 
     # Analyze results
-    analyzer = fsc_analysis.FourierCorrelationAnalysis(frc_data, image1.spacing[0], args)
+    analyzer = fsc_analysis.FourierCorrelationAnalysis(frc_data, spacing, args)
 
     result = analyzer.execute(z_correction=z_correction)[0]
     point = result.resolution["resolution-point"][1]
@@ -74,6 +86,113 @@ def calculate_single_image_frc(image, args, average=True, trim=True, z_correctio
 
     return result
 
+
+class SingleImageFRC(object):
+    """
+    Single image FRC for a series of 2D images of the same size, such as the
+    estimates of an iterative deconvolution. The window, the checkerboard
+    split and the ring index map are calculated only once, and the ring sums
+    are calculated with a single pass over the spectra. The results are
+    equivalent to those of calculate_single_image_frc().
+    """
+
+    def __init__(self, shape, spacing, args, average=True):
+        """
+        :param shape:   the image shape
+        :param spacing: the pixel size
+        :param args:    the parameters for the FRC calculation. See
+                        *miplib.ui.frc_options* for details
+        :param average: average the results of the two checkerboard splits
+        """
+        if len(shape) != 2:
+            raise ValueError("Fourier ring correlation requires 2D images.")
+
+        self.spacing = list(spacing)
+        self.args = args
+        self.average = average
+
+        if args.disable_hamming:
+            self.window = None
+        else:
+            self.window = windowing.apply_hamming_window(np.ones(shape, dtype=np.float32))
+
+        # The splits are zero padded to a matching shape and then to a square
+        odd, even = (slice(1, None, 2), slice(0, None, 2))
+        self.splits = [((odd, odd), (even, even))]
+        if average:
+            self.splits.append(((odd, even), (even, odd)))
+        self.split_shape = tuple(int(np.ceil(i / 2.0)) for i in shape)
+        size = max(self.split_shape)
+        self.fft_shape = (size, size)
+
+        # The ring index of every frequency, as in the FourierRingIterator,
+        # which is created for the split shape. The frequencies outside of it
+        # are collected into an extra bin, that is left out of the results.
+        iterator = iterators.FourierRingIterator(self.split_shape, args.d_bin)
+        nbins = iterator.nbins
+        self.radii = iterator.radii
+        split_rings = np.floor(iterator.r / args.d_bin).astype(np.int64)
+        split_rings[split_rings >= nbins] = nbins
+        rings = np.full(self.fft_shape, nbins, dtype=np.int64)
+        rings[tuple(slice(0, i) for i in split_rings.shape)] = split_rings
+        self.rings = np.fft.ifftshift(rings).ravel()
+        self.nbins = nbins
+
+        # The frequencies are normalized with the Nyquist of the squared image
+        self.frequency = self.radii.astype(np.float32) / int(np.floor(size / 2.0))
+        self.points = np.bincount(self.rings, minlength=nbins + 1)[:len(self.radii)]
+
+    def __pad(self, image):
+        # Same (centered) zero padding as in calculate_single_image_frc()
+        image = ops_array.expand_to_shape(image, self.split_shape)
+        return ops_array.expand_to_shape(image, self.fft_shape)
+
+    def __correlate(self, image, split):
+        fft_image1 = np.fft.fft2(self.__pad(image[split[0]])).ravel()
+        fft_image2 = np.fft.fft2(self.__pad(image[split[1]])).ravel()
+
+        # The ring sums are stored in single precision, as in FRC.execute()
+        length = self.nbins + 1
+        n = len(self.radii)
+        c1 = np.bincount(self.rings, (fft_image1 * fft_image2.conj()).real, length)
+        c2 = np.bincount(self.rings, np.abs(fft_image1) ** 2, length)
+        c3 = np.bincount(self.rings, np.abs(fft_image2) ** 2, length)
+        c1, c2, c3 = (c[:n].astype(np.float32) for c in (c1, c2, c3))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frc = np.abs(c1) / np.sqrt(c2 * c3)
+            frc[frc == np.inf] = 0.0
+            frc = np.nan_to_num(frc)
+
+        return frc
+
+    def execute(self, image, z_correction=1):
+        """
+        Calculate the FRC and the resolution of an image.
+
+        :param image: the image, of the shape given in the constructor
+        :return:      the FRC result as a FourierCorrelationData object
+        """
+        image = np.asarray(image, dtype=np.float64)
+        if self.window is not None:
+            image = image * self.window
+
+        frc = self.__correlate(image, self.splits[0])
+        if self.average:
+            frc *= 0.5
+            frc += 0.5 * self.__correlate(image, self.splits[1])
+
+        data_set = FourierCorrelationData()
+        data_set.correlation["correlation"] = frc
+        data_set.correlation["frequency"] = self.frequency
+        data_set.correlation["points-x-bin"] = self.points.astype(np.float32)
+
+        frc_data = FourierCorrelationDataCollection()
+        frc_data[0] = data_set
+
+        return _analyze_single_image_frc(frc_data, self.spacing[0], self.args, z_correction)
+
+
 def calculate_two_image_frc(image1, image2, args, z_correction=1):
     """
     A simple utility to calculate a regular FRC with a two image input
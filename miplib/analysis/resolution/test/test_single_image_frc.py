@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+import numpy
+from scipy.ndimage import gaussian_filter
+
+import miplib.ui.cli.miplib_entry_point_options as options
+from miplib.data.containers.image import Image
+from ..fourier_ring_correlation import calculate_single_image_frc, SingleImageFRC
+
+
+class TestSingleImageFRC(TestCase):
+    def setUp(self):
+        self.args = options.get_frc_script_options(["image"])
+
+    def __make_image(self, shape):
+        rng = numpy.random.RandomState(0)
+        image = numpy.zeros(shape, dtype=numpy.float32)
+        image[tuple(rng.randint(0, n, 300) for n in shape)] = 1000
+        image = rng.poisson(gaussian_filter(image, 2.0) + 5).astype(numpy.float32)
+
+        return Image(image, (0.05, 0.05))
+
+    def test_matches_calculate_single_image_frc(self):
+        for shape in ((128, 128), (127, 122), (122, 127)):
+            image = self.__make_image(shape)
+
+            expected = calculate_single_image_frc(image, self.args)
+            result = SingleImageFRC(image.shape, image.spacing, self.args).execute(image)
+
+            numpy.testing.assert_allclose(result.correlation["correlation"],
+                                          expected.correlation["correlation"])
+            numpy.testing.assert_allclose(result.correlation["frequency"],
+                                          expected.correlation["frequency"])
+            self.assertAlmostEqual(result.resolution["resolution"],
+                                   expected.resolution["resolution"])
@@ -2,13 +2,20 @@ import os
 import sys
 import time
 
+import numpy
 from pyculib import cuda_compatible
 import miplib.processing.to_string as ops_output
 import miplib.ui.utils as uiutils
-from miplib.processing.deconvolution import deconvolve_cuda, deconvolve
+from miplib.processing.deconvolution import deconvolve_cuda, deconvolve, deconvolve_batch, \
+    deconvolve_multichannel
+from miplib.data.containers.image import Image
 from miplib.psf import psfgen
+from miplib.psf.bank import PSFBank
+from miplib.psf.cache import PSFCache
+from miplib.psf.compact import CompactPSF
 from miplib.ui.cli import miplib_entry_point_options as options
 from miplib.data.io import read as imread
+from miplib.data.io import write as imwrite
 
 
 def main():
@@ -19,8 +26,24 @@ def main():
     dir = args.working_directory
     image_path = os.path.join(dir, image_name)
 
-    # Figure out an image type and use the correct loader.
-    if image_path.endswith('.tif'):
+    # Figure out an image type and use the correct loader. All the images
+    # in a directory are deconvolved in a batch, with the same PSF. The
+    # selected channels of a multi-channel image are read into a single
+    # stack, with the channel on the first axis.
+    if args.channels is not None:
+        channels = [imread.get_image(image_path, channel=channel)
+                    for channel in args.channels]
+        image = Image(numpy.stack(channels), channels[0].spacing)
+    elif os.path.isdir(image_path):
+        image_names = sorted(name for name in os.listdir(image_path)
+                             if name.endswith('.tif'))
+        images = [imread.get_image(os.path.join(image_path, name))
+                  for name in image_names]
+        image = images[0]
+    elif image_path.endswith('.tif') and args.memmap_image:
+        image = imread.get_image_memmap(image_path)
+        args.memmap_estimates = True
+    elif image_path.endswith('.tif'):
         image = imread.get_image(image_path)
     elif image_path.endswith('.mat'):
         image = imread.get_image(image_path)[args.carma_gate_idx, args.carma_det_idx]
@@ -30,32 +53,86 @@ def main():
 
     # Load/Generate PSF
     if args.psf == "estimate":
-        psf = psfgen.PSF(psftype=args.psf_type, shape=args.psf_shape, dims=args.psf_size,
-                         ex_wavelen=args.ex_wl, em_wavelen=args.em_wl, num_aperture=args.na,
-                         refr_index=args.refractive_index, magnification=args.magnification,
-                         pinhole_radius=args.pinhole_radius)
-
-        if args.sted_psf:
-            psf.sted_correction(args.sted_phi, args.sted_sigma)
-
-            psf_image = psf.volume()
-            psf_spacing = psf.dims['um'][0]/psf.shape[0]
-
-            if image.get_dimensions()[0] == 1:
-                psf_image = psf_image[psf_image.shape/2]
-
-            psf = image.Image(psf_image, psf_spacing)
-
+        psf_cache = None
+        if args.psf_cache_dir is not None:
+            psf_cache = PSFCache(args.psf_cache_dir, args.psf_cache_size)
+
+        # With --channels, a PSF is calculated for every channel, with the
+        # per-channel wavelengths, if given.
+        n_psfs = 1
+        if args.channels is not None and (args.channel_ex_wl is not None or
+                                          args.channel_em_wl is not None):
+            n_psfs = len(args.channels)
+        ex_wavelengths = args.channel_ex_wl or (args.ex_wl,) * n_psfs
+        em_wavelengths = args.channel_em_wl or (args.em_wl,) * n_psfs
+        if len(ex_wavelengths) != n_psfs or len(em_wavelengths) != n_psfs:
+            raise ValueError("A wavelength is needed for each of the %i channels" % n_psfs)
+
+        parameters = [dict(shape=args.psf_shape, dims=args.psf_size,
+                           ex_wavelen=ex_wl, em_wavelen=em_wl, num_aperture=args.na,
+                           refr_index=args.refractive_index,
+                           magnification=args.magnification,
+                           pinhole_radius=args.pinhole_radius)
+                      for ex_wl, em_wl in zip(ex_wavelengths, em_wavelengths)]
+        psfs = PSFBank(args.psf_type, parameters, num_workers=args.num_workers,
+                       cache=psf_cache).execute()
+
+        image_ndim = image.ndim - 1 if args.channels is not None else image.ndim
+        # The bank returns the same PSF object for identical parameters,
+        # which must be processed only once.
+        processed = {}
+        for channel_psf in psfs:
+            if id(channel_psf) in processed:
+                continue
+            if args.sted_psf:
+                channel_psf.sted_correction(args.sted_phi, args.sted_sigma)
+
+            # The PSF volume is expanded from the z-r data in single precision,
+            # cropped to the support that contains most of the PSF energy.
+            compact_psf = CompactPSF.from_psf(channel_psf, energy=args.psf_support_energy)
+            compact_psf = compact_psf.xy() if image_ndim == 2 else compact_psf.volume()
+            compact_psf /= compact_psf.sum()
+            processed[id(channel_psf)] = compact_psf
+        psf = [processed[id(channel_psf)] for channel_psf in psfs]
+
+        if len(psf) == 1:
+            psf = psf[0]
+
+    elif args.channels is not None or args.psf_depths is not None:
+        psf = [imread.get_image(os.path.join(dir, path))
+               for path in args.psf.split(',')]
+        if len(psf) == 1 and args.psf_depths is None:
+            psf = psf[0]
     else:
-        psf = image.Image.get_image_from_imagej_tiff(args.psf_path)
+        psf = imread.get_image(os.path.join(dir, args.psf))
+
+    if args.channels is not None:
+        if args.psf_depths is not None:
+            raise NotImplementedError("A depth-variant PSF is not supported "
+                                      "with multi-channel images")
+        deconvolve_channels(args, image, psf)
+        return
+
+    # A depth-variant PSF, with one PSF for every --psf-depths position
+    if args.psf_depths is not None:
+        deconvolve_depth_variant(args, image, psf)
+        return
+
+    # A directory, or a stack of images with a PSF of lower dimension
+    if os.path.isdir(image_path):
+        deconvolve_images(args, images, psf, image_names)
+        return
+    elif image.ndim == psf.ndim + 1:
+        deconvolve_images(args, image, psf, None)
+        return
 
     # Start deconvolution
     if cuda_compatible():
         print("Found a compatible GPU. The image deconvolution will be run with " \
               "hardware acceleration.")
-        task = deconvolve_cuda.DeconvolutionRLCuda(image, psf, args)
+        task = deconvolve_cuda.DeconvolutionRLCuda(image, psf, None, args)
     else:
-        task = deconvolve.DeconvolutionRL(image, psf, args)
+        task = deconvolve.DeconvolutionRL(image, psf, None, args)
 
     begin = time.time()
     task.execute()
@@ -67,11 +144,102 @@ def main():
           "took %s (H:M:S) to complete." % (args.max_nof_iterations,
                                             ops_output.format_time_string(
                                                 end - begin)))
-    if uiutils.get_user_input("Do you want to save the result to TIFF? "):
+    if args.result_file is not None:
+        imwrite.image_out_of_core(os.path.join(args.working_directory,
+                                               args.result_file),
+                                  result)
+    elif uiutils.get_user_input("Do you want to save the result to TIFF? "):
         file_path = os.path.join(args.working_directory,
                                  "fusion_result.tif")
         result.save_to_tiff(file_path)
 
+    task.close()
+
+
+def deconvolve_channels(args, image, psfs):
+    """
+    Deconvolve the channels of a multi-channel image, and save the result
+    into a single multi-channel image.
+
+    :param args: the command line options
+    :param image: the image, with the channel on the first axis
+    :param psfs: a list of PSFs, one for every channel, or a single PSF
+    """
+    task = deconvolve_multichannel.DeconvolutionRLMultiChannel(image, psfs, args)
+
+    begin = time.time()
+    task.execute()
+    end = time.time()
+
+    print("Deconvolution of %i channels took %s (H:M:S) to complete." % (
+        task.n_channels, ops_output.format_time_string(end - begin)))
+
+    result_file = args.result_file
+    if result_file is None:
+        result_file = "deconvolution_result.tif"
+    imwrite.multichannel_image(os.path.join(args.working_directory, result_file),
+                               task.get_result())
+
+    task.close()
+
+
+def deconvolve_depth_variant(args, image, psfs):
+    """
+    Deconvolve an image with a depth-variant PSF, and save the result.
+
+    :param args: the command line options
+    :param image: the image
+    :param psfs: a list of PSFs, one for every --psf-depths position
+    """
+    task = deconvolve.DeconvolutionRL(image, psfs, None, args)
+
+    begin = time.time()
+    task.execute()
+    end = time.time()
+
+    print("Deconvolution with %i PSFs took %s (H:M:S) to complete." % (
+        len(psfs), ops_output.format_time_string(end - begin)))
+
+    result_file = args.result_file
+    if result_file is None:
+        result_file = "deconvolution_result.tif"
+    imwrite.image_out_of_core(os.path.join(args.working_directory, result_file),
+                              task.get_result())
+
+    task.close()
+
+
+def deconvolve_images(args, images, psf, image_names):
+    """
+    Deconvolve a batch of images that share a single PSF, and save the
+    results into a "deconvolved" directory.
+
+    :param args: the command line options
+    :param images: a list of images, or a stack of images
+    :param psf: the PSF
+    :param image_names: the file names of the images, or None with a stack
+    """
+    task = deconvolve_batch.DeconvolutionRLBatch(images, psf, args)
+
+    begin = time.time()
+    task.execute()
+    end = time.time()
+
+    print("Deconvolution of %i images took %s (H:M:S) to complete." % (
+        task.n_images, ops_output.format_time_string(end - begin)))
+
+    output_dir = os.path.join(args.working_directory, "deconvolved")
+    if not os.path.isdir(output_dir):
+        os.mkdir(output_dir)
+
+    if image_names is None:
+        image_names = ["image_%04i.tif" % i for i in range(task.n_images)]
+
+    for i, name in enumerate(image_names):
+        imwrite.image(os.path.join(output_dir, name), task.get_result(i))
+
+    task.close()
+
 
 if __name__ == "__main__":
         main()
@@ -210,6 +210,64 @@ class ImageData(object):
         image_group[name].attrs["size"] = data.shape
         image_group[name].attrs["calculated"] = calculated
 
+    def add_virtual_psf(self, data, scale, index, views, spacing, checksum):
+        """
+        Save a virtual PSF of a multi-view fusion into the psf group of the
+        view, so that it does not have to be calculated again.
+
+        Parameters
+        ----------
+        :param data:            The virtual PSF as a numpy.ndarray
+        :param scale            The scale of the registered images the virtual
+                                PSF was calculated for
+        :param index            The view index
+        :param views            The indexes of all the views in the fusion
+        :param spacing:         Voxel size
+        :param checksum         A checksum of the PSFs the virtual PSF was
+                                calculated from
+        """
+        assert isinstance(data, numpy.ndarray), "Invalid data format."
+
+        group_name = "psf/" + str(index)
+        if group_name not in self.data:
+            raise ValueError("No PSF for view %s" % index)
+        image_group = self.data[group_name]
+
+        name = self.__get_virtual_psf_name(scale, views)
+        if name in image_group:
+            del image_group[name]
+
+        image_group.create_dataset(name, data=data)
+        image_group[name].attrs["spacing"] = spacing
+        image_group[name].attrs["size"] = data.shape
+        image_group[name].attrs["checksum"] = checksum
+
+    def get_virtual_psf(self, scale, index, views, checksum):
+        """
+        Get a saved virtual PSF of a multi-view fusion.
+
+        Parameters
+        ----------
+        :param scale            The parameters that identify the virtual PSF,
+        :param index            as in add_virtual_psf()
+        :param views
+        :param checksum         The checksum of the current PSFs
+
+        Returns
+        -------
+        The virtual PSF as a numpy.ndarray, or None if it has not been saved,
+        or if it was calculated from different PSFs.
+        """
+        name = "psf/" + str(index) + "/" + self.__get_virtual_psf_name(scale, views)
+        if name not in self.data or self.data[name].attrs["checksum"] != checksum:
+            return None
+
+        return self.data[name][:]
+
+    @staticmethod
+    def __get_virtual_psf_name(scale, views):
+        return "virtual_views_" + "-".join(str(view) for view in views) + "_scale_" + str(scale)
+
     def add_transform(self, scale, index, channel, params, fixed_params, transform_type):
         """
         Adds a spatial transformation as an attribute to the corresponding registered
@@ -496,7 +554,9 @@ class ImageData(object):
         scales = []
 
         def find_scale(name):
-            scales.append(int(name.split("_")[-1]))
+            # The virtual PSFs of the fusion are saved with the PSFs
+            if not name.startswith("virtual_"):
+                scales.append(int(name.split("_")[-1]))
 
         for index in range(self.get_number_of_images(image_type)):
             scales = []
@@ -1,4 +1,5 @@
 import os
+import re
 
 import SimpleITK as sitk
 import pims
@@ -37,6 +38,37 @@ def get_image(filename, series=0, channel=0, return_type='image', bioformats=Tru
 
     return data
 
+def get_image_memmap(filename):
+    """
+    Memory map the image data of a TIFF file, instead of reading it into
+    memory. This can be used with images that are too large to fit in
+    the memory. Only uncompressed TIFF files with contiguous image data
+    (such as the ones written by miplib) can be memory mapped.
+
+    :param filename: the full path to a TIFF file
+    :return: an Image, with the image data memory mapped from the file
+    """
+    assert filename.endswith((".tif", ".tiff"))
+
+    with tiffile.TiffFile(filename) as tif:
+        images = tif.asarray(out='memmap')
+        page = tif.pages[0]
+        description = page.description
+        x_resolution = page.tags['XResolution'].value
+        y_resolution = page.tags['YResolution'].value
+
+    # The XY spacing is saved in the resolution tags, the z spacing in the
+    # image description.
+    spacing = [float(x_resolution[1]) / x_resolution[0],
+               float(y_resolution[1]) / y_resolution[0]]
+    if images.ndim == 3:
+        match = re.search(r"spacing=([0-9.eE+-]+)", description)
+        assert match is not None, "The z spacing was not found in the TIFF"
+        spacing.insert(0, float(match.group(1)))
+
+    return Image(images, spacing, filename=filename)
+
+
 def __itk_image(filename, return_itk=True):
     """
     A function for reading image file types typical to ITK (mha & mhd). This is mostly
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import h5py
+import numpy
+
+from miplib.data.containers.image import Image
+from .. import read, write
+
+
+class TestOutOfCoreImages(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image = Image(numpy.random.rand(20, 32, 24).astype(numpy.float32),
+                           [0.2, 0.05, 0.05])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def is_memory_mapped(array):
+        while isinstance(array, numpy.ndarray):
+            if isinstance(array, numpy.memmap):
+                return True
+            array = array.base
+        return False
+
+    def test_tiff_is_memory_mapped_with_spacing(self):
+        path = os.path.join(self.directory, "image.tif")
+        write.image_out_of_core(path, self.image, chunk_size=6)
+
+        image = read.get_image_memmap(path)
+
+        self.assertIsInstance(image, Image)
+        self.assertTrue(self.is_memory_mapped(image))
+        numpy.testing.assert_array_equal(image, self.image)
+        numpy.testing.assert_allclose(image.spacing, self.image.spacing, rtol=1e-6)
+
+    def test_2d_tiff_is_memory_mapped(self):
+        path = os.path.join(self.directory, "image.tif")
+        image_2d = Image(numpy.array(self.image[0]), [0.05, 0.05])
+        write.image_out_of_core(path, image_2d)
+
+        image = read.get_image_memmap(path)
+
+        numpy.testing.assert_array_equal(image, image_2d)
+        numpy.testing.assert_allclose(image.spacing, image_2d.spacing, rtol=1e-6)
+
+    def test_hdf5_is_written_in_chunks(self):
+        path = os.path.join(self.directory, "image.h5")
+        write.image_out_of_core(path, self.image, chunk_size=6)
+
+        with h5py.File(path, 'r') as f:
+            numpy.testing.assert_array_equal(f["image"][:], self.image)
+            numpy.testing.assert_allclose(f["image"].attrs["spacing"], self.image.spacing)
+
+    def test_unknown_file_type_is_rejected(self):
+        self.assertRaises(ValueError, write.image_out_of_core,
+                          os.path.join(self.directory, "image.png"), self.image)
@@ -1,3 +1,5 @@
+import h5py
+import numpy
 import SimpleITK as sitk
 import pims
 import miplib.processing.itk as itkutils
@@ -76,3 +78,89 @@ def __tiff(path, image, spacing):
                        imagej=True,
                        resolution=(1.0 / spacing[0], 1.0 / spacing[1]))
 
+
+def multichannel_image(path, image):
+    """
+    Write a multi-channel image, in which the first axis is the channel. A
+    TIFF is saved as an ImageJ hyperstack. HDF5 (.h5, .hdf5) files are
+    written with image_out_of_core().
+
+    :param path:    A full path to the image.
+    :param image:   An image as :type image: Image. The spacing may be given
+                    for the channel axis as well.
+    """
+    assert isinstance(image, Image)
+    assert image.ndim in (3, 4)
+
+    if path.endswith(('.h5', '.hdf5')):
+        image_out_of_core(path, image)
+        return
+
+    spacing = image.spacing[-(image.ndim - 1):]
+
+    # ImageJ hyperstacks are in TZCYXS order
+    if image.ndim == 4:
+        tiffile.imsave(path,
+                       numpy.ascontiguousarray(numpy.swapaxes(image, 0, 1)),
+                       imagej=True,
+                       resolution=(1.0 / spacing[1], 1.0 / spacing[2]),
+                       metadata={'spacing': spacing[0], 'unit': 'micron'})
+    else:
+        tiffile.imsave(path,
+                       numpy.asarray(image),
+                       imagej=True,
+                       resolution=(1.0 / spacing[0], 1.0 / spacing[1]))
+
+
+def image_out_of_core(path, image, chunk_size=16):
+    """
+    Write an image that may be larger than the available memory, such as a
+    memory mapped array. The image is copied into the file in chunks
+    along the first axis, which means that only a single chunk is read in
+    memory at a time.
+
+    :param path:       A full path to the image. TIFF (.tif, .tiff) and HDF5
+                       (.h5, .hdf5) files are supported. In a HDF5 file, the
+                       image is saved into an "image" dataset, with the
+                       spacing as an attribute.
+    :param image:      An image as :type image: Image
+    :param chunk_size: The number of slices along the first axis that are
+                       copied at a time
+    """
+    assert isinstance(image, Image)
+
+    spacing = image.spacing
+
+    if path.endswith(('.tiff', '.tif')):
+        if image.ndim == 3:
+            image_description = "images={} slices={} unit=micron spacing={}".format(image.shape[0],
+                                                                                    image.shape[0],
+                                                                                    spacing[0])
+            output = tiffile.memmap(path,
+                                    shape=image.shape,
+                                    dtype=image.dtype,
+                                    resolution=(1.0 / spacing[1], 1.0 / spacing[2]),
+                                    metadata={'description': image_description})
+        else:
+            output = tiffile.memmap(path,
+                                    shape=image.shape,
+                                    dtype=image.dtype,
+                                    imagej=True,
+                                    resolution=(1.0 / spacing[0], 1.0 / spacing[1]))
+        __copy_in_chunks(image, output, chunk_size)
+        output.flush()
+        del output
+
+    elif path.endswith(('.h5', '.hdf5')):
+        with h5py.File(path, 'w') as f:
+            output = f.create_dataset("image", shape=image.shape, dtype=image.dtype)
+            output.attrs["spacing"] = spacing
+            __copy_in_chunks(image, output, chunk_size)
+    else:
+        raise ValueError("Unsupported file type %s" % path)
+
+
+def __copy_in_chunks(source, destination, chunk_size):
+    for start in range(0, source.shape[0], chunk_size):
+        stop = min(start + chunk_size, source.shape[0])
+        destination[start:stop] = numpy.asarray(source[start:stop])
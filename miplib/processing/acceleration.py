@@ -0,0 +1,111 @@
+"""
+acceleration.py
+
+This file contains the vector extrapolation based acceleration of the
+Richardson-Lucy type iterative algorithms, as described in:
+
+Biggs, D. S. C., & Andrews, M. (1997). Acceleration of iterative image
+restoration algorithms. Applied Optics, 36(8), 1766-1775.
+
+At every iteration, the next estimate is predicted from the previous
+estimates, and the RL update is applied to the prediction, instead of the
+current estimate. The length of the prediction step is calculated
+from the two previous RL update vectors.
+"""
+
+import os
+
+import numpy
+
+
+class BiggsAndrewsAcceleration(object):
+    """
+    Biggs-Andrews vector extrapolation for multiplicative RL updates. Call
+    predict() before, and update() after each RL iteration. The estimate
+    is modified in place. Between the two calls, the predicted flag is set,
+    and the estimate before the prediction is available in previous, e.g.
+    for restoring it, if the iteration is interrupted.
+    """
+
+    def __init__(self, shape, max_step=1.0, memmap_directory=None):
+        """
+        :param shape: the shape of the estimate
+        :param max_step: the upper limit of the extrapolation step length. The
+                         step is limited to [0, max_step], to keep the
+                         iteration stable.
+        :param memmap_directory: if given, the history arrays are memory mapped
+                                 to files in this directory
+        """
+        assert 0 <= max_step <= 1.0
+
+        self.max_step = max_step
+
+        self.previous = self.__allocate(shape, memmap_directory, "acc_previous.dat")
+        self.prediction = self.__allocate(shape, memmap_directory, "acc_prediction.dat")
+        self.gradient = self.__allocate(shape, memmap_directory, "acc_gradient.dat")
+
+        self.reset()
+
+    @staticmethod
+    def __allocate(shape, directory, name):
+        if directory is None:
+            return numpy.zeros(shape, dtype=numpy.float32)
+        else:
+            return numpy.memmap(os.path.join(directory, name), dtype=numpy.float32,
+                                mode='w+', shape=shape)
+
+    def reset(self):
+        """
+        Forget the iteration history, e.g. after the PSF has been changed.
+        """
+        self.iteration = 0
+        self.step = 0.0
+        self.predicted = False
+
+    def predict(self, estimate):
+        """
+        Extrapolate the estimate along the direction of the previous
+        change. Negative values are clipped.
+
+        :param estimate: the current estimate, modified in place
+        """
+        if self.iteration > 0 and self.step > 0:
+            # The prediction buffer is used as temporary storage for the
+            # change vector here.
+            numpy.subtract(estimate, self.previous, out=self.prediction)
+            self.previous[:] = estimate
+            self.predicted = True
+            self.prediction *= numpy.float32(self.step)
+            estimate += self.prediction
+            numpy.maximum(estimate, 0, out=estimate)
+        else:
+            self.previous[:] = estimate
+            self.predicted = True
+
+        self.prediction[:] = estimate
+
+    def update(self, estimate):
+        """
+        Calculate the step length for the next prediction, based on the
+        RL update that was applied to the predicted estimate.
+
+        :param estimate: the new estimate, after the RL update
+        """
+        # g = x(k+1) - y(k)
+        gradient = self.prediction
+        numpy.subtract(estimate, self.prediction, out=gradient)
+
+        if self.iteration > 0:
+            previous_gradient = self.gradient.ravel()
+            norm = numpy.vdot(previous_gradient, previous_gradient)
+            if norm > 0:
+                step = numpy.vdot(gradient.ravel(), previous_gradient) / norm
+                self.step = float(numpy.clip(step, 0.0, self.max_step))
+            else:
+                self.step = 0.0
+
+        # Swap the buffers: the gradient is saved for the next step
+        # calculation and the old gradient buffer is reused for the prediction.
+        self.prediction, self.gradient = self.gradient, gradient
+        self.iteration += 1
+        self.predicted = False
@@ -0,0 +1,157 @@
+"""
+block_cache.py
+
+This file contains an in-memory cache for image blocks that are read over
+and over again during an iterative reconstruction, such as the blocks of
+the registered views in the multi-view fusion. The input data never
+changes during the iteration, which is why the blocks can be kept in
+memory, decoded into float32, instead of reading them from the HDF5 file
+at every iteration. The size of the cache is limited by a memory budget:
+the least recently used blocks are dropped, or optionally spilled into
+raw files in a local directory, from which they are faster to read back
+than from the (possibly compressed) data file.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy
+
+
+class BlockCache(object):
+    """
+    A thread safe, size bounded LRU cache of image blocks.
+    """
+
+    def __init__(self, max_size, spill_directory=None):
+        """
+        :param max_size: the maximum total size of the blocks kept in memory,
+                         in bytes
+        :param spill_directory: if given, the blocks that do not fit in
+                         memory are saved into this directory, instead of
+                         dropping them
+        """
+        self.max_size = max_size
+        self.spill_directory = spill_directory
+
+        self._blocks = OrderedDict()
+        self._spilled = {}
+        self._lock = threading.Lock()
+
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Get a block from the cache.
+
+        :param key: a hashable block key
+        :return: the block as a read-only float32 numpy.ndarray, or None if
+                 it is not in the cache
+        """
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            path = self._spilled.get(key)
+
+        if path is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # The spilled blocks are read back outside the lock, and moved back
+        # into memory.
+        block = numpy.load(path, allow_pickle=False)
+        with self._lock:
+            self.hits += 1
+        return self.put(key, block)
+
+    def put(self, key, block):
+        """
+        Save a block into the cache. The least recently used blocks are
+        removed from memory, if the cache is full.
+
+        :param key: a hashable block key
+        :param block: the block data
+        :return: the cached block, as a read-only float32 numpy.ndarray
+        """
+        block = numpy.array(block, dtype=numpy.float32)
+        block.setflags(write=False)
+
+        # A block that is larger than the whole cache is not saved
+        if block.nbytes > self.max_size:
+            return block
+
+        with self._lock:
+            if key in self._blocks:
+                self.nbytes -= self._blocks.pop(key).nbytes
+            self._blocks[key] = block
+            self.nbytes += block.nbytes
+            evicted = self.__evict()
+
+        for evicted_key, evicted_block in evicted:
+            self.__spill(evicted_key, evicted_block)
+
+        return block
+
+    def __evict(self):
+        """
+        Remove the least recently used blocks from memory, until the cache
+        fits in the size limit. Must be called with the lock held.
+
+        :return: a list of the removed (key, block) pairs
+        """
+        evicted = []
+        while self.nbytes > self.max_size:
+            key, block = self._blocks.popitem(last=False)
+            self.nbytes -= block.nbytes
+            evicted.append((key, block))
+
+        return evicted
+
+    def __spill(self, key, block):
+        """
+        Save a block that was removed from memory into the spill directory.
+        A block is written only once, as the blocks never change.
+        """
+        if self.spill_directory is None:
+            return
+
+        with self._lock:
+            if key in self._spilled:
+                return
+            path = os.path.join(self.spill_directory,
+                                "block_%i.npy" % len(self._spilled))
+            self._spilled[key] = None
+
+        numpy.save(path, block)
+        with self._lock:
+            self._spilled[key] = path
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._blocks or self._spilled.get(key) is not None
+
+    def clear(self):
+        """
+        Remove all the blocks, including the spilled ones.
+        """
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+            spilled = [path for path in self._spilled.values() if path is not None]
+            self._spilled.clear()
+
+        for path in spilled:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,277 @@
+"""
+blocks.py
+
+This file contains functions for dividing an image into blocks, in the
+iterative deconvolution and fusion algorithms. A block is processed in
+one go, which means that the block size controls the memory consumption
+of the algorithms.
+"""
+
+import itertools
+
+import numpy
+from scipy.fft import next_fast_len
+from scipy.ndimage import maximum_filter, uniform_filter
+
+import miplib.processing.ndarray as ops_array
+
+# An approximation of the number of bytes that are needed for every voxel
+# of a (FFT padded) block during an RL iteration: the padded estimate and
+# image blocks, the real and complex FFT buffers and the ratio image.
+block_voxel_bytes_c = 32
+
+# The maximum number of local mean values that are collected for the
+# estimation of the background and noise levels in find_background_blocks
+noise_samples_c = 2 ** 22
+
+
+def split_by_block_count(image_size, num_blocks):
+    """
+    Calculate the block size and the internal image size for a given
+    number of blocks. 1, 2, 4, 8, 12, 24, 48, 64, 96 or 144 blocks
+    are supported. The internal image size is padded to an exact
+    multiple of the block size.
+
+    :param image_size: the image dimensions, a numpy.ndarray
+    :param num_blocks: the number of blocks
+    :return: a tuple (block_size, image_size)
+    """
+    block_size = image_size
+    image_size = image_size
+
+    if num_blocks == 1:
+        return block_size, image_size
+    elif num_blocks == 2:
+        multiplier3 = numpy.array([2, 1, 1])
+        multiplier2 = numpy.array([2, 1])
+    elif num_blocks == 4:
+        multiplier3 = numpy.array([4, 1, 1])
+        multiplier2 = numpy.array([2, 2])
+    elif num_blocks == 8:
+        multiplier3 = numpy.array([4, 2, 1])
+        multiplier2 = numpy.array([4, 2])
+    elif num_blocks == 12:
+        multiplier3 = numpy.array([4, 2, 2])
+        multiplier2 = numpy.array([4, 3])
+    elif num_blocks == 24:
+        multiplier3 = numpy.array([4, 3, 2])
+        multiplier2 = numpy.array([6, 4])
+    elif num_blocks == 48:
+        multiplier3 = numpy.array([4, 4, 3])
+        multiplier2 = numpy.array([8, 6])
+    elif num_blocks == 64:
+        multiplier3 = numpy.array([4, 4, 4])
+        multiplier2 = numpy.array([8, 8])
+    elif num_blocks == 96:
+        multiplier3 = numpy.array([6, 4, 4])
+        multiplier2 = numpy.array([12, 8])
+    elif num_blocks == 144:
+        multiplier3 = numpy.array([4, 6, 6])
+        multiplier2 = numpy.array([12, 12])
+    else:
+        raise NotImplementedError
+
+    if len(image_size) == 2:
+        block_size = numpy.ceil(image_size.astype(numpy.float16) / multiplier2).astype(numpy.int64)
+        image_size += (multiplier2 * block_size - image_size)
+    else:
+        block_size = numpy.ceil(image_size.astype(numpy.float16) / multiplier3).astype(numpy.int64)
+        image_size += (multiplier3 * block_size - image_size)
+
+    return block_size, image_size
+
+
+def get_block_budget(max_memory, reserved):
+    """
+    Subtract the memory that is reserved for the whole duration of an
+    algorithm (e.g. the image and the estimates) from the memory budget,
+    to get the budget that is left for the blocks.
+
+    :param max_memory: the total memory budget, in bytes
+    :param reserved: a list of (name, bytes) pairs of the reserved parts
+    :return: the memory budget of the blocks, in bytes
+    """
+    total = sum(size for _, size in reserved)
+    if total >= max_memory:
+        parts = ", ".join("%s %i" % (name, size) for name, size in reserved)
+        raise ValueError("The memory budget of %i bytes is too small: %i bytes are "
+                         "reserved (%s), leaving nothing for the image blocks." % (
+                             max_memory, total, parts))
+
+    return max_memory - total
+
+
+def plan_blocks(image_size, psf_size, block_pad, max_memory, num_workers=1,
+                voxel_bytes=block_voxel_bytes_c):
+    """
+    Find a block size that minimizes the total FFT volume of a single iteration,
+    while keeping the memory needed by the blocks that are processed
+    simultaneously within the given budget. The FFTs are calculated at
+    5-smooth lengths, which means that each block is expanded to the
+    closest 5-smooth size, after adding the padding and the PSF overlap. The
+    block size is chosen so that the expanded sizes are wasted as little
+    as possible on the overlap and on padding the image to a multiple of
+    the block size.
+
+    :param image_size: the image dimensions
+    :param psf_size: the PSF dimensions
+    :param block_pad: the amount of padding on each side of a block
+    :param max_memory: the memory budget for the blocks, in bytes
+    :param num_workers: the number of blocks that are processed simultaneously
+    :param voxel_bytes: the number of bytes that are needed for every voxel
+                        of a FFT padded block
+    :return: a tuple (block_size, image_size), with the image_size padded to a
+             multiple of the block size.
+    """
+    assert len(image_size) == len(psf_size)
+
+    # Collect the block size candidates for each axis. For a given number of
+    # blocks, the smallest block is the best one. There is no reason to use
+    # more blocks, if it does not allow the FFT size to be reduced.
+    candidates = []
+    for n, p in zip(image_size, psf_size):
+        n = int(n)
+        overlap = 2 * block_pad + int(p) - 1
+        axis = []
+        for count in range(1, n + 1):
+            block = -(-n // count)
+            if count > 1 and block == axis[-1][1]:
+                continue
+            fft_size = next_fast_len(block + overlap, real=True)
+            if axis and fft_size >= axis[-1][2]:
+                continue
+            axis.append((-(-n // block), block, fft_size))
+        candidates.append(numpy.array(axis, dtype=numpy.int64))
+
+    # Evaluate all the combinations
+    grids = numpy.meshgrid(*(numpy.arange(len(axis)) for axis in candidates),
+                           indexing='ij')
+    counts = [axis[grid.ravel(), 0] for axis, grid in zip(candidates, grids)]
+    blocks = [axis[grid.ravel(), 1] for axis, grid in zip(candidates, grids)]
+    fft_sizes = [axis[grid.ravel(), 2] for axis, grid in zip(candidates, grids)]
+
+    n_blocks = ops_array.mul_seq(c.astype(numpy.float64) for c in counts)
+    fft_volume = ops_array.mul_seq(f.astype(numpy.float64) for f in fft_sizes)
+
+    memory = fft_volume * voxel_bytes * numpy.minimum(n_blocks, max(num_workers, 1))
+    cost = n_blocks * fft_volume
+    cost[memory > max_memory] = numpy.inf
+
+    best = numpy.argmin(cost)
+    if numpy.isinf(cost[best]):
+        raise ValueError("The memory budget of %i bytes is too small for the "
+                         "image blocks." % max_memory)
+
+    block_size = numpy.array([b[best] for b in blocks], dtype=numpy.int64)
+    image_size = numpy.array([c[best] for c in counts], dtype=numpy.int64) * block_size
+
+    return block_size, image_size
+
+
+def find_empty_blocks(mask, block_size, margin):
+    """
+    Find the blocks that do not contain any foreground pixels, within the
+    block itself, or within the given margin around it.
+
+    :param mask: the foreground mask, in the (padded) internal image size
+    :param block_size: the block dimensions
+    :param margin: the margin around the block, on each side, e.g. the block
+                   padding and the PSF half-size
+    :return: a set of block start indexes, as tuples
+    """
+    mask = numpy.asarray(mask).astype(bool)
+
+    # Expand the foreground by the margin, to see the nearby objects as well.
+    if numpy.any(margin):
+        size = tuple(2 * numpy.broadcast_to(margin, (mask.ndim,)) + 1)
+        mask = maximum_filter(mask, size=size, mode='constant')
+
+    iterables = (range(0, m, n) for m, n in zip(mask.shape, block_size))
+
+    empty = set()
+    for idx in itertools.product(*iterables):
+        block_idx = tuple(slice(j, j + k) for j, k in zip(idx, block_size))
+        if not mask[block_idx].any():
+            empty.add(tuple(int(i) for i in idx))
+
+    return empty
+
+
+def _get_local_mean(image, start, stop, halo, kernel_size):
+    """
+    Calculate the local mean of the image, in the region between *start* and
+    *stop*, clipped to the image. The region is read with a halo around it,
+    which means that the result is the same as that of filtering the whole
+    image at once.
+
+    :return: a tuple (local mean, start of the clipped region)
+    """
+    shape = numpy.array(image.shape)
+    start = numpy.clip(start, 0, shape)
+    stop = numpy.clip(stop, 0, shape)
+    read_start = numpy.maximum(start - halo, 0)
+    read_stop = numpy.minimum(stop + halo, shape)
+
+    region = numpy.asarray(image[tuple(slice(i, j) for i, j in zip(read_start, read_stop))],
+                           dtype=numpy.float32)
+    local_mean = uniform_filter(region, size=kernel_size)
+
+    crop = tuple(slice(i, j) for i, j in zip(start - read_start, stop - read_start))
+    return local_mean[crop], start
+
+
+def find_background_blocks(image, block_size, margin, threshold, kernel_size):
+    """
+    Find the blocks that only contain background, within the block itself,
+    or within the given margin around it. This is the same as
+    find_empty_blocks() with the mask of
+    masking.make_noise_level_based_mask(), but the image is processed block
+    by block, so that the local mean of the whole image is never kept in
+    memory.
+
+    The background and noise levels are the median and the median absolute
+    deviation of the local mean. With large images they are estimated from a
+    regular subsample of at most noise_samples_c values.
+
+    :param image: the image, e.g. a numpy.memmap, in the original size
+    :param block_size: the block dimensions
+    :param margin: the margin around the block, on each side
+    :param threshold: the threshold, in units of the noise standard deviation
+    :param kernel_size: the size of the local mean filter
+    :return: a set of block start indexes, as tuples
+    """
+    shape = numpy.array(image.shape)
+    block_size = numpy.array(block_size)
+    margin = numpy.broadcast_to(margin, shape.shape)
+    halo = kernel_size // 2 + 1
+
+    stride = 1
+    while numpy.prod(-(-shape // stride)) > noise_samples_c:
+        stride += 1
+
+    block_starts = [numpy.array(idx) for idx in
+                    itertools.product(*(range(0, m, n) for m, n in zip(shape, block_size)))]
+
+    # The first pass collects the samples on a regular grid, for the
+    # background and noise levels
+    samples = []
+    for start in block_starts:
+        local_mean, start = _get_local_mean(image, start, start + block_size, halo,
+                                            kernel_size)
+        grid = tuple(slice((-i) % stride, None, stride) for i in start)
+        samples.append(local_mean[grid].ravel())
+    samples = numpy.concatenate(samples)
+
+    background = numpy.median(samples)
+    noise = 1.4826 * numpy.median(numpy.abs(samples - background))
+    level = background + threshold * noise
+
+    # The second pass looks for foreground within the margin of every block
+    empty = set()
+    for start in block_starts:
+        local_mean, _ = _get_local_mean(image, start - margin, start + block_size + margin,
+                                        halo, kernel_size)
+        if not (local_mean > level).any():
+            empty.add(tuple(int(i) for i in start))
+
+    return empty
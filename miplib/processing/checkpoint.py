@@ -0,0 +1,79 @@
+"""
+checkpoint.py
+
+This file contains functions for saving the state of the iterative
+deconvolution and fusion algorithms to disk at regular intervals, so
+that an interrupted job can be resumed later on.
+
+A checkpoint consists of the estimate, saved as a .npy file, and a
+small state file that contains the iteration count and the progress
+parameters. The state file is always written last, and it is replaced
+atomically, which means that it never refers to an incomplete estimate.
+"""
+
+import glob
+import os
+
+import numpy
+
+state_file_c = "checkpoint.npz"
+estimate_file_c = "estimate_%i.npy"
+estimate_glob_c = "estimate_*.npy"
+
+
+def save_checkpoint(directory, estimate, iteration_count, progress_parameters):
+    """
+    Save a checkpoint. The estimates of older checkpoints in the same
+    directory are removed after the new checkpoint has been saved.
+
+    :param directory: the checkpoint directory; created if it does not exist
+    :param estimate: the current estimate, a numpy.ndarray or its subclass
+    :param iteration_count: the number of completed iterations
+    :param progress_parameters: the progress parameter array of the iteration
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    estimate_name = estimate_file_c % iteration_count
+    estimate_path = os.path.join(directory, estimate_name)
+
+    # numpy.save adds the .npy suffix, unless the file name already has it
+    temp_path = os.path.join(directory, "estimate.tmp.npy")
+    numpy.save(temp_path, numpy.asarray(estimate))
+    os.replace(temp_path, estimate_path)
+
+    temp_path = os.path.join(directory, "checkpoint.tmp.npz")
+    numpy.savez(temp_path,
+                iteration_count=iteration_count,
+                estimate_file=estimate_name,
+                shape=numpy.array(estimate.shape),
+                progress_parameters=progress_parameters[:iteration_count])
+    os.replace(temp_path, os.path.join(directory, state_file_c))
+
+    for path in glob.glob(os.path.join(directory, estimate_glob_c)):
+        if os.path.basename(path) != estimate_name:
+            os.remove(path)
+
+
+def load_checkpoint(directory):
+    """
+    Load the last checkpoint from the given directory.
+
+    :param directory: the checkpoint directory
+    :return: a tuple (estimate, iteration_count, progress_parameters). The
+             estimate is memory mapped from the checkpoint file.
+    """
+    state_path = os.path.join(directory, state_file_c)
+    if not os.path.exists(state_path):
+        raise ValueError("No checkpoint was found in %s" % directory)
+
+    with numpy.load(state_path) as state:
+        iteration_count = int(state["iteration_count"])
+        estimate_name = str(state["estimate_file"])
+        shape = tuple(state["shape"])
+        progress_parameters = state["progress_parameters"]
+
+    estimate = numpy.load(os.path.join(directory, estimate_name), mmap_mode='r')
+    assert estimate.shape == shape
+
+    return estimate, iteration_count, progress_parameters
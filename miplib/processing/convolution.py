@@ -0,0 +1,114 @@
+"""
+convolution.py
+
+This file contains a FFT based convolution engine for iterative image
+restoration algorithms, in which the same kernel (PSF) is convolved
+with many image blocks, over and over again. The Fourier transform of the
+kernel (OTF) is calculated only once for each block shape and reused
+after that.
+"""
+
+import numpy
+from scipy.fft import rfftn, irfftn, next_fast_len
+
+
+class FourierConvolver(object):
+    """
+    Real-to-complex FFT convolution with a fixed kernel. The results are
+    equivalent to scipy.signal.fftconvolve(block, psf, mode='same'). The
+    exact adjoint of convolve() is implemented with the complex conjugate
+    of the OTF, which means that the kernel only needs to be transformed
+    once. For odd-sized kernels the adjoint is the same as the 'same' mode
+    convolution with the mirrored kernel, psf[::-1]. For even-sized kernels
+    it is shifted by one voxel along the even axes, compared to
+    fftconvolve(block, psf[::-1], mode='same'), as the mirrored kernel is
+    no longer centered at the same voxel.
+
+    The blocks may have leading (batch) axes in addition to the kernel
+    axes, in which case the same OTF is applied to every image in the
+    stack, in a single FFT call.
+    """
+
+    def __init__(self, psf, workers=1):
+        """
+        :param psf: the convolution kernel, a numpy.ndarray
+        :param workers: the number of threads to use in a single FFT
+        """
+        self.psf = numpy.asarray(psf, dtype=numpy.float32)
+        self.ndim = self.psf.ndim
+        self.workers = workers
+
+        self._otfs = {}
+
+    def get_otf(self, shape):
+        """
+        Get the OTF that corresponds to the given (padded) block shape. The
+        OTF is calculated at first request, and cached after that.
+
+        :param shape: the shape of the block that is to be convolved, without
+                      the leading batch axes
+        :return: a tuple (fft_shape, otf, adj_otf), in which fft_shape is
+                 the FFT friendly shape the transforms are calculated at.
+        """
+        shape = tuple(int(i) for i in shape)
+        if shape not in self._otfs:
+            assert len(shape) == self.ndim
+
+            # Pad to avoid circular wrap-around, rounding up to a fast length
+            fft_shape = tuple(next_fast_len(s + p - 1, real=True)
+                              for s, p in zip(shape, self.psf.shape))
+
+            # The kernel is centered at the origin, in order to produce the
+            # same alignment as the "same" mode in scipy fftconvolve
+            kernel = numpy.zeros(fft_shape, dtype=numpy.float32)
+            kernel[tuple(slice(0, p) for p in self.psf.shape)] = self.psf
+            kernel = numpy.roll(kernel,
+                                tuple(-((p - 1) // 2) for p in self.psf.shape),
+                                axis=tuple(range(self.ndim)))
+
+            otf = rfftn(kernel)
+            self._otfs[shape] = (fft_shape, otf, otf.conj())
+
+        return self._otfs[shape]
+
+    def convolve(self, block, out=None):
+        """
+        Convolve a block with the kernel.
+
+        :param block: a numpy.ndarray
+        :param out: an optional array for the result, of the same shape as
+                    the block. It may be the block itself.
+        :return: the convolution result, of the same shape as the block
+        """
+        fft_shape, otf, _ = self.get_otf(block.shape[block.ndim - self.ndim:])
+        return self.__filter(block, fft_shape, otf, self.workers, out)
+
+    def convolve_adjoint(self, block, out=None):
+        """
+        Apply the exact adjoint of the convolve() operation, i.e. a
+        correlation with the kernel. See the class documentation for how
+        it differs from a convolution with the mirrored kernel, when the
+        kernel has an even size.
+
+        :param block: a numpy.ndarray
+        :param out: an optional array for the result, of the same shape as
+                    the block. It may be the block itself.
+        :return: the convolution result, of the same shape as the block
+        """
+        fft_shape, _, adj_otf = self.get_otf(block.shape[block.ndim - self.ndim:])
+        return self.__filter(block, fft_shape, adj_otf, self.workers, out)
+
+    @staticmethod
+    def __filter(block, fft_shape, otf, workers, out):
+        axes = tuple(range(-len(fft_shape), 0))
+        spectrum = rfftn(numpy.asarray(block, dtype=numpy.float32), fft_shape,
+                         axes=axes, workers=workers)
+        spectrum *= otf
+        result = irfftn(spectrum, fft_shape, axes=axes, workers=workers)
+        result = result[(Ellipsis,) + tuple(slice(0, s) for s in block.shape[-len(fft_shape):])]
+
+        if out is None:
+            return result
+
+        out[:] = result
+        return out
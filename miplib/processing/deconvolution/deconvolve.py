@@ -16,13 +16,16 @@ in the Anaconda Accelerate package.
 
 """
 
+import copy
 import itertools
 import os
 import shutil
 import sys
 import tempfile
+import threading
 import time
 import pandas
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy
 import miplib.processing.ops_ext as ops_ext
@@ -32,6 +35,13 @@ from scipy.signal import fftconvolve, medfilt
 
 import miplib.processing.to_string as ops_output
 import miplib.processing.ndarray
+import miplib.processing.image as imops
+from miplib.processing.convolution import FourierConvolver
+from miplib.processing import blocks
+from miplib.processing.acceleration import BiggsAndrewsAcceleration
+from miplib.processing import checkpoint
+from miplib.processing import process_pool
+from miplib.processing import timing
 from miplib.data.containers import temp_data
 from miplib.data.containers.image import Image
 from miplib.data.messages.image_writer_wrappers import ImageWriterBase
@@ -50,25 +60,50 @@ class DeconvolutionRL(object):
     def __init__(self, image, psf, writer, options):
         """
         :param image:    a MyImage object
-
+        :param psf:      the PSF as an Image object, or a list of PSFs for
+                         a depth-variant deconvolution. The PSFs of the list
+                         are measured (or calculated) at the z positions
+                         given with --psf-depths.
         :param options: command line options that control the behavior
                         of the fusion algorithm
         """
         assert isinstance(image, Image)
-        assert isinstance(psf, Image)
         if options.save_intermediate_results:
             assert issubclass(writer.__class__, ImageWriterBase)
 
+        # With a list of PSFs, the PSF varies along the z axis.
+        if isinstance(psf, (list, tuple)):
+            assert all(isinstance(i, Image) for i in psf)
+            if image.ndim != 3:
+                raise ValueError("A depth-variant PSF needs a 3D image")
+            if options.update_blind_psf > 0:
+                raise NotImplementedError("Blind PSF updates are not supported "
+                                          "with a depth-variant PSF")
+            self.psf_bank = list(psf)
+            psf = self.psf_bank[len(self.psf_bank) // 2]
+        else:
+            self.psf_bank = None
+        assert isinstance(psf, Image)
+
         self.image = image
         self.psf = psf
         self.options = options
         self.writer = writer
 
+        # With the process pool backend, the image and the estimates are
+        # shared with the worker processes through memory mapped files.
+        self.use_processes = options.parallel_backend == 'process'
+        if self.use_processes and options.update_blind_psf > 0:
+            raise NotImplementedError("Blind PSF updates are not supported with "
+                                      "the process backend")
+
         self.image_size = numpy.array(self.image.shape)
         self.image_spacing = self.image.spacing
         self.psf_spacing = self.psf.spacing
         self.imdims = image.ndim
+        self.original_size = self.image.shape
 
+        self.fft_workers = 1
         self.__get_psfs()
 
         if options.verbose:
@@ -79,11 +114,23 @@ class DeconvolutionRL(object):
         # Setup blocks
         self.num_blocks = options.num_blocks
         self.block_size, self.image_size = self.__calculate_block_and_image_size()
+        self.num_blocks = int(numpy.prod(self.image_size // self.block_size))
         self.memmap_directory = tempfile.mkdtemp()
 
+        # The internal image size may have been padded to a multiple of
+        # the block size. The image itself is not padded (it may be memory
+        # mapped from a file); the image blocks are zero filled outside of it
+        # in get_padded_block().
+
+        # With a single block, the worker threads are used in the FFTs instead.
+        if self.num_blocks == 1:
+            self.fft_workers = max(self.options.num_workers, 1)
+            for convolver in self.convolvers:
+                convolver.workers = self.fft_workers
+
         # Memmap the estimates to reduce memory requirements. This will slow
         # down the fusion process considerably..
-        if self.options.memmap_estimates:
+        if self.options.memmap_estimates or self.use_processes:
             estimate_new_f = os.path.join(self.memmap_directory, "estimate_new.dat")
             self.estimate_new = Image(numpy.memmap(estimate_new_f, dtype='float32',
                                                    mode='w+',
@@ -99,13 +146,44 @@ class DeconvolutionRL(object):
             self.estimate_new = Image(numpy.zeros(tuple(self.image_size),
                                                   dtype=numpy.float32), self.image_spacing)
 
-        if not self.options.disable_tau1:
-            prev_estimate_f = os.path.join(self.memmap_directory, "prev_estimate.dat")
-            self.prev_estimate = Image(numpy.memmap(prev_estimate_f, dtype=numpy.float32,
-                                                    mode='w+',
-                                                    shape=tuple(self.image_size)), self.image_spacing)
+        # The L1 change and norm of the estimate in the last update, for
+        # the tau1 stopping criterion. They are accumulated by the update
+        # kernel, so that a copy of the previous estimate is not needed.
+        self.estimate_change = (0.0, 0.0)
+
+        # Vector extrapolation based acceleration of the RL iteration
+        self.accelerator = self.__get_accelerator()
 
         padded_block_size = tuple(i + 2 * self.options.block_pad for i in self.block_size)
+
+        # Pre-calculate the OTFs for the padded block shape
+        for convolver in self.convolvers:
+            convolver.get_otf(padded_block_size)
+
+        # The weights of the PSFs of a depth-variant PSF bank, at each z
+        # position of the padded internal image.
+        self.psf_weights = None
+        if self.psf_bank is not None:
+            self.psf_weights = self.__get_psf_weights()
+
+        # The block buffers are allocated once for each worker thread. The
+        # worker threads are kept alive during the whole deconvolution.
+        self._block_buffers = threading.local()
+        self.pool = None
+        if self.options.num_workers > 1 and self.num_blocks > 1 and not self.use_processes:
+            self.executor = ThreadPoolExecutor(max_workers=self.options.num_workers)
+        else:
+            self.executor = None
+
+        # Find the blocks that only contain background. These are updated
+        # without the convolutions.
+        self.background_blocks = set()
+        if self.options.skip_background_blocks > 0 and self.num_blocks > 1:
+            self.background_blocks = self.__find_background_blocks()
+            if options.verbose:
+                print("%i of the %i blocks are background" % (len(self.background_blocks),
+                                                             self.num_blocks))
+
         if options.verbose:
             print("The deconvolution will be run with %i blocks" % self.num_blocks)
             print("The internal block size is %s" % (padded_block_size,))
@@ -113,13 +191,32 @@ class DeconvolutionRL(object):
         # Create temporary directory and data file.
         self.column_headers = ('t', 'tau1', 'leak', 'e',
                              's', 'u', 'n', 'uesu')
+
+        # The resolution is only recorded with the FRC based stopping
+        if self.options.rl_frc_stop > 0:
+            self.column_headers += ('resolution',)
+
+        # Optional per-phase timing of the iterations. The bytes read are
+        # counted for the blocks that are copied from memory mapped images.
+        self.timer = timing.PhaseTimer(enabled=self.options.profile_phases)
+        if self.options.profile_phases:
+            self.column_headers += timing.column_headers_c
+        block_bytes = numpy.prod(padded_block_size) * numpy.dtype(numpy.float32).itemsize
+        self.block_read_bytes = block_bytes * (
+            int(self.__is_memory_mapped(self.image)) +
+            int(self.__is_memory_mapped(self.estimate) and self.options.block_pad > 0))
         self._progress_parameters = numpy.empty((self.options.max_nof_iterations, len(self.column_headers)),
                                                 dtype=numpy.float32)
 
-        # Get initial resolution (in case you are using the FRC based stopping.)
+        # Prepare the FRC based stopping. The FRC window and ring indexes are
+        # calculated only once, for the (optionally cropped) image area.
+        self.frc_curves = {}
         if self.options.rl_frc_stop > 0:
-            self.resolution = frc.calculate_single_image_frc(self.image, 
-                self.options).resolution["resolution"]
+            frc_shape = tuple(min(self.options.rl_frc_crop, n) if self.options.rl_frc_crop > 0
+                              else n for n in self.original_size)
+            self.frc_idx = tuple(slice((n - m) // 2, (n - m) // 2 + m)
+                                 for n, m in zip(self.original_size, frc_shape))
+            self.frc_monitor = frc.SingleImageFRC(frc_shape, self.image_spacing, self.options)
 
         # Enable automatic background correction with --rl-auto-background
         if self.options.rl_auto_background:
@@ -128,6 +225,12 @@ class DeconvolutionRL(object):
             masked_image = Image(image * background_mask, image.spacing)
             self.options.rl_background = numpy.mean(masked_image[masked_image > 0])
 
+        # The worker processes are started last, as they get a copy of the
+        # state. They are kept alive during the whole deconvolution.
+        if self.use_processes:
+            self.pool = process_pool.WorkerPool(type(self), self.__get_worker_state(),
+                                                max(self.options.num_workers, 1))
+
     @property
     def progress_parameters(self):
         return pandas.DataFrame(data=self._progress_parameters, columns=self.column_headers)
@@ -143,64 +246,432 @@ class DeconvolutionRL(object):
 
         self.estimate_new[:] = numpy.float32(0)
 
-        # Iterate over blocks
-        block_nr = 1
+        # Iterate over blocks. The blocks are independent of each other
+        # (each one writes to a separate slice of the self.estimate_new),
+        # which is why they can be processed in parallel.
         iterables = (range(0, m, n) for m, n in zip(self.image_size, self.block_size))
-        pad = self.options.block_pad
-        cache_idx = tuple(slice(pad, pad + block) for block in self.block_size)
 
-        for idx in itertools.product(*iterables):
+        if self.pool is not None:
+            block_indexes = list(itertools.product(*iterables))
+            for events in self.pool.map('_compute_block_in_worker', block_indexes,
+                                        [self.iteration_count] * len(block_indexes)):
+                self.timer.merge(events)
+        elif self.executor is not None:
+            # Consume the results, to re-raise any exceptions from the workers
+            list(self.executor.map(self.__compute_block, itertools.product(*iterables)))
+        else:
+            for idx in itertools.product(*iterables):
+                self.__compute_block(idx)
+
+        with self.timer.phase('update'):
+            if self.pool is not None:
+                # The statistics of the slabs are summed up
+                statistics = self.pool.map_slabs('_update_estimate_slab', self.estimate.shape[0])
+                e, s, u, n, change, norm = numpy.sum(statistics, axis=0)
+            else:
+                e, s, u, n, change, norm = ops_ext.update_estimate_poisson_tau1(
+                    self.estimate, self.estimate_new, self.options.convergence_epsilon)
+
+        self.estimate_change = (change, norm)
+        return e, s, u, n
 
-            estimate_idx = tuple(slice(j, j+k) for j, k in zip(idx, self.block_size))
+    def __get_worker_state(self):
+        """
+        Get the attributes that are copied to the worker processes. The image
+        and the estimates are shared through memory mapped files; the image
+        is copied into a file, if it is not memory mapped already.
+        """
+        excluded = ('executor', 'pool', 'writer', 'accelerator', 'frc_monitor',
+                    'timer', '_block_buffers')
+        state = dict((key, value) for key, value in self.__dict__.items()
+                     if key not in excluded)
+
+        state['image'] = process_pool.share_array(self.image, self.memmap_directory,
+                                                  "image.dat")
+        state['estimate'] = process_pool.MemmapReference(self.estimate)
+        state['estimate_new'] = process_pool.MemmapReference(self.estimate_new)
 
-            index = numpy.array(idx, dtype=int)
+        return state
 
+    def _setup_worker(self):
+        """
+        Finish the initialization of the algorithm object in a worker process.
+        """
+        self._block_buffers = threading.local()
+        self.timer = timing.PhaseTimer(enabled=self.options.profile_phases)
+
+    def _compute_block_in_worker(self, idx, iteration_count):
+        """
+        Calculate the RL update of a single block in a worker process.
+
+        :param idx: the block start index, not considering the padding
+        :param iteration_count: the current iteration
+        :return: the phase timing events of the block
+        """
+        self.iteration_count = iteration_count
+        self.timer.reset()
+        self.__compute_block(idx)
+
+        return self.timer.events
+
+    def _update_estimate_slab(self, start, stop):
+        """
+        Apply the RL update to a slab of the estimate in a worker process.
+
+        :param start: the start index of the slab, on the first axis
+        :param stop: the stop index of the slab
+        :return: the e, s, u, n statistics of the slab, and the L1 change
+                 and norm of the estimate
+        """
+        return ops_ext.update_estimate_poisson_tau1(self.estimate[start:stop],
+                                                    self.estimate_new[start:stop],
+                                                    self.options.convergence_epsilon)
+
+    def __compute_block(self, idx):
+        """
+        Calculates the RL update for a single block and saves it into the
+        self.estimate_new.
+
+        :param idx: the block start index, not considering the padding
+        """
+        estimate_idx = tuple(slice(j, j+k) for j, k in zip(idx, self.block_size))
+
+        if idx in self.background_blocks:
+            with self.timer.phase('update', idx):
+                self.__compute_background_block(estimate_idx)
+            if self.options.tv_lambda > 0 and self.iteration_count > 0:
+                with self.timer.phase('tv', idx):
+                    self.estimate_new[estimate_idx] = self.__regularize_block(
+                        idx, self.estimate_new[estimate_idx])
+            return
+
+        pad = self.options.block_pad
+        cache_idx = tuple(slice(pad, pad + block) for block in self.block_size)
+
+        index = numpy.array(idx, dtype=int)
+        buffers = self.__get_block_buffers()
+
+        with self.timer.phase('read', idx, self.block_read_bytes):
             if self.options.block_pad > 0:
                 estimate_block = self.get_padded_block(
-                    self.estimate, index.copy())
-                image_block = self.get_padded_block(self.image, index.copy())
+                    self.estimate, index.copy(), out=buffers.estimate)
             else:
                 estimate_block = self.estimate[estimate_idx]
-                image_block = self.image[estimate_idx]
 
-            # print "The current block is %i" % block_nr
-            block_nr += 1
-
-            # Execute: cache = convolve(PSF, estimate), non-normalized
-            cache = fftconvolve(estimate_block, self.psf, mode='same')
+            image_block = self.get_padded_block(self.image, index.copy(),
+                                                out=buffers.image)
+
+        # With a depth-variant PSF, the PSFs that overlap the block in z
+        # are blended with the interpolation weights of the block's z range.
+        # The PSFs with a zero weight in the whole block are left out, and
+        # a block that is covered by a single PSF is convolved as usual.
+        weights = None
+        convolvers = [self.convolver]
+        if self.psf_weights is not None:
+            weights = self.psf_weights[:, idx[0]:idx[0] + buffers.cache.shape[0]]
+            active = numpy.flatnonzero(weights.any(axis=1))
+            convolvers = [self.convolvers[k] for k in active]
+            weights = weights[active]
+            if len(active) == 1:
+                weights = None
+
+        # Execute: cache = convolve(PSF, estimate), non-normalized
+        with self.timer.phase('forward_fft', idx):
+            if weights is None:
+                cache = convolvers[0].convolve(estimate_block, out=buffers.cache)
+            else:
+                cache = self.__convolve_depth_variant(
+                    convolvers, weights, estimate_block, buffers)
 
             if self.options.rl_background != 0:
                 cache += self.options.rl_background
 
-                # ops_ext.inverse_division_inplace(cache, image_block)
-            with numpy.errstate(divide="ignore"):
-                cache = image_block.astype(numpy.float32) / cache
-                cache[cache == numpy.inf] = 0.0
-                cache = numpy.nan_to_num(cache)
-
-            # Execute: cache = convolve(PSF(-), cache), inverse of non-normalized
-            # Convolution with virtual PSFs is performed here as well, if
-            # necessary
-            cache = fftconvolve(cache, self.adj_psf, mode='same')
+        # Execute: cache = image/cache, with zero where either one is zero
+        with self.timer.phase('ratio', idx):
+            ops_ext.inverse_division_inplace(cache, image_block)
 
-            self.estimate_new[estimate_idx] = cache[cache_idx]
+        # Execute: cache = convolve(PSF(-), cache), inverse of non-normalized
+        # Convolution with virtual PSFs is performed here as well, if
+        # necessary
+        with self.timer.phase('adjoint_fft', idx):
+            if weights is None:
+                cache = convolvers[0].convolve_adjoint(cache, out=cache)
+            else:
+                cache = self.__convolve_adjoint_depth_variant(
+                    convolvers, weights, cache, buffers)
 
         if self.options.tv_lambda > 0 and self.iteration_count > 0:
-            if self.estimate.ndim == 2:
-                spacing = list(self.image_spacing)
-                spacing.insert(0,1)
-                dv_est = ops_ext.div_unit_grad(numpy.expand_dims(self.estimate, 0),
-                                               spacing)[0]
+            with self.timer.phase('tv', idx):
+                cache = self.__regularize_block(idx, cache[cache_idx])
+        else:
+            cache = cache[cache_idx]
+
+        with self.timer.phase('update', idx):
+            self.estimate_new[estimate_idx] = cache
+
+    @staticmethod
+    def __convolve_depth_variant(convolvers, weights, block, buffers):
+        """
+        The forward model of a depth-variant PSF: the estimate is split
+        between the PSFs with their z weights, and the convolutions are
+        summed up.
+
+        :param convolvers: the convolvers of the PSFs that overlap the block
+        :param weights: the z weights of the PSFs in the padded block
+        :param block: the padded estimate block
+        :param buffers: the block buffers of the calling thread
+        :return: the convolution result, in buffers.cache
+        """
+        result = buffers.cache
+        for k, convolver in enumerate(convolvers):
+            numpy.multiply(block, weights[k][:, None, None], out=buffers.weighted)
+            convolver.convolve(buffers.weighted, out=buffers.weighted)
+            if k == 0:
+                result[:] = buffers.weighted
             else:
-                dv_est = ops_ext.div_unit_grad(self.estimate, self.image_spacing)
-            with numpy.errstate(divide="ignore"):
-                self.estimate_new /= (1.0 - self.options.tv_lambda * dv_est)
-                self.estimate_new[self.estimate_new == numpy.inf] = 0.0
-                self.estimate_new[:] = numpy.nan_to_num(self.estimate_new)
+                result += buffers.weighted
+
+        return result
+
+    @staticmethod
+    def __convolve_adjoint_depth_variant(convolvers, weights, block, buffers):
+        """
+        The adjoint of __convolve_depth_variant(): the adjoint convolutions
+        of the block are weighted with the z weights of each PSF, and summed
+        up. The block may be buffers.cache, in which the result is saved.
+        """
+        result = buffers.estimate
+        for k, convolver in enumerate(convolvers):
+            convolver.convolve_adjoint(block, out=buffers.weighted)
+            buffers.weighted *= weights[k][:, None, None]
+            if k == 0:
+                result[:] = buffers.weighted
+            else:
+                result += buffers.weighted
+
+        buffers.cache[:] = result
+        return buffers.cache
+
+    def __get_psf_weights(self):
+        """
+        Calculate the weights of the PSFs of a depth-variant PSF bank along
+        the z axis of the padded internal image. The PSF is interpolated
+        linearly between the depths of two neighbouring PSFs; above the
+        first and below the last depth, the nearest PSF is used. The
+        weights do not depend on the block layout, which is why the blocks
+        give the same result as a single block would.
+
+        :return: an array of shape (number of PSFs, padded z size); the
+                 first element is at z = -block_pad.
+        """
+        depths = numpy.array(self.options.psf_depths, dtype=numpy.float64)
+        if depths.size != len(self.convolvers):
+            raise ValueError("%i PSF depths were given for %i PSFs" % (
+                depths.size, len(self.convolvers)))
+        if (numpy.diff(depths) <= 0).any():
+            raise ValueError("The PSF depths should be in increasing order")
+
+        # The depths are given in the image units
+        depths /= self.image_spacing[0]
+
+        pad = self.options.block_pad
+        z = numpy.arange(-pad, self.image_size[0] + pad, dtype=numpy.float64)
+        weights = numpy.array([numpy.interp(z, depths, onehot)
+                               for onehot in numpy.eye(depths.size)])
+
+        return weights.astype(numpy.float32)
+
+    def __regularize_block(self, idx, block):
+        """
+        Apply the total variation regularization to the RL update of a single
+        block. The divergence is calculated from the current estimate, with
+        a one voxel halo around the block. At the image boundaries the halo
+        is filled by repeating the edge voxels, which gives the same result
+        as calculating the divergence for the whole estimate at once.
+
+        :param idx: the block start index, not considering the padding
+        :param block: the RL update of the block, without the padding
+        :return: the regularized update
+        """
+        start = numpy.array(idx) - 1
+        stop = start + self.block_size + 2
+        image_start = numpy.maximum(start, 0)
+        image_stop = numpy.minimum(stop, self.image_size)
+
+        halo = self.estimate[tuple(slice(i, j) for i, j in zip(image_start, image_stop))]
+        halo = numpy.pad(numpy.asarray(halo, dtype=numpy.float32),
+                         tuple(zip(image_start - start, stop - image_stop)), mode='edge')
+
+        if halo.ndim == 2:
+            spacing = list(self.image_spacing)
+            spacing.insert(0, 1)
+            dv_est = ops_ext.div_unit_grad(numpy.expand_dims(halo, 0), spacing)[0]
+        else:
+            dv_est = ops_ext.div_unit_grad(halo, self.image_spacing)
+        dv_est = dv_est[(slice(1, -1),) * halo.ndim]
+
+        with numpy.errstate(divide="ignore"):
+            block = block / (1.0 - self.options.tv_lambda * dv_est)
+            block[block == numpy.inf] = 0.0
 
-        return ops_ext.update_estimate_poisson(self.estimate,
-                                               self.estimate_new,
-                                               self.options.convergence_epsilon)
+        return numpy.nan_to_num(block, copy=False)
+
+    def __get_pyramid_estimate(self):
+        """
+        Coarse-to-fine initialization. The image is downsampled by two, and
+        deconvolved with --pyramid-iterations iterations -- recursively with
+        the same method, until --pyramid-levels is reached. The coarse result
+        is then upsampled to the original image size, and scaled to the
+        photon count of the image, to be used as the first estimate. The
+        coarse iterations are cheap: a 2x downsampled 3D image has 8x fewer
+        voxels.
+
+        The image is resampled with imops.halve_sampling() and
+        imops.double_sampling(), instead of imops.resize(), as the grids of
+        the two levels need to be aligned at the pixel centers, and the
+        image is smoothed before the downsampling.
+        """
+        coarse_image = imops.halve_sampling(Image(self.image, self.image_spacing))
+        coarse_spacing = coarse_image.spacing
+
+        # The PSF is sampled so that its center stays at a pixel center.
+        def halve_psf(psf):
+            psf_center = tuple((i - 1) // 2 for i in psf.shape)
+            psf = Image(psf[tuple(slice(i % 2, None) for i in psf_center)],
+                        self.image_spacing)
+            return imops.halve_sampling(psf)
+
+        if self.psf_bank is None:
+            psf = halve_psf(self.psf)
+        else:
+            psf = [halve_psf(convolver.psf) for convolver in self.convolvers]
+
+        options = copy.copy(self.options)
+        options.pyramid_levels -= 1
+        options.max_nof_iterations = self.options.pyramid_iterations
+        options.save_intermediate_results = False
+        options.checkpoint_dir = None
+        options.resume = False
+        options.update_blind_psf = 0
+        options.rl_frc_stop = 0
+        options.rl_auto_background = False
+        options.profile_phases = False
+        options.profile_trace = None
+
+        if self.options.verbose:
+            print("Calculating the first estimate at %s spacing" % (coarse_spacing,))
+
+        task = DeconvolutionRL(coarse_image, psf, None, options)
+        task.execute()
+        coarse_estimate = task.get_result()
+        estimate = imops.double_sampling(coarse_estimate, tuple(self.original_size))
+        task.close()
+
+        # Optionally, the details that were lost in the downsampling are
+        # restored from the image: estimate *= image / upsampled(downsampled(image))
+        if self.options.pyramid_detail:
+            detail = imops.double_sampling(coarse_image, tuple(self.original_size))
+            ops_ext.inverse_division_inplace(detail, numpy.ascontiguousarray(self.image, dtype=numpy.float32))
+            estimate *= detail
+
+        estimate_sum = estimate.sum(dtype=numpy.float64)
+        if estimate_sum > 0:
+            estimate *= numpy.float32(self.image[:].sum(dtype=numpy.float64) / estimate_sum)
+
+        return estimate
+
+    def __copy_in_chunks(self, source, destination):
+        """
+        Copy an image into another, one block row at a time, in order to avoid
+        full size temporary arrays with memory mapped images. The source may
+        be smaller than the destination, in which case the rest of the
+        destination is filled with zeros.
+        """
+        step = int(self.block_size[0])
+        for start in range(0, destination.shape[0], step):
+            chunk = source[start:start + step]
+            if chunk.shape == destination[start:start + step].shape:
+                destination[start:start + step] = chunk
+            else:
+                destination[start:start + step] = numpy.float32(0)
+                destination[(slice(start, start + chunk.shape[0]),) +
+                            tuple(slice(0, s) for s in chunk.shape[1:])] = chunk
+
+    def __calculate_tau1(self):
+        """
+        Calculate the relative change of the estimate during the last
+        iteration. Without acceleration, the change is accumulated in the
+        update step. With acceleration, the estimate is compared to the
+        estimate before the prediction, which is saved by the accelerator,
+        one block row at a time.
+        """
+        if self.accelerator is None:
+            change, total = self.estimate_change
+            return change / total
+
+        step = int(self.block_size[0])
+        change = 0.0
+        total = 0.0
+        for start in range(0, self.estimate.shape[0], step):
+            estimate = self.estimate[start:start + step]
+            prev_estimate = self.accelerator.previous[start:start + step]
+            change += numpy.abs(estimate - prev_estimate).sum(dtype=numpy.float64)
+            total += numpy.abs(prev_estimate).sum(dtype=numpy.float64)
+
+        return change / total
+
+    def __get_block_buffers(self):
+        """
+        Get the padded block buffers of the calling thread. The buffers are
+        allocated at first call.
+        """
+        buffers = self._block_buffers
+        if not hasattr(buffers, "cache"):
+            block_size = tuple(i + 2 * self.options.block_pad for i in self.block_size)
+            buffers.estimate = numpy.empty(block_size, dtype=numpy.float32)
+            buffers.image = numpy.empty(block_size, dtype=numpy.float32)
+            buffers.cache = numpy.empty(block_size, dtype=numpy.float32)
+            if self.psf_weights is not None:
+                buffers.weighted = numpy.empty(block_size, dtype=numpy.float32)
+
+        return buffers
+
+    def __compute_background_block(self, estimate_idx):
+        """
+        A closed-form update for a block that only contains background. The
+        blurring has no effect on a (nearly) flat block, which is why the
+        RL update reduces to a single factor that matches the photon count
+        of the estimate to that of the image. The photon counts are taken
+        over the part of the block that is within the original image, for
+        both the image and the estimate; the padding of the internal image
+        would otherwise bias the factor of the edge blocks.
+
+        :param estimate_idx: the block index, without the padding
+        """
+        image_idx = tuple(slice(i.start, min(i.stop, n))
+                          for i, n in zip(estimate_idx, self.original_size))
+        image_block = self.image[image_idx]
+        image_sum = image_block.sum(dtype=numpy.float64)
+        estimate_sum = self.estimate[image_idx].sum(dtype=numpy.float64) + \
+            self.options.rl_background * image_block.size
+
+        if estimate_sum > 0:
+            self.estimate_new[estimate_idx] = numpy.float32(image_sum / estimate_sum)
+        else:
+            self.estimate_new[estimate_idx] = numpy.float32(0)
+
+    def __find_background_blocks(self):
+        """
+        Classify the blocks based on their signal content, with a local
+        noise level based mask. A block is considered background, if there
+        is no foreground within the reach of the PSF and the block padding.
+        The image is classified block by block, as it may not fit in memory.
+        """
+        margin = numpy.array(self.psf.shape) // 2 + self.options.block_pad
+
+        return blocks.find_background_blocks(self.image, self.block_size, margin,
+                                             threshold=self.options.skip_background_blocks,
+                                             kernel_size=max(self.psf.shape))
 
     def execute(self):
         """
@@ -211,14 +682,23 @@ class DeconvolutionRL(object):
 
         first_estimate = self.options.first_estimate
 
+        image_idx = self.__get_original_idx()
+
         if first_estimate == 'image':
-            self.estimate[:] = self.image[:].astype(numpy.float32)
+            self.__copy_in_chunks(self.image, self.estimate)
         elif first_estimate == 'blurred':
-            self.estimate[:] = uniform_filter(self.image, 3).astype(numpy.float32)
+            self.estimate[:] = numpy.float32(0)
+            self.estimate[image_idx] = uniform_filter(self.image, 3).astype(numpy.float32)
         elif first_estimate == 'image_mean':
             self.estimate[:] = numpy.float32(numpy.mean(self.image[:]))
         elif first_estimate == 'constant':
             self.estimate[:] = numpy.float32(self.options.estimate_constant)
+        elif first_estimate == 'pyramid':
+            if self.options.pyramid_levels > 1:
+                self.estimate[:] = numpy.float32(0)
+                self.estimate[image_idx] = self.__get_pyramid_estimate()
+            else:
+                self.__copy_in_chunks(self.image, self.estimate)
         else:
             raise NotImplementedError(repr(first_estimate))
 
@@ -226,6 +706,9 @@ class DeconvolutionRL(object):
         max_count = self.options.max_nof_iterations
         initial_photon_count = self.image[:].sum()
 
+        if self.accelerator is not None:
+            self.accelerator.reset()
+
         bar = ops_output.ProgressBar(0,
                                      max_count,
                                      totalWidth=40,
@@ -233,7 +716,16 @@ class DeconvolutionRL(object):
 
         self._progress_parameters = numpy.zeros((self.options.max_nof_iterations, len(self.column_headers)),
                                                 dtype=numpy.float32)
+        self.timer.reset()
 
+        # Get initial resolution (in case you are using the FRC based stopping.)
+        if self.options.rl_frc_stop > 0:
+            self.frc_curves = {}
+            self.resolution = self.__calculate_resolution(self.image)
+
+        # Continue from the last checkpoint, if requested
+        if self.options.resume:
+            self.__load_checkpoint()
 
         # duofrc_prev = 0
         # The Fusion calculation starts here
@@ -249,20 +741,27 @@ class DeconvolutionRL(object):
                     self.psf = frc_psf.generate_frc_based_psf(Image(self.estimate, self.image_spacing), self.options)
                     self.__get_psfs()
                     self.image = self.estimate.copy()
+                    if self.accelerator is not None:
+                        self.accelerator.reset()
 
                 info_map = {}
                 ittime = time.time()
+                self.timer.iteration = self.iteration_count
 
-                self.prev_estimate[:] = self.estimate.copy()
+                if self.accelerator is not None:
+                    self.accelerator.predict(self.estimate)
 
                 e, s, u, n = self.compute_estimate()
 
+                if self.accelerator is not None:
+                    self.accelerator.update(self.estimate)
+
                 self.iteration_count += 1
                 photon_leak = 1.0 - (e + s + u) / initial_photon_count
                 u_esu = u / (e + s + u)
 
-                tau1 = abs(self.estimate - self.prev_estimate).sum() / abs(
-                    self.prev_estimate).sum()
+                with self.timer.phase('tau1'):
+                    tau1 = numpy.nan if self.options.disable_tau1 else self.__calculate_tau1()
                 info_map['TAU1=%s'] = tau1
 
                 t = time.time() - ittime
@@ -279,9 +778,24 @@ class DeconvolutionRL(object):
                     bar(self.iteration_count)
                     print()
 
-                # Save parameters to file
-                self._progress_parameters[self.iteration_count - 1] = (t, tau1, leak, e, s, u, n, u_esu)
+                # The FRC is evaluated only every --rl-frc-interval iterations
+                resolution = numpy.nan
+                if self.options.rl_frc_stop > 0 and \
+                        self.iteration_count % max(self.options.rl_frc_interval, 1) == 0:
+                    resolution = self.__calculate_resolution(self.estimate)
 
+                # Save parameters to file
+                progress = (t, tau1, leak, e, s, u, n, u_esu)
+                if self.options.rl_frc_stop > 0:
+                    progress += (resolution,)
+                if self.options.profile_phases:
+                    progress += tuple(self.timer.get_iteration_totals(self.iteration_count - 1))
+                self._progress_parameters[self.iteration_count - 1] = progress
+
+                # Save a checkpoint at regular intervals
+                if self.options.checkpoint_dir is not None and \
+                        self.iteration_count % self.options.checkpoint_interval == 0:
+                    self.__save_checkpoint()
 
                 # Save intermediate image
                 if save_intermediate_results:
@@ -301,17 +815,15 @@ class DeconvolutionRL(object):
                 elif not self.options.disable_tau1 and tau1 <= self.options.stop_tau:
                     stop_message = 'Desired tau-threshold achieved'
                     break
-                elif self.options.rl_frc_stop > 0:
-                    resolution_new = frc.calculate_single_image_frc(
-                            Image(self.estimate, self.image_spacing), self.options).resolution["resolution"]
-                    frc_diff = numpy.abs(self.resolution - resolution_new)
+                elif not numpy.isnan(resolution):
+                    frc_diff = numpy.abs(self.resolution - resolution)
                     if frc_diff <= self.options.rl_frc_stop:
-                        print('Desired FRC diff reached after {} iterations'.format(
-                            self.iteration_count))
+                        stop_message = 'Desired FRC diff reached after {} iterations'.format(
+                            self.iteration_count)
                         break
                     else:
-                        self.resolution = resolution_new
-                    
+                        self.resolution = resolution
+
                 # elif self.iteration_count >= 4 and abs(frc_diff) <= .0001:
                 #     stop_message = 'FRC stop condition reached'
                 #     break
@@ -320,6 +832,16 @@ class DeconvolutionRL(object):
 
         except KeyboardInterrupt:
             stop_message = 'Iteration was interrupted by user.'
+            # An interrupted iteration would leave the extrapolated estimate
+            # in place, which is why the estimate before the prediction is
+            # restored.
+            if self.accelerator is not None and self.accelerator.predicted:
+                self.__copy_in_chunks(self.accelerator.previous, self.estimate)
+            if self.options.checkpoint_dir is not None:
+                self.__save_checkpoint()
+
+        if self.options.profile_trace is not None:
+            self.timer.write_trace(self.options.profile_trace)
 
         # if self.num_blocks > 1:
         #     self.estimate = self.estimate[0:real_size[0], 0:real_size[1], 0:real_size[2]]
@@ -329,26 +851,107 @@ class DeconvolutionRL(object):
             bar(self.iteration_count)
             print()
 
+    def __calculate_resolution(self, image):
+        """
+        Calculate the single image FRC resolution of the image area, and
+        save the FRC curve of the current iteration.
+
+        :param image: the image or the estimate, in the internal image size
+        """
+        result = self.frc_monitor.execute(image[self.frc_idx])
+        self.frc_curves[self.iteration_count] = result.correlation["correlation"]
+
+        return result.resolution["resolution"]
+
+    def __save_checkpoint(self):
+        """
+        Save the estimate and the iteration state to the checkpoint directory.
+        """
+        checkpoint.save_checkpoint(self.options.checkpoint_dir,
+                                   self.estimate,
+                                   self.iteration_count,
+                                   self._progress_parameters)
+
+    def __load_checkpoint(self):
+        """
+        Restore the estimate and the iteration state from the last checkpoint
+        in the checkpoint directory.
+        """
+        if self.options.checkpoint_dir is None:
+            raise ValueError("A checkpoint directory is needed to resume the iteration")
+
+        estimate, iteration_count, progress_parameters = \
+            checkpoint.load_checkpoint(self.options.checkpoint_dir)
+
+        if estimate.shape != tuple(self.image_size):
+            raise ValueError("The checkpoint size %s does not match the internal "
+                             "image size %s" % (estimate.shape, tuple(self.image_size)))
+        if iteration_count >= self.options.max_nof_iterations:
+            raise ValueError("The checkpoint has already reached the maximum "
+                             "number of iterations (%i)" % iteration_count)
+
+        self.estimate[:] = estimate
+        self.iteration_count = iteration_count
+        self._progress_parameters[:iteration_count] = progress_parameters
+
+        if self.options.verbose:
+            print("Resuming from the checkpoint at iteration %i" % iteration_count)
+
+    def __get_accelerator(self):
+        """
+        Setup the RL acceleration, as selected with --rl-acceleration. The
+        history arrays are memory mapped as well, if the estimates are.
+        """
+        if self.options.rl_acceleration == 'none':
+            return None
+        elif self.options.rl_acceleration == 'biggs-andrews':
+            if self.options.memmap_estimates:
+                directory = self.memmap_directory
+            else:
+                directory = None
+            return BiggsAndrewsAcceleration(tuple(self.image_size),
+                                            memmap_directory=directory)
+        else:
+            raise NotImplementedError(repr(self.options.rl_acceleration))
+
     def __get_psfs(self):
         """
         Reads the PSFs from the HDF5 data structure and zooms to the same pixel
         size with the registered images, of selected scale and channel.
         """
-        psf_orig = self.psf[:]
+        if self.psf_bank is None:
+            psfs = [(self.psf[:], self.psf_spacing)]
+        else:
+            psfs = [(psf[:], psf.spacing) for psf in self.psf_bank]
 
         # Zoom to the same voxel size
-        zoom_factors = tuple(x / y for x, y in zip(self.psf_spacing, self.image_spacing))
-        psf_new = zoom(psf_orig, zoom_factors).astype(numpy.float32)
-
-        psf_new /= psf_new.sum()
-
-        # Save the zoomed and rotated PSF, as well as its mirrored version
+        zoomed = []
+        for psf_orig, psf_spacing in psfs:
+            zoom_factors = tuple(x / y for x, y in zip(psf_spacing, self.image_spacing))
+            psf_new = zoom(psf_orig, zoom_factors).astype(numpy.float32)
+            psf_new /= psf_new.sum()
+            zoomed.append(psf_new)
+
+        if len(set(psf.shape for psf in zoomed)) > 1:
+            raise ValueError("The PSFs of a depth-variant PSF should all have "
+                             "the same size")
+
+        # Save the zoomed and rotated PSF, as well as its mirrored version.
+        # With a depth-variant PSF, the PSF in the middle of the bank is
+        # used e.g. in the block planning and in the coarse iterations.
+        psf_new = zoomed[len(zoomed) // 2]
         self.psf = psf_new
         if self.imdims == 3:
             self.adj_psf = psf_new[::-1, ::-1, ::-1]
         else:
             self.adj_psf = psf_new[::-1, ::-1]
 
+        # The OTFs are cached in the convolvers, for each block shape. The
+        # adjoint is obtained with the complex conjugate of the OTF.
+        self.convolvers = [FourierConvolver(psf, workers=self.fft_workers)
+                           for psf in zoomed]
+        self.convolver = self.convolvers[len(zoomed) // 2]
+
     def get_result(self):
         """
         Show fusion result. This is a temporary solution for now
@@ -356,59 +959,58 @@ class DeconvolutionRL(object):
         preferable.
         """
 
-        return Image(self.estimate, self.image_spacing)
+        return Image(self.estimate[self.__get_original_idx()], self.image_spacing)
 
-    def __calculate_block_and_image_size(self):
+    def __get_original_idx(self):
         """
-        Calculate the block size and the internal image size for a given
-        number of blocks. 1,2,4 or 8 blocks are currently supported.
-
+        Get the index of the original image area within the internal
+        (possibly padded) image.
         """
-        block_size = self.image_size
-        image_size = self.image_size
-
-        if self.num_blocks == 1:
-            return block_size, image_size
-        elif self.num_blocks == 2:
-            multiplier3 = numpy.array([2, 1, 1])
-            multiplier2 = numpy.array([2, 1])
-        elif self.num_blocks == 4:
-            multiplier3 = numpy.array([4, 1, 1])
-            multiplier2 = numpy.array([2, 2])
-        elif self.num_blocks == 8:
-            multiplier3 = numpy.array([4, 2, 1])
-            multiplier2 = numpy.array([4, 2])
-        elif self.num_blocks == 12:
-            multiplier3 = numpy.array([4, 2, 2])
-            multiplier2 = numpy.array([4, 3])
-        elif self.num_blocks == 24:
-            multiplier3 = numpy.array([4, 3, 2])
-            multiplier2 = numpy.array([6, 4])
-        elif self.num_blocks == 48:
-            multiplier3 = numpy.array([4, 4, 3])
-            multiplier2 = numpy.array([8, 6])
-        elif self.num_blocks == 64:
-            multiplier3 = numpy.array([4, 4, 4])
-            multiplier2 = numpy.array([8, 8])
-        elif self.num_blocks == 96:
-            multiplier3 = numpy.array([6, 4, 4])
-            multiplier2 = numpy.array([12, 8])
-        elif self.num_blocks == 144:
-            multiplier3 = numpy.array([4, 6, 6])
-            multiplier2 = numpy.array([12, 12])
-        else:
-            raise NotImplementedError
+        return tuple(slice(0, s) for s in self.original_size)
 
-        if self.imdims == 2:
-            block_size = numpy.ceil(self.image_size.astype(numpy.float16) / multiplier2).astype(numpy.int64)
-            image_size += (multiplier2 * block_size - image_size)
-        else:
-            block_size = numpy.ceil(self.image_size.astype(numpy.float16) / multiplier3).astype(numpy.int64)
-            image_size += (multiplier3 * block_size - image_size)
+    def __calculate_block_and_image_size(self):
+        """
+        Calculate the block size and the internal image size. If a memory
+        budget is given, the blocks are planned automatically, otherwise the
+        image is split into the given number of blocks.
 
-        return block_size, image_size
+        """
+        if self.options.max_memory is None:
+            return blocks.split_by_block_count(self.image_size, self.num_blocks)
+
+        # The image and the estimates (if not memory mapped), as well as the
+        # PSFs are kept in memory during the whole deconvolution.
+        image_voxels = numpy.prod(self.image_size)
+        reserved = [("PSFs", sum(convolver.psf.nbytes for convolver in self.convolvers))]
+        if not self.__is_memory_mapped(self.image):
+            reserved.append(("image", image_voxels * self.image.dtype.itemsize))
+        if not (self.options.memmap_estimates or self.use_processes):
+            reserved.append(("estimates", 2 * image_voxels * numpy.dtype(numpy.float32).itemsize))
+
+        # A depth-variant PSF needs a buffer for the weighted blocks
+        voxel_bytes = blocks.block_voxel_bytes_c
+        if self.psf_bank is not None:
+            voxel_bytes += numpy.dtype(numpy.float32).itemsize
+
+        return blocks.plan_blocks(self.image_size,
+                                  self.psf.shape,
+                                  self.options.block_pad,
+                                  blocks.get_block_budget(self.options.max_memory, reserved),
+                                  num_workers=self.options.num_workers,
+                                  voxel_bytes=voxel_bytes)
+
+    @staticmethod
+    def __is_memory_mapped(array):
+        """
+        Check if the array (or the array it is a view of) is memory mapped.
+        """
+        while array is not None:
+            if isinstance(array, numpy.memmap):
+                return True
+            array = getattr(array, 'base', None)
+        return False
 
-    def get_padded_block(self, image, block_start_index):
+    def get_padded_block(self, image, block_start_index, out=None):
         """
         Get a padded block from the self.estimate
 
@@ -416,6 +1018,8 @@ class DeconvolutionRL(object):
         ----------
         :param image: a numpy.ndarray or or its subclass
         :param block_start_index  The real block start index, not considering the padding
+        :param out: an optional buffer for the block. If given, the block is
+                    always copied into it.
 
         Returns
         -------
@@ -424,7 +1028,9 @@ class DeconvolutionRL(object):
         """
 
         block_pad = self.options.block_pad
-        image_size = self.image_size
+        # The image may be smaller than the internal image size, in which case
+        # the area outside of it is filled with zeros.
+        image_size = numpy.array(image.shape)
         ndims = self.imdims
 
         # Apply padding
@@ -436,12 +1042,19 @@ class DeconvolutionRL(object):
         # If the padded block fits within the image boundaries, nothing special
         # is needed to extract it. Normal numpy slicing notation is used.
         if (image_size >= end_index).all() and (start_index >= 0).all():
-            return image[idx]
+            if out is None:
+                return image[idx]
+            out[:] = image[idx]
+            return out
 
         else:
             block_size = tuple(i + 2 * block_pad for i in self.block_size)
             # Block outside the image boundaries will be filled with zeros.
-            block = numpy.zeros(block_size)
+            if out is None:
+                block = numpy.zeros(block_size)
+            else:
+                block = out
+                block[:] = 0
             # If the start_index is close to the image boundaries, it is very
             # probable that padding will introduce negative start_index values.
             # In such case the first pixel index must be corrected.
@@ -457,7 +1070,7 @@ class DeconvolutionRL(object):
             if not (image_size >= end_index).all():
                 block_crop = end_index - image_size
                 block_crop[block_crop < 0] = 0
-                block_end = block_size - block_crop
+                block_end = numpy.maximum(block_size - block_crop, block_start)
             else:
                 block_end = block_size
 
@@ -476,9 +1089,9 @@ class DeconvolutionRL(object):
         to the full 0-255 range.
         """
         if denoise:
-            image = medfilt(self.estimate)
+            image = medfilt(self.estimate[self.__get_original_idx()])
         else:
-            image = self.estimate
+            image = self.estimate[self.__get_original_idx()]
 
         image *= (255.0 / image.max())
         image[image < 0] = 0
@@ -491,8 +1104,11 @@ class DeconvolutionRL(object):
         if self.options.memmap_estimates:
             del self.estimate
             del self.estimate_new
-        if not self.options.disable_tau1:
-            del self.prev_estimate
+        del self.accelerator
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.pool is not None:
+            self.pool.shutdown()
 
         shutil.rmtree(self.memmap_directory)
 
@@ -0,0 +1,197 @@
+"""
+deconvolve_batch.py
+
+This file contains a batch version of the Richardson-Lucy deconvolution,
+for deconvolving a large number of small, same-sized images (e.g. tiles)
+that share a single PSF. The PSF is prepared only once, and the images are
+processed in stacks: the FFTs of all the images in a stack are calculated
+in a single call, with a shared OTF.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy
+from scipy.ndimage.filters import uniform_filter
+from scipy.ndimage.interpolation import zoom
+
+import miplib.processing.ops_ext as ops_ext
+from miplib.data.containers.image import Image
+from miplib.processing.convolution import FourierConvolver
+
+
+class DeconvolutionRLBatch(object):
+    """
+    Richardson-Lucy deconvolution of a stack of images with a common PSF.
+    The images are processed in batches of --batch-size images. Each image
+    is iterated until it meets the stopping criteria of its own.
+    """
+
+    def __init__(self, images, psf, options):
+        """
+        :param images: a list of Image objects of the same shape and spacing,
+                       or a single Image, in which the first axis is the
+                       image index
+        :param psf:    an Image; the PSF is shared by all the images
+        :param options: command line options that control the behavior
+                        of the deconvolution algorithm
+        """
+        assert isinstance(psf, Image)
+
+        if options.tv_lambda > 0 or options.update_blind_psf > 0 or \
+                options.rl_acceleration != 'none':
+            raise NotImplementedError("TV regularization, blind PSF updates and RL "
+                                      "acceleration are not supported in the batch mode")
+
+        if isinstance(images, Image):
+            assert images.ndim == psf.ndim + 1
+            self.image_spacing = images.spacing[1:]
+            self.images = numpy.asarray(images, dtype=numpy.float32)
+        else:
+            assert all(isinstance(image, Image) for image in images)
+            assert all(image.shape == images[0].shape for image in images)
+            self.image_spacing = images[0].spacing
+            self.images = numpy.stack([numpy.asarray(image, dtype=numpy.float32)
+                                       for image in images])
+
+        assert self.images.ndim == psf.ndim + 1
+
+        self.options = options
+        self.psf = psf
+        self.psf_spacing = psf.spacing
+        self.n_images = self.images.shape[0]
+        self.image_size = self.images.shape[1:]
+
+        self.__get_psfs()
+
+        # Memmap the estimates to reduce memory requirements.
+        self.memmap_directory = tempfile.mkdtemp()
+        if self.options.memmap_estimates:
+            estimates_f = os.path.join(self.memmap_directory, "estimates.dat")
+            self.estimates = numpy.memmap(estimates_f, dtype=numpy.float32,
+                                          mode='w+', shape=self.images.shape)
+        else:
+            self.estimates = numpy.zeros(self.images.shape, dtype=numpy.float32)
+
+        self.iteration_counts = numpy.zeros(self.n_images, dtype=numpy.int64)
+
+        # Pre-calculate the OTF, which is shared by all the images
+        self.convolver.get_otf(self.image_size)
+
+    def execute(self):
+        """
+        Deconvolve all the images, one batch at a time.
+        """
+        batch_size = max(self.options.batch_size, 1)
+
+        for start in range(0, self.n_images, batch_size):
+            stop = min(start + batch_size, self.n_images)
+            if self.options.verbose:
+                print("Deconvolving images %i-%i of %i" % (start, stop - 1, self.n_images))
+            self.__deconvolve_batch(slice(start, stop))
+
+    def __deconvolve_batch(self, batch_idx):
+        """
+        Run the RL iteration on a batch of images. The images that have
+        converged are left out of the following iterations.
+
+        :param batch_idx: a slice of the image indexes
+        """
+        images = self.images[batch_idx]
+        estimates = self.__get_first_estimate(images)
+        iteration_counts = self.iteration_counts[batch_idx]
+        converged = numpy.zeros(len(images), dtype=bool)
+
+        for iteration in range(self.options.max_nof_iterations):
+            active = numpy.flatnonzero(~converged)
+            if len(active) == 0:
+                break
+
+            estimate = estimates[active]
+
+            # Execute: cache = convolve(PSF, estimate), non-normalized
+            cache = self.convolver.convolve(estimate)
+
+            if self.options.rl_background != 0:
+                cache += self.options.rl_background
+
+            with numpy.errstate(divide="ignore"):
+                cache = images[active] / cache
+                cache[cache == numpy.inf] = 0.0
+                cache = numpy.nan_to_num(cache)
+
+            # Execute: cache = convolve(PSF(-), cache), inverse of non-normalized
+            cache = numpy.ascontiguousarray(self.convolver.convolve_adjoint(cache),
+                                            dtype=numpy.float32)
+
+            for i, j in enumerate(active):
+                # The relative change of the estimate (tau1) is accumulated
+                # in the update.
+                e, s, u, n, change, norm = ops_ext.update_estimate_poisson_tau1(
+                    estimate[i], cache[i], self.options.convergence_epsilon)
+                if int(u) == 0 and int(n) == 0:
+                    converged[j] = True
+                elif not self.options.disable_tau1:
+                    converged[j] = change / norm <= self.options.stop_tau
+
+            estimates[active] = estimate
+            iteration_counts[active] += 1
+
+        self.estimates[batch_idx] = estimates
+
+    def __get_first_estimate(self, images):
+        """
+        Get the first estimates for a batch of images.
+
+        :param images: the stack of images
+        """
+        first_estimate = self.options.first_estimate
+
+        if first_estimate == 'image':
+            return images.copy()
+        elif first_estimate == 'blurred':
+            size = (1,) + (3,) * (images.ndim - 1)
+            return uniform_filter(images, size).astype(numpy.float32)
+        elif first_estimate == 'image_mean':
+            axes = tuple(range(1, images.ndim))
+            return numpy.ones_like(images) * images.mean(axis=axes, keepdims=True)
+        elif first_estimate == 'constant':
+            return numpy.full(images.shape, self.options.estimate_constant,
+                              dtype=numpy.float32)
+        else:
+            raise NotImplementedError(repr(first_estimate))
+
+    def __get_psfs(self):
+        """
+        Zoom the PSF to the same pixel size with the images. This is done
+        only once for the whole batch.
+        """
+        zoom_factors = tuple(x / y for x, y in zip(self.psf_spacing, self.image_spacing))
+        psf_new = zoom(self.psf[:], zoom_factors).astype(numpy.float32)
+
+        psf_new /= psf_new.sum()
+
+        self.psf = psf_new
+        self.convolver = FourierConvolver(psf_new,
+                                          workers=max(self.options.num_workers, 1))
+
+    def get_result(self, index):
+        """
+        Get the deconvolution result of a single image.
+
+        :param index: the index of the image
+        """
+        return Image(numpy.array(self.estimates[index]), self.image_spacing)
+
+    def get_results(self):
+        """
+        Get all the deconvolution results, as a list of Image objects.
+        """
+        return [self.get_result(i) for i in range(self.n_images)]
+
+    def close(self):
+        if self.options.memmap_estimates:
+            del self.estimates
+
+        shutil.rmtree(self.memmap_directory)
@@ -0,0 +1,146 @@
+"""
+deconvolve_multichannel.py
+
+This file contains a multi-channel version of the Richardson-Lucy
+deconvolution, for images in which the first axis is the channel, e.g. a
+(C, Z, Y, X) stack. Each channel is deconvolved with a PSF of its own, with
+the DeconvolutionRL algorithm. Several channels are deconvolved at the same
+time, which keeps all the worker threads busy also in the parts of the
+iteration that are not parallelized within a channel.
+"""
+
+import copy
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from miplib.data.containers.image import Image
+from . import deconvolve
+
+
+class DeconvolutionRLMultiChannel(object):
+    """
+    Richardson-Lucy deconvolution of a multi-channel image. The --num-workers
+    worker threads and the --max-memory budget are divided between the
+    channels that are processed concurrently. The checkpoints are saved in
+    a channel_<N> subdirectory of --checkpoint-dir, and the phase trace of
+    a channel into a file with a _c<N> suffix.
+    """
+
+    def __init__(self, image, psfs, options):
+        """
+        :param image:   the image as an Image object, in which the first axis
+                        is the channel
+        :param psfs:    a list of Image objects, one PSF for every channel, or
+                        a single Image, if the PSF is shared by all the channels
+        :param options: command line options that control the behavior
+                        of the deconvolution algorithm
+        """
+        assert isinstance(image, Image)
+        if isinstance(psfs, Image):
+            psfs = [psfs] * image.shape[0]
+        assert len(psfs) == image.shape[0]
+        assert all(isinstance(psf, Image) and psf.ndim == image.ndim - 1 for psf in psfs)
+
+        if options.save_intermediate_results:
+            raise NotImplementedError("Saving the intermediate results is not "
+                                      "supported with multi-channel images")
+
+        self.image = image
+        self.psfs = psfs
+        self.options = options
+        self.n_channels = image.shape[0]
+
+        # The spacing may be given for the channel axis as well
+        self.image_spacing = image.spacing[-(image.ndim - 1):]
+
+        # Divide the resources between the concurrent channels
+        num_workers = max(self.options.num_workers, 1)
+        self.concurrent_channels = min(self.n_channels, num_workers)
+
+        self.channel_options = copy.copy(self.options)
+        self.channel_options.num_workers = max(num_workers // self.concurrent_channels, 1)
+        if self.options.max_memory is not None:
+            self.channel_options.max_memory = self.options.max_memory // self.concurrent_channels
+
+        # The results are memory mapped, if the estimates are.
+        self.memmap_directory = tempfile.mkdtemp()
+        if self.options.memmap_estimates:
+            results_f = os.path.join(self.memmap_directory, "results.dat")
+            self.results = numpy.memmap(results_f, dtype=numpy.float32,
+                                        mode='w+', shape=image.shape)
+        else:
+            self.results = numpy.zeros(image.shape, dtype=numpy.float32)
+
+        self.progress_parameters = [None] * self.n_channels
+
+    def execute(self):
+        """
+        Deconvolve all the channels.
+        """
+        if self.concurrent_channels == 1:
+            for channel in range(self.n_channels):
+                self.__deconvolve_channel(channel)
+        else:
+            with ThreadPoolExecutor(max_workers=self.concurrent_channels) as executor:
+                # Consume the results, to re-raise any exceptions from the workers
+                list(executor.map(self.__deconvolve_channel, range(self.n_channels)))
+
+    def __deconvolve_channel(self, channel):
+        """
+        Deconvolve a single channel, and save the result.
+
+        :param channel: the channel index
+        """
+        if self.options.verbose:
+            print("Deconvolving channel %i of %i" % (channel, self.n_channels))
+
+        image = Image(self.image[channel], self.image_spacing)
+        task = deconvolve.DeconvolutionRL(image, self.psfs[channel], None,
+                                          self.__get_channel_options(channel))
+        try:
+            task.execute()
+            self.results[channel] = task.get_result()
+            self.progress_parameters[channel] = task.progress_parameters
+        finally:
+            task.close()
+
+    def __get_channel_options(self, channel):
+        """
+        Get the options of a single channel. Each channel gets an options
+        object of its own, as the deconvolution may modify it, e.g. with
+        --rl-auto-background. The checkpoints and the phase trace are saved
+        separately for every channel, as the channels would otherwise
+        overwrite each other's files.
+
+        :param channel: the channel index
+        """
+        options = copy.copy(self.channel_options)
+        if options.checkpoint_dir is not None:
+            options.checkpoint_dir = os.path.join(options.checkpoint_dir,
+                                                  "channel_%i" % channel)
+        if options.profile_trace is not None:
+            root, ext = os.path.splitext(options.profile_trace)
+            options.profile_trace = "%s_c%i%s" % (root, channel, ext)
+
+        return options
+
+    def get_result(self, channel=None):
+        """
+        Get the deconvolution result.
+
+        :param channel: the channel index. If None, all the channels are
+                        returned, as a multi-channel image.
+        """
+        if channel is None:
+            return Image(self.results, self.image.spacing)
+        return Image(numpy.array(self.results[channel]), self.image_spacing)
+
+    def close(self):
+        if self.options.memmap_estimates:
+            del self.results
+
+        shutil.rmtree(self.memmap_directory)
@@ -15,23 +15,34 @@ used in this file, can take advantage of MKL optimizations available
 in the Anaconda Accelerate package.
 
 """
+import hashlib
 import itertools
 import os
+from collections import deque
 import shutil
 import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy
 import pandas
 
 import miplib.processing.ops_ext as ops_ext
 from scipy.ndimage.interpolation import zoom
+from scipy.fft import rfftn, irfftn, next_fast_len
 from scipy.signal import fftconvolve, medfilt
 
 import miplib.processing.ndarray as ops_array
 import miplib.processing.to_string as ops_output
 from miplib.data.containers import image_data, image
 from miplib.data.containers.image import Image
+from miplib.processing import blocks
+from miplib.processing.block_cache import BlockCache
+from miplib.processing.acceleration import BiggsAndrewsAcceleration
+from miplib.processing import checkpoint
+from miplib.processing.prefetch import BlockPrefetcher
+from miplib.processing import process_pool
+from miplib.processing import timing
 from . import utils as fusion_utils
 
 
@@ -54,6 +65,11 @@ class MultiViewFusionRL(object):
         self.options = options
         self.writer = writer
 
+        # With the process pool backend, the registered views and the
+        # estimates are shared with the worker processes through memory
+        # mapped files.
+        self.use_processes = options.parallel_backend == 'process'
+
         # Select views to fuse
         if self.options.fuse_views == -1:
             self.views = range(self.data.get_number_of_images("registered"))
@@ -62,22 +78,31 @@ class MultiViewFusionRL(object):
 
         self.n_views = len(self.views)
 
-        # Get weights
+        # Get weights. The photon counts of the views are needed for the
+        # scaling of the ordered subsets.
         self.weights = numpy.zeros(self.n_views, dtype=numpy.float32)
+        photon_counts = numpy.zeros(self.n_views)
 
         for idx, view in enumerate(self.views):
             self.data.set_active_image(view, self.options.channel,
                                        self.options.scale, "registered")
 
-            self.weights[idx] = self.data.get_max()
+            view_data = self.data[:]
+            self.weights[idx] = view_data.max()
+            photon_counts[idx] = view_data.sum(dtype=numpy.float64)
+            del view_data
 
         self.weights /= self.weights.sum()
 
+        # Divide the views into ordered subsets
+        self.subsets, self.view_scales = self.__get_subsets(photon_counts)
+
 
         # Get image size
         self.data.set_active_image(0, self.options.channel, self.options.scale,
                                    "registered")
         self.image_size = self.data.get_image_size()
+        self.original_size = tuple(self.image_size)
         self.imdims = len(self.image_size)
 
         print("The original image size is {}".format(tuple(self.image_size)))
@@ -85,14 +110,25 @@ class MultiViewFusionRL(object):
         self.voxel_size = self.data.get_voxel_size()
         self.iteration_count = 0
 
+        # Setup PSFs
+        self.psfs = []
+        self.adj_psfs = []
+        self.__get_psfs()
+        if "opt" in self.options.fusion_method:
+            self.virtual_psfs = []
+            self.__compute_virtual_psfs()
+        else:
+            pass
+
         # Setup blocks
         self.num_blocks = options.num_blocks
         self.block_size, self.image_size = self.__calculate_block_and_image_size()
+        self.num_blocks = int(numpy.prod(self.image_size // self.block_size))
         self.memmap_directory = tempfile.mkdtemp()
 
         # Memmap the estimates to reduce memory requirements. This will slow
         # down the fusion process considerably..
-        if self.options.memmap_estimates:
+        if self.options.memmap_estimates or self.use_processes:
             estimate_new_f = os.path.join(self.memmap_directory, "estimate_new.dat")
             self.estimate_new = Image(numpy.memmap(estimate_new_f, dtype='float32',
                                                    mode='w+',
@@ -108,20 +144,50 @@ class MultiViewFusionRL(object):
             self.estimate_new = Image(numpy.zeros(tuple(self.image_size),
                                                   dtype=numpy.float32), self.voxel_size)
 
-        if not self.options.disable_tau1:
-            prev_estimate_f = os.path.join(self.memmap_directory, "prev_estimate.dat")
-            self.prev_estimate = numpy.memmap(prev_estimate_f, dtype=numpy.float32,
-                                              mode='w+',
-                                              shape=tuple(self.image_size))
-        # Setup PSFs
-        self.psfs = []
-        self.adj_psfs = []
-        self.__get_psfs()
-        if "opt" in self.options.fusion_method:
-            self.virtual_psfs = []
-            self.__compute_virtual_psfs()
-        else:
-            pass
+        # The L1 change and norm of the estimate in the last update, for
+        # the tau1 stopping criterion. They are accumulated by the update
+        # kernel, so that a copy of the previous estimate is not needed.
+        self.estimate_change = (0.0, 0.0)
+
+        # Vector extrapolation based acceleration of the RL iteration
+        self.accelerator = self.__get_accelerator()
+
+        # With several ordered subsets, the changes of the subset updates do
+        # not add up to the change of the estimate during a pass, which is
+        # why the estimate is saved at the beginning of each pass for the
+        # tau1 criterion. The accelerator saves the estimate already.
+        self.pass_start = None
+        if len(self.subsets) > 1 and self.accelerator is None and \
+                not self.options.disable_tau1:
+            if self.options.memmap_estimates:
+                pass_start_f = os.path.join(self.memmap_directory, "pass_start.dat")
+                self.pass_start = numpy.memmap(pass_start_f, dtype=numpy.float32,
+                                               mode='w+', shape=tuple(self.image_size))
+            else:
+                self.pass_start = numpy.zeros(tuple(self.image_size), dtype=numpy.float32)
+
+        # The blocks of a view are processed in parallel with
+        # --num-workers threads or processes. With --parallel-views, the
+        # views of a block are processed in parallel as well.
+        self.executor = None
+        self.pool = None
+        self.registered_views = None
+        parallel_blocks = self.num_blocks > 1 or (self.options.parallel_views and self.n_views > 1)
+        if self.options.num_workers > 1 and parallel_blocks and not self.use_processes:
+            self.executor = ThreadPoolExecutor(max_workers=self.options.num_workers)
+
+        # The registered view blocks never change during the fusion. They
+        # are kept in memory with --block-cache-size, instead of reading
+        # them from the data file at every iteration. The process backend
+        # reads the blocks from the shared copies of the views instead.
+        self.block_cache = None
+        if self.options.block_cache_size is not None and not self.use_processes:
+            spill_directory = None
+            if self.options.block_cache_spill:
+                spill_directory = os.path.join(self.memmap_directory, "blocks")
+                os.mkdir(spill_directory)
+            self.block_cache = BlockCache(self.options.block_cache_size,
+                                          spill_directory=spill_directory)
 
         print("The fusion will be run with %i blocks" % self.num_blocks)
         padded_block_size = tuple(i + 2 * self.options.block_pad for i in self.block_size)
@@ -129,6 +195,23 @@ class MultiViewFusionRL(object):
 
         self.column_headers = ('t', 'tau1', 'leak', 'e',
                                's', 'u', 'n', 'uesu')
+
+        # Optional per-phase timing of the iterations. The bytes read are
+        # counted for the registered image blocks that are read from the
+        # HDF5 file, and for the memory mapped estimate blocks.
+        self.timer = timing.PhaseTimer(enabled=self.options.profile_phases)
+        if self.options.profile_phases:
+            self.column_headers += timing.column_headers_c
+        self.block_read_bytes = 0
+        if (self.options.memmap_estimates or self.use_processes) and self.options.block_pad > 0:
+            self.block_read_bytes = numpy.prod(self.block_size + 2 * self.options.block_pad) * \
+                numpy.dtype(numpy.float32).itemsize
+
+        # The worker processes are started last, as they get a copy of the
+        # state. They are kept alive during the whole fusion.
+        if self.use_processes:
+            self.pool = process_pool.WorkerPool(type(self), self.__get_worker_state(),
+                                                max(self.options.num_workers, 1))
         self._progress_parameters = numpy.empty((self.options.max_nof_iterations, len(self.column_headers)),
                                                 dtype=numpy.float32)
 
@@ -140,74 +223,76 @@ class MultiViewFusionRL(object):
         """
         Calculates a single RL fusion estimate. There is no reason to call this
         function -- it is used internally by the class during fusion process.
+        With the ordered subsets (-os) methods, the estimate is updated after
+        each subset of views, during a single pass over the views.
         """
 
         print('Beginning the computation of the %i. estimate' % self.iteration_count)
 
-        if "multiplicative" in self.options.fusion_method:
-            self.estimate_new[:] = numpy.float32(1.0)
-        else:
-            self.estimate_new[:] = numpy.float32(0)
+        iterables = (range(0, m, n) for m, n in zip(self.image_size, self.block_size))
+        block_indexes = list(itertools.product(*iterables))
 
-        # Iterate over views
-        for idx, view in enumerate(self.views):
+        if self.pass_start is not None:
+            step = int(self.block_size[0])
+            for start in range(0, self.estimate.shape[0], step):
+                self.pass_start[start:start + step] = self.estimate[start:start + step]
 
-            # Get PSFs for view
-            psf = self.psfs[idx]
-            adj_psf = self.adj_psfs[idx]
+        # The e, s, u, n statistics are summed over the subset updates of
+        # the pass, which is why u and n only reach zero, if none of the
+        # subset updates changes the estimate. The change is that of the
+        # last subset update, which, with a single subset, is that of the
+        # whole pass.
+        statistics = numpy.zeros(4)
+        for view_indexes in self.subsets:
+            e, s, u, n, change, norm = self.__compute_subset(view_indexes, block_indexes)
+            statistics += (e, s, u, n)
 
-            self.data.set_active_image(view, self.options.channel,
-                                       self.options.scale, "registered")
-
-            #weighting = float(self.data.get_max()) / 255
-            weighting = self.weights[idx]
+        self.estimate_change = (change, norm)
+        return tuple(statistics)
 
-            iterables = (range(0, m, n) for m, n in zip(self.image_size, self.block_size))
-            pad = self.options.block_pad
-            cache_idx = tuple(slice(pad, pad + block) for block in self.block_size)
+    def __compute_subset(self, view_indexes, block_indexes):
+        """
+        Calculate the RL update of a subset of the views, and update the
+        estimate.
 
-            # Iterate over blocks
-            for pos in itertools.product(*iterables):
+        :param view_indexes: the indexes of the views, in self.views
+        :param block_indexes: the block start indexes
+        :return: the e, s, u, n statistics of the update, and the L1 change
+                 and norm of the estimate
+        """
+        if "multiplicative" in self.options.fusion_method:
+            self.estimate_new[:] = numpy.float32(1.0)
+        else:
+            self.estimate_new[:] = numpy.float32(0)
 
-                estimate_idx = tuple(slice(j, j + k) for j, k in zip(pos, self.block_size))
-                index = numpy.array(pos, dtype=int)
-                if self.options.block_pad > 0:
-                    estimate_block = self.get_padded_block(index.copy())
-                else:
-                    estimate_block = self.estimate[estimate_idx]
-
-                # Execute: cache = convolve(PSF, estimate), non-normalized
-                estimate_block_new = fftconvolve(estimate_block, psf, mode='same')
-                estimate_block_new *= weighting
-
-                # Execute: cache = data/cache
-                block = self.data.get_registered_block(self.block_size,
-                                                       self.options.block_pad,
-                                                       index.copy())
-
-                with numpy.errstate(divide="ignore"):
-                    estimate_block_new = block / estimate_block_new
-                    estimate_block_new[estimate_block_new == numpy.inf] = 0.0
-                    estimate_block_new = numpy.nan_to_num(estimate_block_new)
-
-                # Execute: cache = convolve(PSF(-), cache), inverse of non-normalized
-                # Convolution with virtual PSFs is performed here as well, if
-                # necessary
-                estimate_block_new = fftconvolve(estimate_block_new, adj_psf, mode='same')
-
-                # Update the contribution from a single view to the new estimate
-                if self.options.block_pad == 0:
-                    if "multiplicative" in self.options.fusion_method:
-                        self.estimate_new[estimate_idx] *= estimate_block_new
-                    else:
-                        self.estimate_new[estimate_idx] += estimate_block_new
+        # With --parallel-views, the views of a block are processed at the
+        # same time. With --prefetch-depth, the registered view blocks are
+        # read in a background thread, while the previous blocks are being
+        # processed.
+        if self.executor is not None and self.options.parallel_views:
+            self.__compute_views_in_parallel(view_indexes, block_indexes)
+        elif self.pool is None and self.options.prefetch_depth > 0:
+            self.__compute_views_with_prefetch(view_indexes, block_indexes)
+        else:
+            # Iterate over views. The blocks of a single view are independent
+            # of each other, which is why they can be processed in parallel.
+            for idx in view_indexes:
+
+                self.data.set_active_image(self.views[idx], self.options.channel,
+                                           self.options.scale, "registered")
+
+                if self.pool is not None:
+                    for events in self.pool.map('_compute_block_in_worker',
+                                                [idx] * len(block_indexes), block_indexes,
+                                                [self.iteration_count] * len(block_indexes)):
+                        self.timer.merge(events)
+                elif self.executor is not None:
+                    # Consume the results, to re-raise any exceptions from the workers
+                    list(self.executor.map(self.__compute_block,
+                                           [idx] * len(block_indexes), block_indexes))
                 else:
-                    if "multiplicative" in self.options.fusion_method:
-                        self.estimate_new[estimate_idx] *= estimate_block_new[cache_idx]
-
-                    else:
-                        # print "The block size is ", self.block_size
-                        self.estimate_new[estimate_idx] += estimate_block_new[cache_idx]
+                    for pos in block_indexes:
+                        self.__compute_block(idx, pos)
 
         # I changed the weighting scheme a little bit
         # I'm not sure if this thing is necessary; maybe in the multiplicative?
@@ -218,9 +303,270 @@ class MultiViewFusionRL(object):
         #     self.estimate_new[:] = ops_array.nroot(self.estimate_new,
         #                                            self.n_views)
 
-        return ops_ext.update_estimate_poisson(self.estimate,
-                                               self.estimate_new,
-                                               self.options.convergence_epsilon)
+        with self.timer.phase('update'):
+            if self.pool is not None:
+                # The statistics of the slabs are summed up
+                statistics = self.pool.map_slabs('_update_estimate_slab', self.estimate.shape[0])
+                return numpy.sum(statistics, axis=0)
+            else:
+                return ops_ext.update_estimate_poisson_tau1(
+                    self.estimate, self.estimate_new, self.options.convergence_epsilon)
+
+    def __compute_views_with_prefetch(self, view_indexes, block_indexes):
+        """
+        Calculate the RL updates of the views, with the registered view
+        blocks read ahead in a background thread. The blocks are read in
+        the order they are processed: the blocks of a view, followed by the
+        first blocks of the next view. The blocks of a view may be
+        processed in parallel, but the views are processed one at a time,
+        as they all update the same estimate blocks.
+
+        :param view_indexes: the indexes of the views, in self.views
+        :param block_indexes: the block start indexes
+        """
+        keys = [(idx, pos) for idx in view_indexes for pos in block_indexes]
+
+        with BlockPrefetcher(self.__read_registered_block, keys,
+                             self.options.prefetch_depth) as prefetcher:
+            for idx in view_indexes:
+                if self.executor is None:
+                    for pos in block_indexes:
+                        _, block = next(prefetcher)
+                        self.__compute_block(idx, pos, block)
+                    continue
+
+                # The number of blocks in the executor queue is limited, in
+                # order not to consume the read ahead blocks too early.
+                futures = deque()
+                for pos in block_indexes:
+                    _, block = next(prefetcher)
+                    futures.append(self.executor.submit(self.__compute_block, idx, pos, block))
+                    if len(futures) >= self.options.num_workers:
+                        futures.popleft().result()
+                for future in futures:
+                    future.result()
+
+    def __compute_views_in_parallel(self, view_indexes, block_indexes):
+        """
+        Calculate the RL updates of the views, processing the (view,
+        block) pairs in the worker threads. The contributions of the views
+        are added to the self.estimate_new in the calling thread, for each
+        block in the view order. This gives the same result as the
+        sequential processing of the views, with both the summative and
+        the multiplicative fusion. The registered view blocks are read in a
+        single background thread, as the active image of the data file
+        cannot be switched between the views concurrently.
+
+        :param view_indexes: the indexes of the views, in self.views
+        :param block_indexes: the block start indexes
+        """
+        keys = [(idx, pos) for pos in block_indexes for idx in view_indexes]
+        depth = max(self.options.prefetch_depth, 1)
+
+        with BlockPrefetcher(self.__read_registered_block, keys, depth) as prefetcher:
+            # The number of unreduced contributions is limited, in order to
+            # limit the memory use.
+            pending = deque()
+            for (idx, pos), block in prefetcher:
+                pending.append((idx, pos, self.executor.submit(
+                    self.__compute_block_contribution, idx, pos, block)))
+                if len(pending) >= 2 * self.options.num_workers:
+                    idx, pos, future = pending.popleft()
+                    self.__add_block_contribution(idx, pos, future.result())
+
+            for idx, pos, future in pending:
+                self.__add_block_contribution(idx, pos, future.result())
+
+    def __read_registered_block(self, view_idx, pos):
+        """
+        Read a padded block of a registered view, in the background thread
+        of the prefetcher.
+
+        :param view_idx: the index of the view, in self.views
+        :param pos: the block start index, not considering the padding
+        """
+        self.data.set_active_image(self.views[view_idx], self.options.channel,
+                                   self.options.scale, "registered")
+
+        with self.timer.phase('read', pos) as phase:
+            block = self.__get_registered_block(view_idx, numpy.array(pos, dtype=int))
+            phase.nbytes = block.nbytes
+
+        return block
+
+    def __compute_block(self, view_idx, pos, block=None):
+        """
+        Calculates the RL update of a single view for a single block, and
+        adds it to the self.estimate_new.
+
+        :param view_idx: the index of the view, in self.views
+        :param pos: the block start index, not considering the padding
+        :param block: the padded registered view block, if it has been read
+                      already
+        """
+        contribution = self.__compute_block_contribution(view_idx, pos, block)
+        self.__add_block_contribution(view_idx, pos, contribution)
+
+    def __compute_block_contribution(self, view_idx, pos, block=None):
+        """
+        Calculates the RL update of a single view for a single block.
+
+        :param view_idx: the index of the view, in self.views
+        :param pos: the block start index, not considering the padding
+        :param block: the padded registered view block, if it has been read
+                      already
+        :return: the padded update block
+        """
+        psf = self.psfs[view_idx]
+        adj_psf = self.adj_psfs[view_idx]
+        weighting = self.weights[view_idx]
+
+        estimate_idx = tuple(slice(j, j + k) for j, k in zip(pos, self.block_size))
+        index = numpy.array(pos, dtype=int)
+        with self.timer.phase('read', pos, self.block_read_bytes):
+            if self.options.block_pad > 0:
+                estimate_block = self.get_padded_block(self.estimate, index.copy())
+            else:
+                estimate_block = self.estimate[estimate_idx]
+
+        # Execute: cache = convolve(PSF, estimate), non-normalized
+        with self.timer.phase('forward_fft', pos):
+            estimate_block_new = fftconvolve(estimate_block, psf, mode='same')
+            estimate_block_new *= weighting
+
+        # Execute: cache = data/cache
+        if block is None:
+            with self.timer.phase('read', pos) as phase:
+                block = self.__get_registered_block(view_idx, index.copy())
+                phase.nbytes = block.nbytes
+
+        with self.timer.phase('ratio', pos):
+            with numpy.errstate(divide="ignore"):
+                estimate_block_new = block / estimate_block_new
+                estimate_block_new[estimate_block_new == numpy.inf] = 0.0
+                estimate_block_new = numpy.nan_to_num(estimate_block_new)
+
+        # Execute: cache = convolve(PSF(-), cache), inverse of non-normalized
+        # Convolution with virtual PSFs is performed here as well, if
+        # necessary
+        with self.timer.phase('adjoint_fft', pos):
+            estimate_block_new = fftconvolve(estimate_block_new, adj_psf, mode='same')
+
+        return estimate_block_new
+
+    def __add_block_contribution(self, view_idx, pos, estimate_block_new):
+        """
+        Add the contribution of a single view to a block of the
+        self.estimate_new.
+
+        :param view_idx: the index of the view, in self.views
+        :param pos: the block start index, not considering the padding
+        :param estimate_block_new: the padded update block of the view
+        """
+        pad = self.options.block_pad
+        cache_idx = tuple(slice(pad, pad + block) for block in self.block_size)
+        estimate_idx = tuple(slice(j, j + k) for j, k in zip(pos, self.block_size))
+
+        # Update the contribution from a single view to the new estimate
+        with self.timer.phase('update', pos):
+            if self.view_scales[view_idx] != 1.0:
+                estimate_block_new *= self.view_scales[view_idx]
+            if self.options.block_pad == 0:
+                if "multiplicative" in self.options.fusion_method:
+                    self.estimate_new[estimate_idx] *= estimate_block_new
+                else:
+                    self.estimate_new[estimate_idx] += estimate_block_new
+            else:
+                if "multiplicative" in self.options.fusion_method:
+                    self.estimate_new[estimate_idx] *= estimate_block_new[cache_idx]
+
+                else:
+                    # print "The block size is ", self.block_size
+                    self.estimate_new[estimate_idx] += estimate_block_new[cache_idx]
+
+    def __get_worker_state(self):
+        """
+        Get the attributes that are copied to the worker processes. The
+        registered views are copied from the data file into memory mapped
+        files, of the internal image size, and shared with the estimates.
+        """
+        excluded = ('data', 'writer', 'executor', 'pool', 'accelerator', 'timer',
+                    'block_cache', 'pass_start')
+        state = dict((key, value) for key, value in self.__dict__.items()
+                     if key not in excluded)
+
+        state['registered_views'] = []
+        for idx, view in enumerate(self.views):
+            self.data.set_active_image(view, self.options.channel,
+                                       self.options.scale, "registered")
+            state['registered_views'].append(process_pool.share_array(
+                self.data[:], self.memmap_directory, "view_%i.dat" % idx,
+                shape=self.image_size))
+
+        state['estimate'] = process_pool.MemmapReference(self.estimate)
+        state['estimate_new'] = process_pool.MemmapReference(self.estimate_new)
+
+        return state
+
+    def _setup_worker(self):
+        """
+        Finish the initialization of the algorithm object in a worker process.
+        """
+        self.timer = timing.PhaseTimer(enabled=self.options.profile_phases)
+
+    def _compute_block_in_worker(self, view_idx, pos, iteration_count):
+        """
+        Calculate the RL update of a single view for a single block, in a
+        worker process.
+
+        :param view_idx: the index of the view, in self.views
+        :param pos: the block start index, not considering the padding
+        :param iteration_count: the current iteration
+        :return: the phase timing events of the block
+        """
+        self.iteration_count = iteration_count
+        self.timer.reset()
+        self.__compute_block(view_idx, pos)
+
+        return self.timer.events
+
+    def _update_estimate_slab(self, start, stop):
+        """
+        Apply the RL update to a slab of the estimate in a worker process.
+
+        :param start: the start index of the slab, on the first axis
+        :param stop: the stop index of the slab
+        :return: the e, s, u, n statistics of the slab, and the L1 change
+                 and norm of the estimate
+        """
+        return ops_ext.update_estimate_poisson_tau1(self.estimate[start:stop],
+                                                    self.estimate_new[start:stop],
+                                                    self.options.convergence_epsilon)
+
+    def __get_registered_block(self, view_idx, index):
+        """
+        Read a padded block of a registered view, either from the shared
+        copies of the views (with the process backend), or from the data file.
+
+        :param view_idx: the index of the view, in self.views
+        :param index: the block start index, not considering the padding
+        """
+        if self.registered_views is not None:
+            return self.get_padded_block(self.registered_views[view_idx], index)
+
+        if self.block_cache is None:
+            return self.data.get_registered_block(self.block_size,
+                                                  self.options.block_pad,
+                                                  index)
+
+        key = (self.views[view_idx], self.options.channel, self.options.scale,
+               tuple(int(i) for i in index))
+        block = self.block_cache.get(key)
+        if block is None:
+            block = self.block_cache.put(key, self.data.get_registered_block(
+                self.block_size, self.options.block_pad, index))
+
+        return block
 
     def execute(self):
         """
@@ -238,28 +584,32 @@ class MultiViewFusionRL(object):
                                    self.options.scale,
                                    "registered")
 
+        # The internal image size may have been padded to a multiple of
+        # the block size.
+        image_idx = self.__get_original_idx()
+
         if first_estimate == 'first_image':
-            self.estimate[:] = self.data[:].astype(numpy.float32)
+            self.estimate[image_idx] = self.data[:].astype(numpy.float32)
         elif first_estimate == 'first_image_mean':
             self.estimate[:] = numpy.float32(numpy.mean(self.data[:]))
         elif first_estimate == 'sum_of_originals':
-            self.estimate[:] = fusion_utils.sum_of_all(self.data,
-                                                       self.options.channel,
-                                                       self.options.scale)
+            self.estimate[image_idx] = fusion_utils.sum_of_all(self.data,
+                                                               self.options.channel,
+                                                               self.options.scale)
         elif first_estimate == 'sum_of_registered':
-            self.estimate[:] = fusion_utils.sum_of_all(self.data,
-                                                       self.options.channel,
-                                                       self.options.scale,
-                                                       "registered")
+            self.estimate[image_idx] = fusion_utils.sum_of_all(self.data,
+                                                               self.options.channel,
+                                                               self.options.scale,
+                                                               "registered")
         elif first_estimate == 'simple_fusion':
-            self.estimate[:] = fusion_utils.simple_fusion(self.data,
-                                                          self.options.channel,
-                                                          self.options.scale)
+            self.estimate[image_idx] = fusion_utils.simple_fusion(self.data,
+                                                                  self.options.channel,
+                                                                  self.options.scale)
         elif first_estimate == 'average_af_all':
-            self.estimate[:] = fusion_utils.average_of_all(self.data,
-                                                           self.options.channel,
-                                                           self.options.scale,
-                                                           "registered")
+            self.estimate[image_idx] = fusion_utils.average_of_all(self.data,
+                                                                   self.options.channel,
+                                                                   self.options.scale,
+                                                                   "registered")
         elif first_estimate == 'constant':
             self.estimate[:] = numpy.float32(self.options.estimate_constant)
         else:
@@ -269,6 +619,9 @@ class MultiViewFusionRL(object):
         max_count = self.options.max_nof_iterations
         initial_photon_count = self.data[:].sum()
 
+        if self.accelerator is not None:
+            self.accelerator.reset()
+
         bar = ops_output.ProgressBar(0,
                                      max_count,
                                      totalWidth=40,
@@ -277,6 +630,11 @@ class MultiViewFusionRL(object):
         self._progress_parameters = numpy.zeros((self.options.max_nof_iterations,
                                                  len(self.column_headers)),
                                                 dtype=numpy.float32)
+        self.timer.reset()
+
+        # Continue from the last checkpoint, if requested
+        if self.options.resume:
+            self.__load_checkpoint()
 
         # The Fusion calculation starts here
         # ====================================================================
@@ -285,19 +643,25 @@ class MultiViewFusionRL(object):
 
                 info_map = {}
                 ittime = time.time()
+                self.timer.iteration = self.iteration_count
 
-                if not self.options.disable_tau1:
-                    self.prev_estimate[:] = self.estimate.copy()
+                if self.accelerator is not None:
+                    self.accelerator.predict(self.estimate)
 
                 e, s, u, n = self.compute_estimate()
 
+                if self.accelerator is not None:
+                    self.accelerator.update(self.estimate)
+
                 self.iteration_count += 1
-                photon_leak = 1.0 - (e + s + u) / initial_photon_count
+                # The photon counts are summed over the ordered subsets
+                photon_leak = 1.0 - (e + s + u) / (len(self.subsets) * initial_photon_count)
                 u_esu = u / (e + s + u)
 
+                tau1 = numpy.nan
                 if not self.options.disable_tau1:
-                    tau1 = abs(self.estimate - self.prev_estimate).sum() / abs(
-                        self.prev_estimate).sum()
+                    with self.timer.phase('tau1'):
+                        tau1 = self.__calculate_tau1()
                     info_map['TAU1=%s'] = tau1
 
                 t = time.time() - ittime
@@ -313,8 +677,15 @@ class MultiViewFusionRL(object):
                 print()
 
                 # Save parameters to file
-                self._progress_parameters[self.iteration_count - 1] = (t, tau1, leak, e, s, u, n, u_esu)
-
+                progress = (t, tau1, leak, e, s, u, n, u_esu)
+                if self.options.profile_phases:
+                    progress += tuple(self.timer.get_iteration_totals(self.iteration_count - 1))
+                self._progress_parameters[self.iteration_count - 1] = progress
+
+                # Save a checkpoint at regular intervals
+                if self.options.checkpoint_dir is not None and \
+                        self.iteration_count % self.options.checkpoint_interval == 0:
+                    self.__save_checkpoint()
                 # Save intermediate image
                 if save_intermediate_results:
                     self.writer.write(Image(self.estimate, self.voxel_size))
@@ -334,6 +705,19 @@ class MultiViewFusionRL(object):
 
         except KeyboardInterrupt:
             stop_message = 'Iteration was interrupted by user.'
+            # An interrupted iteration would leave the extrapolated estimate
+            # in place, which is why the estimate before the prediction is
+            # restored, one block row at a time.
+            if self.accelerator is not None and self.accelerator.predicted:
+                previous = self.accelerator.previous
+                step = int(self.block_size[0])
+                for start in range(0, self.estimate.shape[0], step):
+                    self.estimate[start:start + step] = previous[start:start + step]
+            if self.options.checkpoint_dir is not None:
+                self.__save_checkpoint()
+
+        if self.options.profile_trace is not None:
+            self.timer.write_trace(self.options.profile_trace)
 
         # if self.num_blocks > 1:
         #     self.estimate = self.estimate[0:real_size[0], 0:real_size[1], 0:real_size[2]]
@@ -343,6 +727,132 @@ class MultiViewFusionRL(object):
         bar(self.iteration_count)
         print()
 
+    def __save_checkpoint(self):
+        """
+        Save the estimate and the iteration state to the checkpoint directory.
+        """
+        checkpoint.save_checkpoint(self.options.checkpoint_dir,
+                                   self.estimate,
+                                   self.iteration_count,
+                                   self._progress_parameters)
+
+    def __load_checkpoint(self):
+        """
+        Restore the estimate and the iteration state from the last checkpoint
+        in the checkpoint directory.
+        """
+        if self.options.checkpoint_dir is None:
+            raise ValueError("A checkpoint directory is needed to resume the iteration")
+
+        estimate, iteration_count, progress_parameters = \
+            checkpoint.load_checkpoint(self.options.checkpoint_dir)
+
+        if estimate.shape != tuple(self.image_size):
+            raise ValueError("The checkpoint size %s does not match the internal "
+                             "image size %s" % (estimate.shape, tuple(self.image_size)))
+        if iteration_count >= self.options.max_nof_iterations:
+            raise ValueError("The checkpoint has already reached the maximum "
+                             "number of iterations (%i)" % iteration_count)
+
+        self.estimate[:] = estimate
+        self.iteration_count = iteration_count
+        self._progress_parameters[:iteration_count] = progress_parameters
+
+        print("Resuming from the checkpoint at iteration %i" % iteration_count)
+
+    def __calculate_tau1(self):
+        """
+        Calculate the relative change of the estimate during the last
+        iteration. Without acceleration, the change is accumulated in the
+        update step. With acceleration, the estimate is compared to the
+        estimate before the prediction, which is saved by the accelerator,
+        one block row at a time. With several ordered subsets, the estimate
+        is compared to the estimate at the beginning of the pass.
+        """
+        if self.accelerator is not None:
+            previous = self.accelerator.previous
+        elif self.pass_start is not None:
+            previous = self.pass_start
+        else:
+            change, total = self.estimate_change
+            return change / total
+
+        step = int(self.block_size[0])
+        change = 0.0
+        total = 0.0
+        for start in range(0, self.estimate.shape[0], step):
+            estimate = self.estimate[start:start + step]
+            prev_estimate = previous[start:start + step]
+            change += numpy.abs(estimate - prev_estimate).sum(dtype=numpy.float64)
+            total += numpy.abs(prev_estimate).sum(dtype=numpy.float64)
+
+        return change / total
+
+    def __get_accelerator(self):
+        """
+        Setup the RL acceleration, as selected with --rl-acceleration. The
+        history arrays are memory mapped as well, if the estimates are.
+        """
+        if self.options.rl_acceleration == 'none':
+            return None
+        elif self.options.rl_acceleration == 'biggs-andrews':
+            if self.options.memmap_estimates:
+                directory = self.memmap_directory
+            else:
+                directory = None
+            return BiggsAndrewsAcceleration(tuple(self.image_size),
+                                            memmap_directory=directory)
+        else:
+            raise NotImplementedError(repr(self.options.rl_acceleration))
+
+    def __get_subsets(self, photon_counts):
+        """
+        Divide the views into ordered subsets, with the -os fusion methods.
+        The views are interleaved, so that the views of a subset are spread
+        over the view angles. Without the ordered subsets, all the views
+        are in a single subset.
+
+        The RL update of a subset has a different fixed point (in terms of
+        the scale of the estimate) than the update of all the views, as the
+        views are divided by their weights. A view v contributes in
+        proportion to photon_counts[v] / weights[v]. With the summative
+        methods, the photon count of the estimate after an update is the
+        sum of these contributions, and with the multiplicative methods,
+        the fixed point depends on their product. The contributions are
+        scaled so that, with consistent views, the estimate that is a fixed
+        point of the regular fusion method is a fixed point of every subset
+        update as well. With a single view in a subset, the summative and
+        multiplicative updates are the same, apart from the scale.
+
+        :param photon_counts: the photon counts of the views
+        :return: a tuple (subsets, view_scales), in which subsets is a list
+                 of lists of view indexes, and view_scales is the scaling
+                 factor of each view
+        """
+        if self.options.fusion_method.endswith("-os"):
+            n_subsets = self.options.os_subsets
+            if n_subsets <= 0:
+                n_subsets = self.n_views
+            n_subsets = min(n_subsets, self.n_views)
+            subsets = [list(range(i, self.n_views, n_subsets)) for i in range(n_subsets)]
+        else:
+            subsets = [list(range(self.n_views))]
+
+        contributions = photon_counts / self.weights.astype(numpy.float64)
+        view_scales = numpy.ones(self.n_views)
+        if len(subsets) == 1:
+            return subsets, view_scales
+
+        for subset in subsets:
+            if "multiplicative" in self.options.fusion_method:
+                log_contributions = numpy.log(contributions)
+                scale = numpy.exp(log_contributions.mean() - log_contributions[subset].mean())
+            else:
+                scale = contributions.sum() / contributions[subset].sum()
+            view_scales[subset] = scale
+
+        return subsets, view_scales
+
     # region Prepare PSFs
     def __get_psfs(self):
         """
@@ -377,86 +887,103 @@ class MultiViewFusionRL(object):
         Implements a Virtual PSF calculation routine, as described in "Efficient
         Bayesian-based multiview deconvolution" by Preibich et al in Nature
         Methods 11/6 (2014)
+
+        The virtual PSF of view i is the product of the mirrored PSF of the
+        view and the compound kernels PSF_i(-) * PSF_j * PSF_j(-) of all the
+        other views j. The compound kernels are calculated as products of
+        the OTFs, which are transformed only once for each view. Unlike
+        with two consecutive 'same' mode convolutions, the intermediate
+        result is not truncated to the PSF size, which changes the virtual
+        PSFs slightly, mostly near their borders. The virtual PSFs are saved into the data file, for the set of views and
+        the scale, and loaded from there in later runs, if the PSFs have not
+        changed.
         """
+        checksum = hashlib.sha1(b"".join(psf.tobytes() for psf in self.psfs)).hexdigest()
+
+        saved = [self.data.get_virtual_psf(self.options.scale, view, self.views, checksum)
+                 for view in self.views]
+        if all(psf is not None for psf in saved):
+            print("Using the saved Virtual PSFs")
+            self.adj_psfs = [psf.astype(numpy.float32) for psf in saved]
+            return
 
         print("Caclulating Virtual PSFs")
 
+        # The transforms are large enough to contain the central part of
+        # the compound kernels, of the PSF size, without circular wrap-around.
+        psf_size = numpy.max([psf.shape for psf in self.psfs], axis=0)
+        fft_shape = tuple(next_fast_len(int(2 * n), real=True) for n in psf_size)
+
+        adj_otfs = [rfftn(adj_psf, fft_shape) for adj_psf in self.adj_psfs]
+        # PSF_j * PSF_j(-)
+        compound_otfs = [rfftn(psf, fft_shape) * adj_otf
+                         for psf, adj_otf in zip(self.psfs, adj_otfs)]
+
+        virtual_psfs = []
         for i in range(self.n_views):
-            virtual_psf = numpy.ones(self.psfs[0].shape, dtype=self.psfs[0].dtype)
+            virtual_psf = numpy.ones(self.adj_psfs[i].shape, dtype=self.psfs[0].dtype)
             for j in range(self.n_views):
                 if j == i:
                     pass
                 else:
-                    cache = fftconvolve(
-                        fftconvolve(
-                            self.adj_psfs[i],
-                            self.psfs[j],
-                            mode='same'
-                        ),
-                        self.adj_psfs[j],
-                        mode='same'
-
-                    )
+                    cache = irfftn(adj_otfs[i] * compound_otfs[j], fft_shape)
 
-                    virtual_psf *= cache.real
+                    # The same alignment as with two consecutive "same" mode
+                    # convolutions
+                    offset = tuple(2 * ((n - 1) // 2) for n in self.psfs[j].shape)
+                    virtual_psf *= cache[tuple(slice(o, o + n) for o, n in
+                                               zip(offset, virtual_psf.shape))]
 
             virtual_psf *= self.adj_psfs[i]
             virtual_psf /= virtual_psf.sum()
-            self.adj_psfs[i] = virtual_psf
-            # self.virtual_psfs.append(virtual_psf)
+            virtual_psfs.append(virtual_psf)
+
+        self.adj_psfs = virtual_psfs
+
+        self.data.set_active_image(0, self.options.channel, self.options.scale,
+                                   "registered")
+        spacing = self.data.get_voxel_size()
+        for view, virtual_psf in zip(self.views, virtual_psfs):
+            self.data.add_virtual_psf(virtual_psf, self.options.scale, view,
+                                      self.views, spacing, checksum)
 
     # endregion
 
 
-    def __calculate_block_and_image_size(self):
+    def __get_original_idx(self):
         """
-        Calculate the block size and the internal image size for a given
-        number of blocks. 1,2,4 or 8 blocks are currently supported.
-
+        Get the index of the original image area within the internal
+        (possibly padded) image.
         """
-        block_size = self.image_size
-        image_size = self.image_size
-
-        if self.num_blocks == 1:
-            return block_size, image_size
-        elif self.num_blocks == 2:
-            multiplier3 = numpy.array([2, 1, 1])
-            multiplier2 = numpy.array([2, 1])
-        elif self.num_blocks == 4:
-            multiplier3 = numpy.array([4, 1, 1])
-            multiplier2 = numpy.array([2, 2])
-        elif self.num_blocks == 8:
-            multiplier3 = numpy.array([4, 2, 1])
-            multiplier2 = numpy.array([4, 2])
-        elif self.num_blocks == 12:
-            multiplier3 = numpy.array([4, 2, 2])
-            multiplier2 = numpy.array([4, 3])
-        elif self.num_blocks == 24:
-            multiplier3 = numpy.array([4, 3, 2])
-            multiplier2 = numpy.array([6, 4])
-        elif self.num_blocks == 48:
-            multiplier3 = numpy.array([4, 4, 3])
-            multiplier2 = numpy.array([8, 6])
-        elif self.num_blocks == 64:
-            multiplier3 = numpy.array([4, 4, 4])
-            multiplier2 = numpy.array([8, 8])
-        elif self.num_blocks == 96:
-            multiplier3 = numpy.array([6, 4, 4])
-            multiplier2 = numpy.array([12, 8])
-        elif self.num_blocks == 144:
-            multiplier3 = numpy.array([4, 6, 6])
-            multiplier2 = numpy.array([12, 12])
-        else:
-            raise NotImplementedError
+        return tuple(slice(0, s) for s in self.original_size)
 
-        if self.imdims == 2:
-            block_size = numpy.ceil(self.image_size.astype(numpy.float16) / multiplier2).astype(numpy.int64)
-            image_size += (multiplier2 * block_size - image_size)
-        else:
-            block_size = numpy.ceil(self.image_size.astype(numpy.float16) / multiplier3).astype(numpy.int64)
-            image_size += (multiplier3 * block_size - image_size)
+    def __calculate_block_and_image_size(self):
+        """
+        Calculate the block size and the internal image size. If a memory
+        budget is given, the blocks are planned automatically, otherwise the
+        image is split into the given number of blocks.
 
-        return block_size, image_size
+        """
+        if self.options.max_memory is None:
+            return blocks.split_by_block_count(self.image_size, self.num_blocks)
+
+        # The estimates (if not memory mapped) and the PSFs are kept in
+        # memory during the whole fusion.
+        reserved = [("PSFs", sum(psf.nbytes + adj_psf.nbytes
+                                 for psf, adj_psf in zip(self.psfs, self.adj_psfs)))]
+        if not (self.options.memmap_estimates or self.use_processes):
+            reserved.append(("estimates", 2 * numpy.prod(self.image_size) *
+                             numpy.dtype(numpy.float32).itemsize))
+        if self.options.block_cache_size is not None and not self.use_processes:
+            reserved.append(("block cache", self.options.block_cache_size))
+
+        psf_size = numpy.max([psf.shape for psf in self.psfs], axis=0)
+
+        return blocks.plan_blocks(self.image_size,
+                                  psf_size,
+                                  self.options.block_pad,
+                                  blocks.get_block_budget(self.options.max_memory, reserved),
+                                  num_workers=self.options.num_workers)
 
     def get_padded_block(self, image, block_start_index):
         """
@@ -528,12 +1055,12 @@ class MultiViewFusionRL(object):
         preferable.
         """
         if cast_to_8bit:
-            result = self.estimate.copy()
+            result = self.estimate[self.__get_original_idx()].copy()
             result *= (255.0 / result.max())
             result[result < 0] = 0
             return Image(result, self.voxel_size)
 
-        return Image(self.estimate, self.voxel_size)
+        return Image(self.estimate[self.__get_original_idx()], self.voxel_size)
 
     def save_to_hdf(self):
         """
@@ -546,7 +1073,7 @@ class MultiViewFusionRL(object):
                                    "registered")
         spacing = self.data.get_voxel_size()
 
-        self.data.add_fused_image(self.estimate,
+        self.data.add_fused_image(self.estimate[self.__get_original_idx()],
                                   self.options.channel,
                                   self.options.scale,
                                   spacing)
@@ -554,10 +1081,16 @@ class MultiViewFusionRL(object):
     # endregion
 
     def close(self):
-        if self.options.memmap_estimates:
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.block_cache is not None:
+            self.block_cache.clear()
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.options.memmap_estimates or self.use_processes:
             del self.estimate
             del self.estimate_new
-        if not self.options.disable_tau1:
-            del self.prev_estimate
+        del self.accelerator
+        del self.pass_start
 
         shutil.rmtree(self.memmap_directory)
@@ -169,9 +169,11 @@ class MultiViewFusionRLCuda(fusion.MultiViewFusionRL):
                 self.estimate_new[:] = numpy.nan_to_num(self.estimate_new)
 
         # Update estimate inplace. Get convergence statistics.
-        return ops_ext.update_estimate_poisson(self.estimate,
-                                               self.estimate_new,
-                                               self.options.convergence_epsilon)
+        e, s, u, n, change, norm = ops_ext.update_estimate_poisson_tau1(
+            self.estimate, self.estimate_new, self.options.convergence_epsilon)
+        self.estimate_change = (change, norm)
+
+        return e, s, u, n
 
     @staticmethod
     def __best_grid_size(size, tpb):
@@ -0,0 +1,257 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+from scipy.ndimage import gaussian_filter
+from scipy.signal import fftconvolve
+
+from miplib.data.containers import image_data
+from miplib.processing.fusion.fusion import MultiViewFusionRL
+from miplib.ui.cli.miplib_entry_point_options import get_fusion_script_options
+
+view_sigmas_c = ((2.0, 1.0, 1.0), (1.0, 2.0, 1.0), (1.0, 1.0, 2.0), (1.5, 1.5, 1.0))
+
+
+def make_data(path, brightness=(1.0, 1.5, 2.0), noise=True, shape=(16, 32, 32), seed=0):
+    """
+    Make a multi-view data file, in which the views are blurred with
+    different PSFs. The views are registered already. The truth is zero
+    within the PSF radius of the image borders.
+
+    :param path: the path of the .hdf5 file
+    :param brightness: the photon count multipliers of the views
+    :param noise: if False, the views are consistent with each other
+    :return: the truth, as a numpy.ndarray
+    """
+    rng = numpy.random.RandomState(seed)
+    truth = numpy.zeros(shape, dtype=numpy.float32)
+    truth[tuple(rng.randint(6, n - 6, 30) for n in shape)] = 1000
+    truth = gaussian_filter(truth, 1.0)
+    truth[truth < 1e-3 * truth.max()] = 0
+
+    data = image_data.ImageData(path)
+    spacing = [0.1] * len(shape)
+    for view, multiplier in enumerate(brightness):
+        psf = numpy.zeros((9,) * len(shape), dtype=numpy.float32)
+        psf[(4,) * len(shape)] = 1
+        psf = gaussian_filter(psf, view_sigmas_c[view])
+        psf /= psf.sum()
+
+        image = numpy.clip(fftconvolve(truth, psf, mode='same'), 0, None) * multiplier
+        if noise:
+            image = rng.poisson(image + 2)
+
+        image = image.astype(numpy.float32)
+        data.add_original_image(image, 100, view, 0, 0, spacing)
+        data.add_registered_image(image, 100, view, 0, 0, spacing)
+        data.add_psf(psf, 100, view, 0, 0, spacing)
+    data.close()
+
+    return truth
+
+
+class FusionTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "data.hdf5")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_task(self, arguments):
+        data = image_data.ImageData(self.path)
+        options = get_fusion_script_options([self.path] + arguments.split())
+        task = MultiViewFusionRL(data, None, options)
+        self.addCleanup(data.close)
+        self.addCleanup(task.close)
+        return task
+
+    def fuse(self, arguments):
+        """
+        :return: a tuple (result, progress parameters)
+        """
+        task = self.get_task(arguments)
+        task.execute()
+        return numpy.array(task.get_result()), task.progress_parameters
+
+
+class TestOrderedSubsets(FusionTestCase):
+    def test_fixed_point_is_that_of_the_regular_method(self):
+        truth = make_data(self.path, noise=False)
+        brightness = numpy.array([1.0, 1.5, 2.0])
+
+        for method in ("summative", "multiplicative"):
+            task = self.get_task("--fusion-method %s" % method)
+            contributions = brightness / task.weights
+
+            # With consistent views, the scaled truth is a fixed point of
+            # the regular method
+            if method == "summative":
+                scale = contributions.sum()
+            else:
+                scale = numpy.exp(numpy.log(contributions).mean())
+
+            for arguments in ("--fusion-method %s" % method,
+                              "--fusion-method %s-os" % method,
+                              "--fusion-method %s-os --os-subsets 2" % method):
+                task = self.get_task(arguments + " --disable-tau1")
+                task.estimate[:] = scale * truth
+                task.compute_estimate()
+
+                numpy.testing.assert_allclose(task.estimate, scale * truth,
+                                              rtol=1e-3, atol=1e-3 * scale * truth.max(),
+                                              err_msg=arguments)
+
+    def test_photon_count_matches_the_regular_method(self):
+        make_data(self.path, noise=False)
+
+        result, progress = self.fuse("--fusion-method summative --max-nof-iterations 4")
+        result_os, progress_os = self.fuse("--fusion-method summative-os "
+                                           "--max-nof-iterations 4")
+
+        # The photon count of a summative update is that of the views,
+        # with every subset
+        numpy.testing.assert_allclose(result_os.sum(), result.sum(), rtol=1e-4)
+
+        # The photon leak is normalized by the number of subsets
+        numpy.testing.assert_allclose(progress_os["leak"], progress["leak"], rtol=1e-3)
+
+    def test_single_view_subsets_only_differ_in_scale(self):
+        make_data(self.path)
+
+        summative, _ = self.fuse("--fusion-method summative-os --max-nof-iterations 3")
+        multiplicative, _ = self.fuse("--fusion-method multiplicative-os "
+                                      "--max-nof-iterations 3")
+
+        numpy.testing.assert_allclose(multiplicative / multiplicative.sum(),
+                                      summative / summative.sum(), rtol=1e-3, atol=1e-7)
+
+    def test_statistics_depend_on_the_method(self):
+        make_data(self.path, brightness=(1.0, 1.5, 2.0, 1.2))
+
+        _, summative = self.fuse("--fusion-method summative-os --os-subsets 2 "
+                                 "--max-nof-iterations 3")
+        _, multiplicative = self.fuse("--fusion-method multiplicative-os --os-subsets 2 "
+                                      "--max-nof-iterations 3")
+
+        for column in ("tau1", "s", "u", "uesu"):
+            self.assertFalse(numpy.allclose(summative[column], multiplicative[column]),
+                             column)
+
+
+def spatial_virtual_psf(psfs, i, mode):
+    """
+    Calculate the virtual PSF of view i in the spatial domain, with two
+    consecutive convolutions. With mode='same', the intermediate result is
+    truncated to the PSF size, as in the earlier implementation.
+    """
+    adj_psfs = [psf[::-1, ::-1, ::-1] for psf in psfs]
+    virtual_psf = numpy.ones(psfs[i].shape)
+    for j in range(len(psfs)):
+        if j == i:
+            continue
+        cache = fftconvolve(fftconvolve(adj_psfs[i], psfs[j], mode=mode), adj_psfs[j],
+                            mode=mode)
+        if mode == 'full':
+            offset = tuple(2 * ((n - 1) // 2) for n in psfs[j].shape)
+            cache = cache[tuple(slice(o, o + n) for o, n in zip(offset, psfs[j].shape))]
+        virtual_psf *= cache
+
+    virtual_psf *= adj_psfs[i]
+    return virtual_psf / virtual_psf.sum()
+
+
+class TestVirtualPSFs(FusionTestCase):
+    def setUp(self):
+        super(TestVirtualPSFs, self).setUp()
+        make_data(self.path)
+
+    def test_virtual_psfs_match_the_spatial_calculation(self):
+        task = self.get_task("--fusion-method summative-opt")
+
+        for i, virtual_psf in enumerate(task.adj_psfs):
+            # The Fourier domain calculation is the same as the spatial one,
+            # without the truncation of the intermediate result, within the
+            # float32 precision
+            expected = spatial_virtual_psf(task.psfs, i, 'full')
+            numpy.testing.assert_allclose(virtual_psf, expected,
+                                          rtol=1e-4, atol=1e-5 * expected.max())
+
+            # The truncation of two consecutive 'same' mode convolutions
+            # changes the virtual PSFs by less than 1% of their maximum.
+            expected = spatial_virtual_psf(task.psfs, i, 'same')
+            numpy.testing.assert_allclose(virtual_psf, expected,
+                                          rtol=0, atol=1e-2 * expected.max())
+
+    def test_virtual_psfs_are_saved_and_reused(self):
+        task = self.get_task("--fusion-method summative-opt")
+        virtual_psfs = task.adj_psfs
+        checksum = hashlib.sha1(b"".join(psf.tobytes() for psf in task.psfs)).hexdigest()
+        views = list(task.views)
+
+        data = image_data.ImageData(self.path)
+        for view, virtual_psf in zip(views, virtual_psfs):
+            numpy.testing.assert_array_equal(
+                data.get_virtual_psf(task.options.scale, view, views, checksum), virtual_psf)
+
+            # The virtual PSFs of other PSFs, or other sets of views are not returned
+            self.assertIsNone(data.get_virtual_psf(task.options.scale, view, views, "0"))
+            self.assertIsNone(data.get_virtual_psf(task.options.scale, view, views[:2],
+                                                   checksum))
+        data.close()
+
+        # The saved virtual PSFs are used, if the PSFs have not changed
+        data = image_data.ImageData(self.path)
+        saved = numpy.full(virtual_psfs[0].shape, 1.0 / virtual_psfs[0].size,
+                           dtype=numpy.float32)
+        data.add_virtual_psf(saved, task.options.scale, views[0], views,
+                             [0.1] * 3, checksum)
+        data.close()
+
+        task = self.get_task("--fusion-method summative-opt")
+        numpy.testing.assert_array_equal(task.adj_psfs[0], saved)
+
+        # A changed PSF invalidates the saved virtual PSFs
+        data = image_data.ImageData(self.path)
+        data.set_active_image(views[1], 0, 100, "psf")
+        psf = data[:]
+        psf[4, 4, 4] += 0.01
+        data[:] = psf / psf.sum()
+        data.close()
+
+        task = self.get_task("--fusion-method summative-opt")
+        self.assertFalse(numpy.array_equal(task.adj_psfs[0], saved))
+        numpy.testing.assert_allclose(task.adj_psfs[0],
+                                      spatial_virtual_psf(task.psfs, 0, 'full'),
+                                      rtol=1e-4, atol=1e-5 * task.adj_psfs[0].max())
+
+
+class TestParallelFusion(FusionTestCase):
+    def setUp(self):
+        super(TestParallelFusion, self).setUp()
+        make_data(self.path)
+
+    def assert_matches_sequential(self, arguments):
+        # The contributions of the views are added up in the same order as
+        # in the sequential fusion, which is why the results are identical.
+        for method in ("summative", "multiplicative"):
+            common = "--fusion-method %s --max-nof-iterations 3 --blocks 2 --pad 4 " % method
+            expected, expected_progress = self.fuse(common)
+            result, progress = self.fuse(common + arguments)
+
+            numpy.testing.assert_array_equal(result, expected, err_msg=method)
+            numpy.testing.assert_array_equal(progress["tau1"], expected_progress["tau1"],
+                                             err_msg=method)
+
+    def test_parallel_views(self):
+        self.assert_matches_sequential("--parallel-views --num-workers 3")
+
+    def test_prefetch(self):
+        self.assert_matches_sequential("--prefetch-depth 2")
+        self.assert_matches_sequential("--prefetch-depth 2 --num-workers 2")
+
+    def test_process_backend(self):
+        self.assert_matches_sequential("--parallel-backend process --num-workers 2")
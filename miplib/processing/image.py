@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import ndimage
 from scipy.ndimage import interpolation
 
 from . import ndarray
@@ -62,6 +63,65 @@ def resize(image, size, order=3, verbose=False):  # type: (Image, tuple) -> Imag
     return Image(array, spacing)
 
 
+def halve_sampling(image, offset=0):  # type: (Image, int) -> Image
+    """
+    Downsample an image by two along every axis. The image is smoothed with
+    a [1/4, 1/2, 1/4] kernel, before every second pixel is taken. The pixel
+    centers of the result coincide with those of the original image, i.e.
+    pixel i of the result is at pixel 2*i + offset of the original.
+
+    :param image:   The Image object.
+    :param offset:  The index of the first pixel that is taken, 0 or 1.
+    :return:        The downsampled Image, with twice the spacing.
+    """
+    assert isinstance(image, Image)
+
+    array = ndimage.convolve1d(image.astype(np.float32), [.25, .5, .25], axis=0,
+                               mode='nearest')
+    for axis in range(1, image.ndim):
+        array = ndimage.convolve1d(array, [.25, .5, .25], axis=axis, mode='nearest')
+
+    array = array[(slice(offset, None, 2),) * image.ndim]
+
+    return Image(np.ascontiguousarray(array), [2 * i for i in image.spacing])
+
+
+def double_sampling(image, shape):  # type: (Image, tuple) -> Image
+    """
+    Upsample an image by two along every axis, with linear interpolation.
+    This is the inverse of halve_sampling(): pixel i of the original image is
+    at pixel 2*i of the result.
+
+    :param image:   The Image object.
+    :param shape:   The shape of the result. Each dimension should be either
+                    2*n - 1 or 2*n, n being the original size.
+    :return:        The upsampled Image, with half the spacing.
+    """
+    assert isinstance(image, Image)
+    assert len(shape) == image.ndim
+
+    array = np.asarray(image, dtype=np.float32)
+    for axis, size in enumerate(shape):
+        assert 2 * array.shape[axis] - 1 <= size <= 2 * array.shape[axis]
+        new_shape = list(array.shape)
+        new_shape[axis] = size
+        result = np.empty(new_shape, dtype=np.float32)
+
+        def index(start, stop=None, step=None):
+            idx = [slice(None)] * array.ndim
+            idx[axis] = slice(start, stop, step)
+            return tuple(idx)
+
+        n = array.shape[axis]
+        result[index(0, None, 2)] = array
+        result[index(1, 2 * n - 1, 2)] = 0.5 * (array[index(0, -1)] + array[index(1, None)])
+        if size == 2 * n:
+            result[index(-1, None)] = array[index(-1, None)]
+        array = result
+
+    return Image(array, [i / 2.0 for i in image.spacing])
+
+
 def apply_hanning(image):  # type: (Image) -> Image
     """
     Apply Hanning window to the image.
@@ -0,0 +1,76 @@
+"""
+prefetch.py
+
+This file contains a simple producer/consumer pipeline for reading image
+blocks ahead of time. The blocks are read in a background thread, in the
+order they are going to be processed, while the previous blocks are being
+convolved. The reads from slow (e.g. network mounted) files overlap with
+the FFTs, which release the GIL. The number of blocks that are read ahead
+is limited by the queue depth, which also limits the extra memory use.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BlockPrefetcher(object):
+    """
+    Read blocks in a background thread, ahead of their use. Iterating over
+    the prefetcher yields (key, block) pairs, in the order of the keys.
+    """
+
+    def __init__(self, read, keys, depth=2):
+        """
+        :param read: the function that reads a block. It is called with the
+                     items of a key as arguments, always in the same
+                     background thread.
+        :param keys: the keys of the blocks, as tuples, in the order in which
+                     the blocks are consumed
+        :param depth: the maximum number of blocks that are read ahead
+        """
+        assert depth > 0
+
+        self.read = read
+        self.depth = depth
+
+        self._keys = iter(keys)
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        for _ in range(depth):
+            self.__read_next()
+
+    def __read_next(self):
+        key = next(self._keys, None)
+        if key is not None:
+            self._pending.append((key, self._executor.submit(self.read, *key)))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._pending:
+            raise StopIteration
+
+        key, future = self._pending.popleft()
+        self.__read_next()
+
+        # Any exception from the read is raised here
+        return key, future.result()
+
+    def close(self):
+        """
+        Cancel the reads that have not started yet, and wait for the
+        background thread to finish.
+        """
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
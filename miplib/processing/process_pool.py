@@ -0,0 +1,175 @@
+"""
+process_pool.py
+
+This file contains the process pool backend of the blockwise RL
+deconvolution and fusion algorithms. The Python code in the block loop
+(slicing, padding and copying of the blocks) holds the GIL, which limits
+the speed-up that can be obtained with worker threads.
+
+The large arrays are shared between the processes through memory mapped
+files: the workers are given a reference to a file, rather than a copy of
+the data. The rest of the algorithm state (the options, PSFs and OTFs) is
+copied to each worker process once, when the pool is started. The workers
+call the methods of their copy of the algorithm object.
+"""
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from miplib.data.containers.image import Image
+
+# The algorithm object of a worker process
+_worker = None
+
+
+def get_memmap(array):
+    """
+    Get the memory mapped array that the given array is a view of.
+
+    :param array: a numpy.ndarray or its subclass
+    :return: the numpy.memmap, or None if the array is not memory mapped, or
+             if it is only a part of the memory mapped array
+    """
+    # The slices of a memmap are memmaps as well, but only the original one
+    # is a view of the memory map itself, and knows the correct file offset.
+    base = array
+    while isinstance(base.base, numpy.ndarray):
+        base = base.base
+
+    if not isinstance(base, numpy.memmap) or base.filename is None:
+        return None
+    if base.shape != array.shape or \
+            base.__array_interface__['data'][0] != array.__array_interface__['data'][0]:
+        return None
+
+    return base
+
+
+class MemmapReference(object):
+    """
+    A reference to a memory mapped array, that can be sent to another
+    process instead of the array itself.
+    """
+
+    def __init__(self, array):
+        """
+        :param array: a memory mapped array, or an Image of it
+        """
+        memmap = get_memmap(array)
+        assert memmap is not None
+
+        self.filename = memmap.filename
+        self.dtype = memmap.dtype
+        self.shape = memmap.shape
+        self.offset = memmap.offset
+        self.spacing = array.spacing if isinstance(array, Image) else None
+
+    def open(self, mode='r+'):
+        """
+        Map the array into the memory of the calling process.
+        """
+        array = numpy.memmap(self.filename, dtype=self.dtype, mode=mode,
+                             offset=self.offset, shape=self.shape)
+        if self.spacing is None:
+            return array
+        return Image(array, self.spacing)
+
+
+def share_array(array, directory, name, shape=None):
+    """
+    Get a reference to an array that can be shared between processes. If
+    the array is not memory mapped already, it is copied into a new file
+    in the given directory.
+
+    :param array: a numpy.ndarray or its subclass
+    :param directory: the directory for the new file
+    :param name: the file name
+    :param shape: the shape of the shared array. If it is larger than the
+                  array, the array is zero padded at the end of each axis.
+    :return: a MemmapReference
+    """
+    if get_memmap(array) is not None and (shape is None or tuple(shape) == array.shape):
+        return MemmapReference(array)
+
+    shape = array.shape if shape is None else tuple(shape)
+    memmap = numpy.memmap(os.path.join(directory, name), dtype=array.dtype,
+                          mode='w+', shape=shape)
+
+    # Copy one plane at a time, to avoid a full size temporary copy
+    for i in range(array.shape[0]):
+        memmap[(i,) + tuple(slice(0, n) for n in array.shape[1:])] = array[i]
+    memmap.flush()
+
+    if isinstance(array, Image):
+        return MemmapReference(Image(memmap, array.spacing))
+    return MemmapReference(memmap)
+
+
+def _initialize_worker(cls, state):
+    global _worker
+
+    worker = cls.__new__(cls)
+    for key, value in state.items():
+        if isinstance(value, MemmapReference):
+            value = value.open()
+        elif isinstance(value, list) and value and isinstance(value[0], MemmapReference):
+            value = [reference.open() for reference in value]
+        setattr(worker, key, value)
+
+    worker._setup_worker()
+    _worker = worker
+
+
+def _call_worker(method, args):
+    return getattr(_worker, method)(*args)
+
+
+class WorkerPool(object):
+    """
+    A pool of processes, each of which has a copy of an algorithm object.
+    """
+
+    def __init__(self, cls, state, num_workers):
+        """
+        :param cls: the algorithm class. The class must implement a
+                    _setup_worker() method, that is called after the
+                    state has been set.
+        :param state: a dictionary of the attributes of the algorithm object.
+                      The MemmapReferences, and lists of them, are opened
+                      in the worker processes.
+        :param num_workers: the number of processes
+        """
+        self.num_workers = num_workers
+        self.executor = ProcessPoolExecutor(max_workers=num_workers,
+                                            initializer=_initialize_worker,
+                                            initargs=(cls, state))
+
+    def map(self, method, *iterables):
+        """
+        Call a method of the algorithm object in the worker processes, for
+        each set of arguments.
+
+        :param method: the method name
+        :param iterables: the method arguments, as in the built-in map()
+        :return: a list of the results, in the order of the arguments
+        """
+        return list(self.executor.map(_call_worker, itertools.repeat(method),
+                                      zip(*iterables)))
+
+    def map_slabs(self, method, length):
+        """
+        Divide the first axis of an array into a slab for each worker, and
+        call a method with the start and stop index of each slab.
+
+        :param method: the method name
+        :param length: the length of the first axis
+        :return: a list of the results
+        """
+        bounds = numpy.linspace(0, length, min(self.num_workers, length) + 1).astype(int)
+        return self.map(method, bounds[:-1].tolist(), bounds[1:].tolist())
+
+    def shutdown(self):
+        self.executor.shutdown()
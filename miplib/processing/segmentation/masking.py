@@ -16,3 +16,30 @@ def make_local_intensity_based_mask(image, threshold, kernel_size=40, invert=Fal
         return np.invert(mask.astype(bool))
     else:
         return mask
+
+
+def make_noise_level_based_mask(image, threshold, kernel_size=15, invert=False):
+    """
+    Mark the pixels in which the local mean intensity exceeds the background
+    level by more than *threshold* times the noise level. The background level
+    and the noise level are estimated with the median and the median absolute
+    deviation of the local mean, which means that the image should be mostly
+    background.
+
+    :param image: an Image
+    :param threshold: the threshold, in units of the noise standard deviation
+    :param kernel_size: the size of the local mean filter
+    :param invert: return the background instead of the foreground
+    """
+    assert isinstance(image, Image)
+
+    blurred_image = ndimage.uniform_filter(image.astype(np.float32), size=kernel_size)
+
+    background = np.median(blurred_image)
+    noise = 1.4826 * np.median(np.abs(blurred_image - background))
+
+    mask = blurred_image > background + threshold * noise
+    if invert:
+        return np.invert(mask)
+    else:
+        return mask
@@ -136,6 +136,90 @@ static PyObject *update_estimate_poisson(PyObject *self, PyObject *args)
   return Py_BuildValue("dddd", exact, stable, unstable, negative);
 }
 
+static PyObject *update_estimate_poisson_tau1(PyObject *self, PyObject *args)
+{
+  PyObject* a = NULL;
+  PyObject* b = NULL;
+  npy_intp sz = 0, i;
+  double tmp, tmp2, tmp3;
+  npy_float32* a_data_sp = NULL;
+  npy_float32* b_data_sp = NULL;
+  npy_float64* a_data_dp = NULL;
+  npy_float64* b_data_dp = NULL;
+  double c, c0, c1, c2;
+  double unstable = 0.0, stable = 0.0, negative = 0.0, exact = 0.0;
+  double change = 0.0, norm = 0.0;
+  if (!PyArg_ParseTuple(args, "OOd", &a, &b, &c))
+    return NULL;
+  if (c<0 || c>0.5)
+    {
+      PyErr_SetString(PyExc_TypeError,"third argument must be non-negative and less than 0.5");
+      return NULL;
+    }
+  if (!(PyArray_Check(a) && PyArray_Check(b)))
+    {
+      PyErr_SetString(PyExc_TypeError,"first two arguments must be array objects");
+      return NULL;
+    }
+  sz = PyArray_SIZE(a);
+  if (sz != PyArray_SIZE(b))
+    {
+      PyErr_SetString(PyExc_TypeError,"array argument sizes must be equal");
+      return NULL;
+    }
+  c0 = -c;
+  c1 = 1.0+c;
+  c2 = 1.0-c;
+  if ((PyArray_TYPE(a) == PyArray_FLOAT32) && (PyArray_TYPE(b) == PyArray_FLOAT32))
+    {
+      a_data_sp = (npy_float32*)PyArray_DATA(a);
+      b_data_sp = (npy_float32*)PyArray_DATA(b);
+      for (i=0; i<sz; ++i)
+	{
+	  tmp = b_data_sp[i];
+	  tmp3 = a_data_sp[i];
+	  tmp2 = (a_data_sp[i] *= (tmp>0?tmp:0.0));
+	  if (tmp==0.0 || tmp==1.0)
+	    exact += tmp2;
+	  else if (((tmp>c0) && (tmp<c)) || ((tmp<c1) && (tmp>c2)))
+	    stable += tmp2;
+	  else
+	    unstable += tmp2;
+	  if (tmp2<0)
+	    negative += tmp2;
+	  change += fabs(tmp2 - tmp3);
+	  norm += fabs(tmp3);
+	}
+    }
+  else if ((PyArray_TYPE(a) == PyArray_FLOAT64) && (PyArray_TYPE(b) == PyArray_FLOAT64))
+    {
+      a_data_dp = (npy_float64*)PyArray_DATA(a);
+      b_data_dp = (npy_float64*)PyArray_DATA(b);
+      for (i=0; i<sz; ++i)
+	{
+	  tmp = b_data_dp[i];
+	  tmp3 = a_data_dp[i];
+	  tmp2 = (a_data_dp[i] *= (tmp>0?tmp:0.0));
+	  if (tmp==0.0 || tmp==1.0)
+	    exact += tmp2;
+	  else if (((tmp>c0) && (tmp<c)) || ((tmp<c1) && (tmp>c2)))
+	    stable += tmp2;
+	  else
+	    unstable += tmp2;
+	  if (tmp2<0)
+	    negative += tmp2;
+	  change += fabs(tmp2 - tmp3);
+	  norm += fabs(tmp3);
+	}
+    }
+  else
+    {
+      PyErr_SetString(PyExc_TypeError,"array argument types must be either float32 or float64");
+      return NULL;
+    }
+  return Py_BuildValue("dddddd", exact, stable, unstable, negative, change, norm);
+}
+
 static PyObject *update_estimate_gauss(PyObject *self, PyObject *args)
 {
   PyObject* a = NULL;
@@ -440,6 +524,8 @@ static PyObject *inverse_division_inplace(PyObject *self, PyObject *args)
   npy_float64 tmp2_dp;
   npy_complex128* a_data_dp = NULL;
   npy_float64* b_data_dp = NULL;
+  npy_float32* a_data_rsp = NULL;
+  npy_float64* a_data_rdp = NULL;
   if (!PyArg_ParseTuple(args, "OO", &a, &b))
     return NULL;
   if (!(PyArray_Check(a) && PyArray_Check(b)))
@@ -454,7 +540,37 @@ static PyObject *inverse_division_inplace(PyObject *self, PyObject *args)
       PyErr_SetString(PyExc_TypeError,"argument sizes must be equal");
       return NULL;
     }
-  if ((PyArray_TYPE(a) == PyArray_COMPLEX64) && (PyArray_TYPE(b) == PyArray_FLOAT32))
+  if (!PyArray_ISCOMPLEX((PyArrayObject*)a) &&
+      !(PyArray_ISCARRAY((PyArrayObject*)a) && PyArray_ISCARRAY_RO((PyArrayObject*)b)))
+    {
+      PyErr_SetString(PyExc_TypeError,"real arguments must be C contiguous arrays");
+      return NULL;
+    }
+  if ((PyArray_TYPE(a) == PyArray_FLOAT32) && (PyArray_TYPE(b) == PyArray_FLOAT32))
+    {
+      a_data_rsp = (npy_float32*)PyArray_DATA(a);
+      b_data_sp = (npy_float32*)PyArray_DATA(b);
+      for (i=0; i<sz; ++i)
+	{
+	  if (a_data_rsp[i]==0.0 || b_data_sp[i]==0.0)
+	    a_data_rsp[i] = 0.0;
+	  else
+	    a_data_rsp[i] = b_data_sp[i] / a_data_rsp[i];
+	}
+    }
+  else if ((PyArray_TYPE(a) == PyArray_FLOAT64) && (PyArray_TYPE(b) == PyArray_FLOAT64))
+    {
+      a_data_rdp = (npy_float64*)PyArray_DATA(a);
+      b_data_dp = (npy_float64*)PyArray_DATA(b);
+      for (i=0; i<sz; ++i)
+	{
+	  if (a_data_rdp[i]==0.0 || b_data_dp[i]==0.0)
+	    a_data_rdp[i] = 0.0;
+	  else
+	    a_data_rdp[i] = b_data_dp[i] / a_data_rdp[i];
+	}
+    }
+  else if ((PyArray_TYPE(a) == PyArray_COMPLEX64) && (PyArray_TYPE(b) == PyArray_FLOAT32))
     {
       a_data_sp = (npy_complex64*)PyArray_DATA(a);
       b_data_sp = (npy_float32*)PyArray_DATA(b);
@@ -494,7 +610,7 @@ static PyObject *inverse_division_inplace(PyObject *self, PyObject *args)
     }
   else
     {
-      PyErr_SetString(PyExc_TypeError,"argument types must be complex64 and float32");
+      PyErr_SetString(PyExc_TypeError,"argument types must be complex64 and float32, or both real");
       return NULL;
     }
   return Py_BuildValue("");
@@ -1031,6 +1147,7 @@ static PyMethodDef module_methods[] = {
   {"inverse_division_inplace",  inverse_division_inplace, METH_VARARGS, "inverse_division_inplace(a,b) == `a = b/a if a!=0 else 0`"},
   {"inverse_subtraction_inplace",  inverse_subtraction_inplace, METH_VARARGS, "inverse_subtraction_inplace(a,b,c) == `a = b-c*a`"},
   {"update_estimate_poisson", update_estimate_poisson, METH_VARARGS, "update_estimate_poisson(a,b,epsilon) -> e,s,u,n == `a *= b, s,u are photon counts`"},
+  {"update_estimate_poisson_tau1", update_estimate_poisson_tau1, METH_VARARGS, "update_estimate_poisson_tau1(a,b,epsilon) -> e,s,u,n,d,m == `a *= b, s,u are photon counts, d = sum(|a_new - a|), m = sum(|a|)`"},
   {"update_estimate_gauss", update_estimate_gauss, METH_VARARGS, "update_estimate_gauss(a,b,epsilon, alpha) -> e,s,u,n == `a += alpha * b, s,u are photon counts`"},
   {"div_unit_grad", div_unit_grad, METH_VARARGS, "div_unit_grad(f, (hx,hy,hz)) == `div(grad f/|grad f|)`"},
   {"div_unit_grad1", div_unit_grad1, METH_VARARGS, "div_unit_grad1(f, hx) == `div(grad f/|grad f|)`"},
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+
+from ..block_cache import BlockCache
+
+
+class TestBlockCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.block = numpy.ones((8, 16, 16), dtype=numpy.uint16)
+        self.block_bytes = self.block.size * numpy.dtype(numpy.float32).itemsize
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_blocks_are_cached_as_float32(self):
+        cache = BlockCache(4 * self.block_bytes)
+        self.assertIsNone(cache.get((0, 0, 100, (0, 0, 0))))
+
+        cache.put((0, 0, 100, (0, 0, 0)), self.block)
+        block = cache.get((0, 0, 100, (0, 0, 0)))
+
+        self.assertEqual(block.dtype, numpy.float32)
+        self.assertFalse(block.flags.writeable)
+        numpy.testing.assert_array_equal(block, self.block)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_blocks_are_dropped(self):
+        cache = BlockCache(int(2.5 * self.block_bytes))
+
+        for i in range(3):
+            cache.put(i, self.block * i)
+            # Block 0 is used again, which makes block 1 the oldest one
+            cache.get(0)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 2 * self.block_bytes)
+        self.assertIsNone(cache.get(1))
+        numpy.testing.assert_array_equal(cache.get(0), 0)
+
+    def test_dropped_blocks_are_spilled(self):
+        cache = BlockCache(self.block_bytes, spill_directory=self.directory)
+
+        for i in range(3):
+            cache.put(i, self.block * i)
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        numpy.testing.assert_array_equal(cache.get(1), 1)
+
+        cache.clear()
+        self.assertEqual(os.listdir(self.directory), [])
@@ -0,0 +1,106 @@
+import itertools
+from unittest import TestCase, mock
+
+import numpy
+from scipy.fft import next_fast_len
+from scipy.ndimage import gaussian_filter
+
+from miplib.data.containers.image import Image
+from .. import blocks
+from miplib.processing.segmentation import masking
+from ..blocks import plan_blocks, split_by_block_count, find_empty_blocks, \
+    get_block_budget, block_voxel_bytes_c, find_background_blocks
+
+
+class TestPlanBlocks(TestCase):
+    def test_single_block_with_large_budget(self):
+        image_size = numpy.array([64, 512, 512])
+        block_size, new_size = plan_blocks(image_size, (31, 31, 31), 8, 2 ** 40)
+
+        numpy.testing.assert_array_equal(block_size, image_size)
+        numpy.testing.assert_array_equal(new_size, image_size)
+
+    def test_budget_is_respected(self):
+        image_size = numpy.array([100, 1000, 900])
+        psf_size = (21, 21, 21)
+        max_memory = 256 * 1024 ** 2
+
+        for workers in (1, 4):
+            block_size, new_size = plan_blocks(image_size, psf_size, 16, max_memory,
+                                               num_workers=workers)
+            fft_size = [next_fast_len(b + 2 * 16 + p - 1, real=True)
+                        for b, p in zip(block_size, psf_size)]
+
+            self.assertLessEqual(numpy.prod(fft_size) * block_voxel_bytes_c * workers,
+                                 max_memory)
+            self.assertTrue((new_size >= image_size).all())
+            self.assertTrue((new_size % block_size == 0).all())
+            self.assertTrue((new_size - image_size < block_size).all())
+
+    def test_too_small_budget(self):
+        with self.assertRaises(ValueError):
+            plan_blocks(numpy.array([256, 256]), (63, 63), 32, 1024)
+
+    def test_block_budget(self):
+        reserved = [("image", 400), ("estimates", 800)]
+        self.assertEqual(get_block_budget(2000, reserved), 800)
+
+    def test_reserved_memory_exceeds_the_budget(self):
+        with self.assertRaisesRegex(ValueError, "image 400, estimates 800"):
+            get_block_budget(1000, [("image", 400), ("estimates", 800)])
+
+
+class TestSplitByBlockCount(TestCase):
+    def test_split(self):
+        block_size, image_size = split_by_block_count(numpy.array([30, 101, 100]), 8)
+
+        numpy.testing.assert_array_equal(block_size, [8, 51, 100])
+        numpy.testing.assert_array_equal(image_size, [32, 102, 100])
+
+
+class TestFindEmptyBlocks(TestCase):
+    def test_margin_includes_neighbours(self):
+        mask = numpy.zeros((40, 40), dtype=bool)
+        mask[5, 5] = True
+
+        self.assertEqual(find_empty_blocks(mask, (10, 10), 0),
+                         set(itertools.product(range(0, 40, 10), range(0, 40, 10))) - {(0, 0)})
+
+        # With a margin, the object is seen from the neighbouring blocks
+        empty = find_empty_blocks(mask, (10, 10), 5)
+        self.assertNotIn((0, 10), empty)
+        self.assertNotIn((10, 10), empty)
+        self.assertIn((0, 20), empty)
+        self.assertEqual(len(empty), 12)
+
+
+class TestFindBackgroundBlocks(TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        shape = (30, 60, 62)
+        truth = numpy.zeros(shape, dtype=numpy.float32)
+        truth[tuple(rng.randint(2, n // 3, 40) for n in shape)] = 1000
+        self.image = rng.poisson(gaussian_filter(truth, 1.5) + 5).astype(numpy.float32)
+
+    def test_matches_the_whole_image_mask(self):
+        margin = numpy.array([5, 7, 7])
+        for block_size in ((8, 20, 16), (30, 15, 31), (7, 9, 11)):
+            mask = masking.make_noise_level_based_mask(Image(self.image, [0.1] * 3),
+                                                       threshold=5, kernel_size=11)
+            expected = find_empty_blocks(mask, block_size, margin)
+            result = find_background_blocks(self.image, block_size, margin, threshold=5,
+                                            kernel_size=11)
+
+            self.assertGreater(len(expected), 0)
+            self.assertEqual(result, expected, block_size)
+
+    def test_subsampled_noise_level(self):
+        block_size = (8, 20, 16)
+        expected = find_background_blocks(self.image, block_size, 5, threshold=5,
+                                          kernel_size=11)
+        with mock.patch.object(blocks, "noise_samples_c", 5000):
+            result = find_background_blocks(self.image, block_size, 5, threshold=5,
+                                            kernel_size=11)
+
+        self.assertEqual(result, expected)
+
@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+
+from ..checkpoint import save_checkpoint, load_checkpoint
+
+
+class TestCheckpoint(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_latest_checkpoint_is_loaded(self):
+        progress = numpy.random.rand(20, 8).astype(numpy.float32)
+
+        for iteration in (5, 10):
+            estimate = numpy.full((8, 16, 16), iteration, dtype=numpy.float32)
+            save_checkpoint(self.directory, estimate, iteration, progress)
+
+        estimate, iteration, saved_progress = load_checkpoint(self.directory)
+
+        self.assertEqual(iteration, 10)
+        numpy.testing.assert_array_equal(estimate, 10)
+        numpy.testing.assert_array_equal(saved_progress, progress[:10])
+
+        # The estimates of the older checkpoints are removed
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["checkpoint.npz", "estimate_10.npy"])
+
+    def test_missing_checkpoint(self):
+        with self.assertRaises(ValueError):
+            load_checkpoint(self.directory)
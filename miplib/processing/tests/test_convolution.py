@@ -0,0 +1,74 @@
+from unittest import TestCase
+
+import numpy
+from scipy.signal import fftconvolve
+
+from ..convolution import FourierConvolver
+
+
+class TestFourierConvolver(TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(1)
+        self.block_2d = rng.rand(40, 37).astype(numpy.float32)
+        self.psf_2d = rng.rand(9, 7).astype(numpy.float32)
+        self.block_3d = rng.rand(12, 20, 18).astype(numpy.float32)
+        self.psf_3d = rng.rand(5, 7, 7).astype(numpy.float32)
+
+    def test_convolve(self):
+        for block, psf in ((self.block_2d, self.psf_2d), (self.block_3d, self.psf_3d)):
+            convolver = FourierConvolver(psf)
+            expected = fftconvolve(block, psf, mode='same')
+            numpy.testing.assert_allclose(convolver.convolve(block), expected,
+                                          rtol=1e-4, atol=1e-4)
+
+    def test_convolve_adjoint(self):
+        for block, psf in ((self.block_2d, self.psf_2d), (self.block_3d, self.psf_3d)):
+            convolver = FourierConvolver(psf)
+            adj_psf = psf[(slice(None, None, -1),) * psf.ndim]
+            expected = fftconvolve(block, adj_psf, mode='same')
+            numpy.testing.assert_allclose(convolver.convolve_adjoint(block), expected,
+                                          rtol=1e-4, atol=1e-4)
+
+    def test_convolve_stack(self):
+        convolver = FourierConvolver(self.psf_2d)
+        stack = numpy.stack([self.block_2d, 2 * self.block_2d])
+
+        result = convolver.convolve(stack)
+
+        self.assertEqual(result.shape, stack.shape)
+        for image, image_result in zip(stack, result):
+            numpy.testing.assert_allclose(image_result, convolver.convolve(image),
+                                          rtol=1e-4, atol=1e-4)
+
+    def test_otf_is_cached(self):
+        convolver = FourierConvolver(self.psf_2d)
+        otf = convolver.get_otf(self.block_2d.shape)
+        convolver.convolve(self.block_2d)
+
+        self.assertIs(convolver.get_otf(self.block_2d.shape), otf)
+
+    def test_even_sized_kernel(self):
+        psf = numpy.random.RandomState(2).rand(8, 6).astype(numpy.float32)
+        convolver = FourierConvolver(psf)
+
+        expected = fftconvolve(self.block_2d, psf, mode='same')
+        numpy.testing.assert_allclose(convolver.convolve(self.block_2d), expected,
+                                      rtol=1e-4, atol=1e-4)
+
+        # The adjoint is one voxel off from the 'same' mode convolution with
+        # the mirrored kernel, which starts at (p - 1) // 2 instead of p // 2
+        full = fftconvolve(self.block_2d, psf[::-1, ::-1], mode='full')
+        expected = full[tuple(slice(p // 2, p // 2 + s)
+                              for p, s in zip(psf.shape, self.block_2d.shape))]
+        numpy.testing.assert_allclose(convolver.convolve_adjoint(self.block_2d),
+                                      expected, rtol=1e-4, atol=1e-4)
+
+    def test_adjoint_is_exact(self):
+        rng = numpy.random.RandomState(3)
+        for psf in (self.psf_2d, rng.rand(8, 6).astype(numpy.float32)):
+            convolver = FourierConvolver(psf)
+            other = rng.rand(*self.block_2d.shape).astype(numpy.float32)
+
+            forward = numpy.vdot(convolver.convolve(self.block_2d), other)
+            adjoint = numpy.vdot(self.block_2d, convolver.convolve_adjoint(other))
+            self.assertAlmostEqual(forward / adjoint, 1.0, places=5)
@@ -0,0 +1,267 @@
+import itertools
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+from scipy.ndimage import gaussian_filter
+from scipy.signal import fftconvolve
+
+import miplib.processing.ops_ext as ops_ext
+from miplib.data.containers.image import Image
+from miplib.data.io import read, write
+from miplib.processing.deconvolution.deconvolve import DeconvolutionRL
+from miplib.ui.cli.miplib_entry_point_options import get_deconvolve_script_options
+
+
+def make_image(shape=(24, 48, 48), sigma=(2.0, 1.5, 1.5), seed=0, extent=1.0):
+    """
+    Make a blurred and noisy test image of random point sources, and its PSF.
+
+    :param extent: the point sources are placed in this fraction of the image,
+                   along each axis; the rest of the image is background
+    """
+    rng = numpy.random.RandomState(seed)
+    spacing = [0.1] * len(shape)
+
+    truth = numpy.zeros(shape, dtype=numpy.float32)
+    truth[tuple(rng.randint(0, int(n * extent), 40) for n in shape)] = 1000
+
+    psf = numpy.zeros((11,) * len(shape), dtype=numpy.float32)
+    psf[(5,) * len(shape)] = 1
+    psf = gaussian_filter(psf, sigma)
+    psf /= psf.sum()
+
+    image = rng.poisson(gaussian_filter(truth, sigma) + 5).astype(numpy.float32)
+
+    return Image(image, spacing), Image(psf, spacing)
+
+
+def get_i_divergence(estimate, image, psf):
+    """
+    The I-divergence of the blurred estimate from the image, which the RL
+    iteration minimizes.
+    """
+    image = numpy.asarray(image, dtype=numpy.float64)
+    blurred = numpy.maximum(fftconvolve(estimate.astype(numpy.float64), psf, mode='same'),
+                            1e-12)
+    log_ratio = numpy.log(numpy.maximum(image, 1e-12) / blurred)
+    return numpy.sum(numpy.where(image > 0, image * log_ratio, 0) - image + blurred)
+
+
+class InterruptedDeconvolution(DeconvolutionRL):
+    """
+    Raises a KeyboardInterrupt in the middle of the given iteration, after
+    the prediction of the accelerated iteration.
+    """
+    interrupt_at = 3
+
+    def compute_estimate(self):
+        if self.iteration_count == self.interrupt_at:
+            raise KeyboardInterrupt
+        return super(InterruptedDeconvolution, self).compute_estimate()
+
+
+def deconvolve(image, psf, arguments, task_class=DeconvolutionRL):
+    options = get_deconvolve_script_options(["image", "psf"] + arguments.split())
+    task = task_class(image, psf, None, options)
+    try:
+        task.execute()
+        return numpy.array(task.get_result())
+    finally:
+        task.close()
+
+
+class TestDeconvolutionRL(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image, self.psf = make_image()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_memory_mapped_image_gives_the_same_result(self):
+        path = os.path.join(self.directory, "image.tif")
+        write.image_out_of_core(path, self.image)
+        image = read.get_image_memmap(path)
+
+        arguments = "--max-nof-iterations 4 --blocks 4 --pad 6"
+        expected = deconvolve(self.image, self.psf, arguments)
+        result = deconvolve(image, self.psf, arguments + " --memmap-estimates")
+
+        numpy.testing.assert_array_equal(result, expected)
+
+    def test_identical_depth_variant_psfs_match_a_single_psf(self):
+        arguments = "--max-nof-iterations 4 --blocks 4 --pad 6"
+        expected = deconvolve(self.image, self.psf, arguments)
+        result = deconvolve(self.image, [self.psf] * 3, arguments +
+                            " --psf-depths 0.4,1.2,2.0")
+
+        numpy.testing.assert_allclose(result, expected, rtol=1e-4, atol=1e-3)
+
+    def test_depth_variant_psf_weights_sum_to_one(self):
+        options = get_deconvolve_script_options(
+            ["image", "psf", "--blocks", "4", "--pad", "6",
+             "--psf-depths", "0.4,1.2,2.0"])
+        task = DeconvolutionRL(self.image, [self.psf] * 3, None, options)
+        try:
+            weights = task.psf_weights
+            self.assertEqual(weights.shape, (3, self.image.shape[0] + 2 * 6))
+            numpy.testing.assert_allclose(weights.sum(axis=0), 1, rtol=1e-6)
+            self.assertTrue((weights >= 0).all())
+        finally:
+            task.close()
+
+    def test_interrupted_acceleration_restores_the_estimate(self):
+        arguments = "--blocks 4 --pad 6 --rl-acceleration biggs-andrews"
+        expected = deconvolve(self.image, self.psf,
+                              arguments + " --max-nof-iterations 3")
+        result = deconvolve(self.image, self.psf,
+                            arguments + " --max-nof-iterations 6",
+                            task_class=InterruptedDeconvolution)
+
+        numpy.testing.assert_array_equal(result, expected)
+
+    def test_pyramid_estimate(self):
+        for shape in ((24, 48, 48), (23, 37, 40)):
+            image, psf = make_image(shape)
+            for detail in ("", " --pyramid-detail"):
+                options = get_deconvolve_script_options(
+                    ["image", "psf", "--first-estimate", "pyramid", "--pyramid-levels", "3",
+                     "--pyramid-iterations", "3"] + detail.split())
+                task = DeconvolutionRL(image, psf, None, options)
+                try:
+                    estimate = numpy.asarray(task._DeconvolutionRL__get_pyramid_estimate())
+                finally:
+                    task.close()
+
+                self.assertEqual(estimate.shape, shape)
+                self.assertGreaterEqual(estimate.min(), 0)
+                photon_count = numpy.asarray(image).sum(dtype=numpy.float64)
+                self.assertAlmostEqual(estimate.sum(dtype=numpy.float64) / photon_count, 1.0,
+                                       places=4)
+
+    def test_blockwise_tv_matches_the_whole_array(self):
+        rng = numpy.random.RandomState(1)
+        tv_lambda = 0.002
+
+        for image, psf in (make_image(), make_image((48, 52), (1.5, 1.5))):
+            for arguments in ("--blocks 4 --pad 0", "--blocks 8 --pad 6"):
+                options = get_deconvolve_script_options(
+                    ["image", "psf", "--tv-lambda", str(tv_lambda)] + arguments.split())
+                task = DeconvolutionRL(image, psf, None, options)
+                try:
+                    shape = task.estimate.shape
+                    estimate = (rng.rand(*shape) + 0.5).astype(numpy.float32)
+                    update = (rng.rand(*shape) + 0.5).astype(numpy.float32)
+                    task.estimate[:] = estimate
+
+                    # The regularization of the whole estimate at once
+                    if estimate.ndim == 2:
+                        dv_est = ops_ext.div_unit_grad(numpy.expand_dims(estimate, 0),
+                                                       [1] + list(image.spacing))[0]
+                    else:
+                        dv_est = ops_ext.div_unit_grad(estimate, image.spacing)
+                    expected = update / (1.0 - tv_lambda * dv_est)
+
+                    result = numpy.zeros(shape, dtype=numpy.float32)
+                    iterables = (range(0, m, n) for m, n in zip(shape, task.block_size))
+                    for idx in itertools.product(*iterables):
+                        block_idx = tuple(slice(i, i + n) for i, n in zip(idx, task.block_size))
+                        result[block_idx] = task._DeconvolutionRL__regularize_block(
+                            idx, update[block_idx].copy())
+                finally:
+                    task.close()
+
+                self.assertGreater(numpy.prod(shape // task.block_size), 1)
+                numpy.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6,
+                                              err_msg=arguments)
+
+    def test_skipped_background_blocks_are_close_to_the_full_update(self):
+        image, psf = make_image((30, 60, 62), extent=1.0 / 3)
+        arguments = "--max-nof-iterations 10 --blocks 24 --pad 6"
+        expected = deconvolve(image, psf, arguments)
+        result = deconvolve(image, psf, arguments + " --skip-background-blocks 5")
+
+        options = get_deconvolve_script_options(
+            ["image", "psf", "--skip-background-blocks", "5"] + arguments.split())
+        task = DeconvolutionRL(image, psf, None, options)
+        try:
+            background = numpy.zeros(image.shape, dtype=bool)
+            for idx in task.background_blocks:
+                background[tuple(slice(i, i + n) for i, n in zip(idx, task.block_size))] = True
+        finally:
+            task.close()
+        self.assertTrue(background.any())
+
+        difference = numpy.abs(result - expected)
+        peak = expected.max()
+
+        # The foreground is not affected by the skipped blocks
+        self.assertLess(difference[~background].max(), 0.05 * peak)
+
+        # In the background blocks the mean level is kept, and the
+        # difference is within the noise of the full update. Only at the
+        # image borders, the noise of the full update is amplified further.
+        numpy.testing.assert_allclose(result[background].mean(),
+                                      expected[background].mean(), rtol=0.01)
+        rms = numpy.sqrt(numpy.mean((result - expected)[background] ** 2))
+        self.assertLess(rms, expected[background].std())
+
+        interior = tuple(slice(n // 2, -(n // 2)) for n in psf.shape)
+        self.assertLess(difference[interior].max(), 0.05 * peak)
+
+
+    def test_resolution_is_recorded_only_with_frc_stopping(self):
+        rng = numpy.random.RandomState(0)
+        spacing = [0.05, 0.05]
+        truth = gaussian_filter(rng.rand(128, 128).astype(numpy.float32), 2.0) * 1000
+        psf = numpy.zeros((15, 15), dtype=numpy.float32)
+        psf[7, 7] = 1
+        psf = gaussian_filter(psf, 1.5)
+        image = Image(rng.poisson(gaussian_filter(truth, 1.5) + 5).astype(numpy.float32),
+                      spacing)
+        psf = Image(psf / psf.sum(), spacing)
+
+        for arguments in ("", "--rl-frc-stop 0.0001 --rl-frc-interval 2"):
+            options = get_deconvolve_script_options(
+                ["image", "psf", "--max-nof-iterations", "4"] + arguments.split())
+            task = DeconvolutionRL(image, psf, None, options)
+            try:
+                task.execute()
+                progress = task.progress_parameters
+            finally:
+                task.close()
+
+            if arguments:
+                self.assertEqual(progress.columns[-1], "resolution")
+                # The resolution is evaluated every --rl-frc-interval iterations
+                self.assertTrue(numpy.isnan(progress["resolution"][0]))
+                self.assertTrue(numpy.isfinite(progress["resolution"][1]))
+            else:
+                self.assertNotIn("resolution", progress.columns)
+
+    def test_threaded_blocks_match_the_sequential_run(self):
+        # Every block writes to its own part of the new estimate, and the
+        # estimate is updated only after all the blocks are done, which is
+        # why the results are identical.
+        arguments = "--max-nof-iterations 4 --blocks 8 --pad 6"
+        expected = deconvolve(self.image, self.psf, arguments + " --num-workers 1")
+        result = deconvolve(self.image, self.psf, arguments + " --num-workers 2")
+
+        numpy.testing.assert_array_equal(result, expected)
+
+    def test_acceleration_reaches_a_lower_i_divergence(self):
+        def deconvolve_i_divergence(arguments):
+            result = deconvolve(self.image, self.psf, arguments)
+            return get_i_divergence(result, self.image, numpy.asarray(self.psf))
+
+        accelerated = deconvolve_i_divergence(
+            "--max-nof-iterations 10 --rl-acceleration biggs-andrews")
+
+        # The accelerated iteration gets further than the plain one in the
+        # same number of iterations, and as far as in twice the iterations.
+        self.assertLess(accelerated, deconvolve_i_divergence("--max-nof-iterations 10"))
+        self.assertLess(accelerated, deconvolve_i_divergence("--max-nof-iterations 20"))
+
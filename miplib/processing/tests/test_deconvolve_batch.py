@@ -0,0 +1,58 @@
+from unittest import TestCase
+
+import numpy
+from scipy.ndimage import gaussian_filter
+
+from miplib.data.containers.image import Image
+from miplib.processing.deconvolution.deconvolve import DeconvolutionRL
+from miplib.processing.deconvolution.deconvolve_batch import DeconvolutionRLBatch
+from miplib.ui.cli.miplib_entry_point_options import get_deconvolve_script_options
+
+
+class TestDeconvolutionRLBatch(TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        spacing = [0.05, 0.05]
+
+        psf = numpy.zeros((15, 15), dtype=numpy.float32)
+        psf[7, 7] = 1
+        psf = gaussian_filter(psf, 2.0)
+        self.psf = Image(psf / psf.sum(), spacing)
+
+        # The second image only contains background, which is why it
+        # reaches the tau1 threshold before the others.
+        self.images = []
+        for index in range(3):
+            truth = numpy.zeros((64, 64), dtype=numpy.float32)
+            if index != 1:
+                truth[tuple(rng.randint(0, 64, (2, 20)))] = 500
+            image = rng.poisson(gaussian_filter(truth, 2.0) + 10)
+            self.images.append(Image(image.astype(numpy.float32), spacing))
+
+        self.arguments = ["image", "psf", "--max-nof-iterations", "12",
+                          "--stop-tau", "0.02"]
+
+    def test_batch_matches_separate_runs(self):
+        options = get_deconvolve_script_options(self.arguments + ["--batch-size", "3"])
+        batch = DeconvolutionRLBatch(self.images, self.psf, options)
+        try:
+            batch.execute()
+            results = batch.get_results()
+            iteration_counts = batch.iteration_counts.copy()
+        finally:
+            batch.close()
+
+        # One of the images converges early, and must not be updated
+        # while the rest of the batch continues.
+        self.assertLess(iteration_counts[1], iteration_counts.max())
+
+        for index, image in enumerate(self.images):
+            task = DeconvolutionRL(image, self.psf, None,
+                                   get_deconvolve_script_options(self.arguments))
+            try:
+                task.execute()
+                self.assertEqual(iteration_counts[index], task.iteration_count)
+                numpy.testing.assert_allclose(results[index], task.get_result(),
+                                              rtol=1e-5, atol=1e-5)
+            finally:
+                task.close()
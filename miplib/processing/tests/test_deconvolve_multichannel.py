@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+from scipy.ndimage import gaussian_filter
+
+from miplib.data.containers.image import Image
+from miplib.processing.deconvolution.deconvolve import DeconvolutionRL
+from miplib.processing.deconvolution.deconvolve_multichannel import \
+    DeconvolutionRLMultiChannel
+from miplib.ui.cli.miplib_entry_point_options import get_deconvolve_script_options
+
+
+class TestDeconvolutionRLMultiChannel(TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        spacing = [0.05, 0.05]
+
+        # The channels have different backgrounds and PSFs
+        channels = []
+        self.psfs = []
+        for channel, (background, sigma) in enumerate(((5, 1.5), (40, 2.5))):
+            truth = numpy.zeros((96, 96), dtype=numpy.float32)
+            truth[tuple(rng.randint(0, 96, (2, 30)))] = 500
+            psf = numpy.zeros((15, 15), dtype=numpy.float32)
+            psf[7, 7] = 1
+            psf = gaussian_filter(psf, sigma)
+            self.psfs.append(Image(psf / psf.sum(), spacing))
+            image = gaussian_filter(truth, sigma) + background
+            channels.append(rng.poisson(image).astype(numpy.float32))
+
+        self.image = Image(numpy.stack(channels), spacing)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def deconvolve(self, arguments):
+        options = get_deconvolve_script_options(
+            ["image", "psf", "--blocks", "4", "--pad", "8", "--rl-auto-background",
+             "--num-workers", "2"] + arguments)
+        task = DeconvolutionRLMultiChannel(self.image, self.psfs, options)
+        try:
+            task.execute()
+            return numpy.array(task.get_result())
+        finally:
+            task.close()
+
+    def test_concurrent_channels_match_separate_runs(self):
+        options = get_deconvolve_script_options(
+            ["image", "psf", "--max-nof-iterations", "5", "--blocks", "4",
+             "--pad", "8", "--rl-auto-background", "--num-workers", "2"])
+
+        task = DeconvolutionRLMultiChannel(self.image, self.psfs, options)
+        try:
+            task.execute()
+            result = task.get_result()
+        finally:
+            task.close()
+
+        for channel in range(2):
+            channel_options = get_deconvolve_script_options(
+                ["image", "psf", "--max-nof-iterations", "5", "--blocks", "4",
+                 "--pad", "8", "--rl-auto-background"])
+            single = DeconvolutionRL(Image(self.image[channel], self.image.spacing),
+                                     self.psfs[channel], None, channel_options)
+            try:
+                single.execute()
+                numpy.testing.assert_allclose(result[channel], single.get_result(),
+                                              rtol=1e-5, atol=1e-5)
+            finally:
+                single.close()
+
+    def test_concurrent_channels_are_checkpointed_and_resumed_separately(self):
+        checkpoint_dir = os.path.join(self.directory, "checkpoints")
+        arguments = ["--checkpoint-dir", checkpoint_dir, "--checkpoint-interval", "2"]
+
+        self.deconvolve(arguments + ["--max-nof-iterations", "2"])
+        self.assertEqual(sorted(os.listdir(checkpoint_dir)), ["channel_0", "channel_1"])
+
+        result = self.deconvolve(arguments + ["--max-nof-iterations", "5", "--resume"])
+        expected = self.deconvolve(["--max-nof-iterations", "5"])
+
+        numpy.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-5)
@@ -0,0 +1,23 @@
+from unittest import TestCase
+
+import numpy
+
+import miplib.processing.ops_ext as ops_ext
+
+
+class TestUpdateEstimatePoisson(TestCase):
+    def test_tau1_is_accumulated_in_the_update(self):
+        estimate = numpy.random.rand(20, 30).astype(numpy.float32)
+        ratio = 2 * numpy.random.rand(20, 30).astype(numpy.float32)
+        prev_estimate = estimate.copy()
+        expected = estimate.copy()
+
+        statistics = ops_ext.update_estimate_poisson(expected, ratio, 0.05)
+        e, s, u, n, change, norm = ops_ext.update_estimate_poisson_tau1(estimate, ratio, 0.05)
+
+        numpy.testing.assert_array_equal(estimate, expected)
+        self.assertEqual((e, s, u, n), statistics)
+
+        tau1 = numpy.abs(estimate.astype(numpy.float64) - prev_estimate).sum() / \
+            numpy.abs(prev_estimate.astype(numpy.float64)).sum()
+        self.assertAlmostEqual(change / norm, tau1)
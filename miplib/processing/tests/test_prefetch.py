@@ -0,0 +1,32 @@
+import threading
+from unittest import TestCase
+
+from ..prefetch import BlockPrefetcher
+
+
+class TestBlockPrefetcher(TestCase):
+    def test_blocks_are_read_in_order_in_a_background_thread(self):
+        threads = set()
+
+        def read(view, pos):
+            threads.add(threading.current_thread())
+            return view * 10 + pos
+
+        keys = [(view, pos) for view in range(3) for pos in range(4)]
+        with BlockPrefetcher(read, keys, depth=2) as prefetcher:
+            blocks = list(prefetcher)
+
+        self.assertEqual([key for key, _ in blocks], keys)
+        self.assertEqual([block for _, block in blocks],
+                         [view * 10 + pos for view, pos in keys])
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_read_errors_are_raised_to_the_consumer(self):
+        def read(pos):
+            if pos == 1:
+                raise IOError("read failed")
+            return pos
+
+        with BlockPrefetcher(read, [(0,), (1,), (2,)], depth=1) as prefetcher:
+            self.assertEqual(next(prefetcher), ((0,), 0))
+            self.assertRaises(IOError, next, prefetcher)
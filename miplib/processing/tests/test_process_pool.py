@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+
+from miplib.data.containers.image import Image
+from ..process_pool import MemmapReference, get_memmap, share_array
+
+
+class TestProcessPool(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_array_is_zero_padded(self):
+        array = numpy.random.rand(5, 6, 7).astype(numpy.float32)
+
+        shared = share_array(Image(array, [0.1, 0.1, 0.1]), self.directory,
+                             "array.dat", shape=(6, 8, 7)).open(mode='r')
+
+        self.assertIsInstance(shared, Image)
+        self.assertEqual(shared.shape, (6, 8, 7))
+        numpy.testing.assert_array_equal(shared[:5, :6], array)
+        numpy.testing.assert_array_equal(shared[5], 0)
+        numpy.testing.assert_array_equal(shared[:, 6:], 0)
+
+    def test_memmap_is_shared_in_place(self):
+        filename = os.path.join(self.directory, "estimate.dat")
+        memmap = numpy.memmap(filename, dtype=numpy.float32, mode='w+', shape=(4, 4))
+
+        reference = share_array(memmap, self.directory, "copy.dat")
+        self.assertEqual(reference.filename, filename)
+
+        reference.open()[1] = 2
+        numpy.testing.assert_array_equal(memmap[1], 2)
+
+    def test_memmap_slice_is_not_shared(self):
+        filename = os.path.join(self.directory, "estimate.dat")
+        memmap = numpy.memmap(filename, dtype=numpy.float32, mode='w+', shape=(4, 4))
+
+        self.assertIsNone(get_memmap(memmap[1:]))
+        self.assertIsNone(get_memmap(numpy.zeros(4)))
+        self.assertEqual(MemmapReference(Image(memmap, [0.1, 0.1])).shape, (4, 4))
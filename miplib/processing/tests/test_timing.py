@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ..timing import PhaseTimer, column_headers_c
+
+
+class TestPhaseTimer(TestCase):
+    def test_disabled_timer_records_nothing(self):
+        timer = PhaseTimer(enabled=False)
+        with timer.phase('read', (0, 0), 100):
+            pass
+
+        self.assertEqual(timer.events, [])
+        self.assertEqual(timer.get_iteration_totals(0), [0.0] * (len(column_headers_c) - 1) + [0])
+
+    def test_phases_are_summed_per_iteration(self):
+        timer = PhaseTimer()
+        for iteration in range(2):
+            timer.iteration = iteration
+            for block in ((0, 0), (0, 8)):
+                with timer.phase('read', block, 100):
+                    pass
+                with timer.phase('forward_fft', block):
+                    pass
+
+        totals = timer.get_iteration_totals(1)
+        self.assertEqual(len(totals), len(column_headers_c))
+        self.assertEqual(totals[-1], 200)
+        self.assertGreater(totals[column_headers_c.index('t_forward_fft')], 0)
+        self.assertEqual(totals[column_headers_c.index('t_tau1')], 0)
+
+        block_timings = timer.block_timings
+        self.assertEqual(len(block_timings), 4)
+        self.assertEqual(block_timings['bytes_read'].sum(), 400)
+
+    def test_write_trace(self):
+        directory = tempfile.mkdtemp()
+        try:
+            timer = PhaseTimer()
+            with timer.phase('adjoint_fft', (0, 8)):
+                pass
+            path = os.path.join(directory, "trace.json")
+            timer.write_trace(path)
+
+            with open(path) as trace_file:
+                events = json.load(trace_file)["traceEvents"]
+            self.assertEqual(len(events), 1)
+            self.assertEqual(events[0]["name"], "adjoint_fft")
+            self.assertEqual(events[0]["args"]["block"], [0, 8])
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,183 @@
+"""
+timing.py
+
+This file contains a simple per-phase timer for the iterative deconvolution
+and fusion algorithms. Each iteration is divided into phases (block read,
+forward FFT, ratio, adjoint FFT, TV regularization, update and tau1), and the
+time spent in each phase is recorded per block, together with the number
+of bytes read from memory mapped or HDF5 images. This makes it possible to
+tell whether a slow run is I/O or FFT bound.
+
+The timer is disabled by default, in which case the phases cost only an
+empty context manager call.
+"""
+
+import json
+import os
+import threading
+import time
+
+import pandas
+
+phases_c = ('read', 'forward_fft', 'ratio', 'adjoint_fft', 'tv', 'update', 'tau1')
+
+# The progress table columns that are added, when the timing is enabled
+column_headers_c = tuple('t_' + phase for phase in phases_c) + ('bytes_read',)
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+class _Phase(object):
+    def __init__(self, timer, name, block, nbytes):
+        self.timer = timer
+        self.name = name
+        self.block = block
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.timer.add(self.name, self.start, time.perf_counter() - self.start,
+                       self.block, self.nbytes)
+        return False
+
+
+class PhaseTimer(object):
+    """
+    Collects the time spent in the phases of an iterative algorithm. The
+    phases may be timed simultaneously in several threads, in which case the
+    phase totals of an iteration are summed over the threads.
+    """
+
+    def __init__(self, enabled=True):
+        """
+        :param enabled: if False, nothing is recorded
+        """
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all the recorded timings.
+        """
+        self.iteration = 0
+        self.origin = time.perf_counter()
+        self.events = []
+        self.totals = {}
+
+    def phase(self, name, block=None, nbytes=0):
+        """
+        Time a phase, with a with-statement.
+
+        :param name: the phase name, one of phases_c
+        :param block: the block start index, if the phase is done for a block
+        :param nbytes: the number of bytes that are read from disk in the phase
+        """
+        if not self.enabled:
+            return _null_phase
+        assert name in phases_c
+
+        return _Phase(self, name, block, nbytes)
+
+    def add(self, name, start, duration, block=None, nbytes=0):
+        """
+        Record the duration of a phase of the current iteration.
+
+        :param name: the phase name
+        :param start: the start time, as given by time.perf_counter()
+        :param duration: the duration, in seconds
+        :param block: the block start index, or None
+        :param nbytes: the number of bytes read
+        """
+        event = (self.iteration, name, start, duration,
+                 None if block is None else tuple(int(i) for i in block),
+                 int(nbytes), (os.getpid(), threading.get_ident()))
+        with self.lock:
+            self.__append(event)
+
+    def merge(self, events):
+        """
+        Add the events that were recorded by another timer, e.g. in a worker
+        process, to the current iteration.
+
+        :param events: a list of events, from the events attribute of the
+                       other timer
+        """
+        with self.lock:
+            for event in events:
+                self.__append((self.iteration,) + tuple(event[1:]))
+
+    def __append(self, event):
+        self.events.append(event)
+        totals = self.totals.setdefault(event[0], [0.0] * len(phases_c) + [0])
+        totals[phases_c.index(event[1])] += event[3]
+        totals[-1] += event[5]
+
+    def get_iteration_totals(self, iteration):
+        """
+        Get the phase totals of a single iteration, in the order of
+        column_headers_c.
+
+        :param iteration: the iteration
+        :return: a list of the phase times (in seconds) and the bytes read
+        """
+        with self.lock:
+            return list(self.totals.get(iteration, [0.0] * len(phases_c) + [0]))
+
+    @property
+    def block_timings(self):
+        """
+        The phase times of every block in every iteration, as a DataFrame.
+        The phases that are not done per block have an empty block index.
+        """
+        columns = ('iteration', 'block') + phases_c + ('bytes_read',)
+        rows = {}
+        with self.lock:
+            for iteration, name, start, duration, block, nbytes, thread in self.events:
+                key = (iteration, block)
+                if key not in rows:
+                    rows[key] = dict.fromkeys(columns, 0.0)
+                    rows[key].update(iteration=iteration, block=block, bytes_read=0)
+                rows[key][name] += duration
+                rows[key]['bytes_read'] += nbytes
+
+        return pandas.DataFrame(list(rows.values()), columns=columns)
+
+    def write_trace(self, path):
+        """
+        Save the recorded phases as a JSON trace, in the Trace Event Format
+        that can be opened with the chrome://tracing or Perfetto viewers.
+
+        :param path: the output file path
+        """
+        with self.lock:
+            events = list(self.events)
+
+        threads = {}
+        trace = []
+        for iteration, name, start, duration, block, nbytes, thread in events:
+            args = {"iteration": iteration, "bytes": nbytes}
+            if block is not None:
+                args["block"] = list(block)
+            trace.append({"name": name,
+                          "ph": "X",
+                          "ts": round((start - self.origin) * 1e6, 3),
+                          "dur": round(duration * 1e6, 3),
+                          "pid": 0,
+                          "tid": threads.setdefault(thread, len(threads)),
+                          "args": args})
+
+        with open(path, 'w') as trace_file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, trace_file)
@@ -0,0 +1,143 @@
+"""
+bank.py
+
+This file contains a batch interface for calculating families of PSFs,
+e.g. for several emission wavelengths, pinhole sizes or refractive indexes.
+A confocal or widefield PSF is the product of an excitation and an emission
+PSF. Within a family, the same excitation and emission components are
+often shared by several PSFs. The unique components are calculated only
+once, and combined into all the requested PSFs. All the calculations are
+done in worker threads; the numerical integration in the C extension is
+done without holding the GIL.
+"""
+
+import inspect
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from . import psfgen
+
+# The PSF parameters that define the excitation and emission components
+_excitation_parameters = ('shape', 'dims', 'ex_wavelen', 'num_aperture',
+                          'refr_index', 'underfilling')
+_emission_parameters = ('shape', 'dims', 'em_wavelen', 'num_aperture',
+                        'refr_index', 'magnification')
+
+
+def parameter_grid(**axes):
+    """
+    Get all the combinations of a set of PSF parameters.
+
+    :param axes: the PSF keyword arguments. The list values are the
+                 parameters that are varied; the other values are shared
+                 by all the PSFs.
+    :return: a list of dictionaries of PSF keyword arguments
+    """
+    names = sorted(axes)
+    values = [axes[name] if isinstance(axes[name], list) else [axes[name]]
+              for name in names]
+
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+class PSFBank(object):
+    """
+    Calculate a family of PSFs of a single type.
+    """
+
+    def __init__(self, psftype, parameters, num_workers=1, cache=None):
+        """
+        :param psftype: the PSF type, as in psfgen.PSF
+        :param parameters: a list of dictionaries of the other psfgen.PSF
+                           keyword arguments, one for every PSF, e.g. from
+                           parameter_grid()
+        :param num_workers: the number of worker threads
+        :param cache: an optional PSFCache
+        """
+        self.psftype = psftype
+        self.num_workers = max(num_workers, 1)
+        self.cache = cache
+
+        # Fill in the default values, in order to find the shared
+        # components.
+        signature = inspect.signature(psfgen.PSF.__init__)
+        self.parameters = []
+        for kwargs in parameters:
+            arguments = signature.bind(None, psftype, **kwargs)
+            arguments.apply_defaults()
+            arguments = dict(arguments.arguments)
+            del arguments['self'], arguments['psftype']
+            self.parameters.append(arguments)
+
+        self.psfs = None
+
+    @staticmethod
+    def __get_key(arguments, names):
+        return tuple((name, tuple(value) if isinstance(value, (list, tuple)) else value)
+                     for name, value in ((name, arguments[name]) for name in names))
+
+    def __is_composite(self):
+        return bool(self.psftype & psfgen.ISOTROPIC) and \
+            bool(self.psftype & (psfgen.CONFOCAL | psfgen.WIDEFIELD))
+
+    def execute(self):
+        """
+        Calculate all the PSFs.
+
+        :return: a list of psfgen.PSF objects, in the order of the parameters
+        """
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            components = {}
+            if self.__is_composite():
+                components = self.__calculate_components(executor)
+
+            futures = {}
+            for arguments in self.parameters:
+                key = self.__get_key(arguments, sorted(arguments))
+                if key in futures:
+                    continue
+                kwargs = dict(arguments, cache=self.cache)
+                if self.__is_composite():
+                    kwargs['expsf'] = components[self.__get_key(arguments, _excitation_parameters)]
+                    kwargs['empsf'] = components[self.__get_key(arguments, _emission_parameters)]
+                futures[key] = executor.submit(psfgen.PSF, self.psftype, **kwargs)
+
+            self.psfs = [futures[self.__get_key(arguments, sorted(arguments))].result()
+                         for arguments in self.parameters]
+
+        return self.psfs
+
+    def __calculate_components(self, executor):
+        """
+        Calculate the unique excitation and emission PSFs, in parallel.
+
+        :return: a dictionary of the component PSFs, keyed by their parameters
+        """
+        futures = {}
+        for arguments in self.parameters:
+            key = self.__get_key(arguments, _excitation_parameters)
+            if key not in futures:
+                futures[key] = executor.submit(
+                    psfgen.PSF, psfgen.ISOTROPIC | psfgen.EXCITATION,
+                    arguments['shape'], arguments['dims'], arguments['ex_wavelen'],
+                    None, arguments['num_aperture'], arguments['refr_index'], 1.0,
+                    arguments['underfilling'], cache=self.cache)
+
+            key = self.__get_key(arguments, _emission_parameters)
+            if key not in futures:
+                futures[key] = executor.submit(
+                    psfgen.PSF, psfgen.ISOTROPIC | psfgen.EMISSION,
+                    arguments['shape'], arguments['dims'], None,
+                    arguments['em_wavelen'], arguments['num_aperture'],
+                    arguments['refr_index'], arguments['magnification'], 1.0,
+                    cache=self.cache)
+
+        return dict((key, future.result()) for key, future in futures.items())
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def __getitem__(self, index):
+        if self.psfs is None:
+            self.execute()
+        return self.psfs[index]
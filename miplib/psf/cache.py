@@ -0,0 +1,115 @@
+"""
+cache.py
+
+This file contains a persistent cache for the calculated PSFs. The
+numerical integration of the isotropic (Richards-Wolf) PSF models is slow,
+and e.g. batch deconvolution jobs tend to calculate the same PSF over and
+over again. The PSF data arrays are saved into a directory, keyed by the
+parameters of the calculation. The size of the directory is limited by
+removing the least recently used PSFs.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy
+
+
+class PSFCache(object):
+    """
+    A directory of PSF data arrays, keyed by the PSF parameters.
+    """
+
+    def __init__(self, directory, max_size=1 << 30):
+        """
+        :param directory: the cache directory; it is created, if necessary
+        :param max_size: the maximum total size of the cached files, in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def get_key(**parameters):
+        """
+        Get a cache key for a set of PSF parameters.
+
+        :param parameters: all the parameters that affect the PSF data
+        :return: the key, as a string
+        """
+        # The numbers are converted to floats, in order to get the same key
+        # e.g. for 1 and 1.0
+        items = []
+        for name, value in sorted(parameters.items()):
+            if isinstance(value, (tuple, list)):
+                value = tuple(float(i) for i in value)
+            elif isinstance(value, (int, float)):
+                value = float(value)
+            items.append((name, value))
+
+        return hashlib.sha1(repr(items).encode()).hexdigest()
+
+    def __get_path(self, key):
+        return os.path.join(self.directory, "psf_%s.npy" % key)
+
+    def get(self, key):
+        """
+        Get a PSF from the cache.
+
+        :param key: the cache key, from get_key()
+        :return: the PSF data array, or None if it is not in the cache
+        """
+        path = self.__get_path(key)
+        try:
+            data = numpy.load(path, allow_pickle=False)
+        except (IOError, ValueError):
+            return None
+
+        # The modification time tells when the PSF was used last
+        os.utime(path, None)
+        return data
+
+    def put(self, key, data):
+        """
+        Save a PSF into the cache, and remove the least recently used PSFs,
+        if the cache is full.
+
+        :param key: the cache key, from get_key()
+        :param data: the PSF data array
+        """
+        # Write into a temporary file first, so that the other processes
+        # never see a partially written PSF.
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, 'wb') as temp_file:
+            numpy.save(temp_file, numpy.asarray(data))
+        os.replace(temp_path, self.__get_path(key))
+
+        self.__evict()
+
+    def __evict(self):
+        """
+        Remove the least recently used PSFs, until the cache fits in
+        the size limit.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith("psf_") and name.endswith(".npy")):
+                continue
+            try:
+                status = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
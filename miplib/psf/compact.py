@@ -0,0 +1,154 @@
+"""
+compact.py
+
+This file contains a compact representation of the rotationally symmetric
+PSFs calculated with psfgen. The PSF is stored as the z-r data of the
+model, instead of the full 3D volume, which is 8 times redundant (mirror
+symmetry along each axis) and in double precision. The volume, or its
+Fourier transform, is produced in single precision on demand, and it may
+be cropped to the support that contains most of the PSF energy.
+"""
+
+import numpy
+
+from miplib.data.containers.image import Image
+from miplib.processing.convolution import FourierConvolver
+from . import _psf
+
+
+def mirror(octant):
+    """
+    Apply mirror symmetry along one face in each dimension. This is the
+    same as psfgen.mirror_symmetry(), but the data type is kept.
+
+    :param octant: a numpy.ndarray, with the origin at index 0 on each axis
+    :return: an array of shape 2*octant.shape-1
+    """
+    result = numpy.asarray(octant)
+    for axis in range(result.ndim):
+        flipped = numpy.flip(result, axis=axis)
+        tail = [slice(None)] * result.ndim
+        tail[axis] = slice(0, -1)
+        result = numpy.concatenate((flipped[tuple(tail)], result), axis=axis)
+
+    return result
+
+
+class CompactPSF(object):
+    """
+    A rotationally symmetric PSF, stored in z-r space.
+    """
+
+    def __init__(self, data, spacing, energy=None):
+        """
+        :param data: the PSF values in z-r space, with the origin at [0, 0]
+        :param spacing: the pixel size in z and r
+        :param energy: if given, the PSF is cropped to the smallest support
+                       that contains this fraction of the PSF energy, e.g.
+                       0.999. Outside of the support radius the PSF is zero.
+        """
+        data = numpy.asarray(data, dtype=numpy.float64)
+        assert data.ndim == 2
+
+        self.spacing = tuple(float(i) for i in spacing)
+
+        if energy is not None:
+            assert 0 < energy <= 1
+            n_z, n_r = self.__get_support(data, energy)
+            data = data[:n_z, :n_r]
+
+        self.data = data.astype(numpy.float32)
+
+    @classmethod
+    def from_psf(cls, psf, energy=None):
+        """
+        Get a compact representation of a psfgen PSF.
+
+        :param psf: a psfgen.PSF or psfgen.PsfFromFwhm
+        :param energy: the energy fraction of the support, see __init__
+        """
+        spacing = (psf.dims.um[0] / psf.dims.px[0], psf.dims.um[1] / psf.dims.px[1])
+        return cls(psf.data, spacing, energy=energy)
+
+    @staticmethod
+    def __get_support(data, energy):
+        """
+        Find the size of the z-r data that contains the given fraction of
+        the energy of the full PSF volume. Half of the energy that may be
+        lost is given to each of the z and r axes.
+        """
+        n_z, n_r = data.shape
+
+        # The number of voxels in the full volume at each integer radius
+        # and at each z plane.
+        x = numpy.arange(n_r)
+        radius = numpy.floor(numpy.hypot(x[:, None], x[None, :])).astype(numpy.int64)
+        multiplicity = numpy.where(x > 0, 2, 1)
+        voxels = numpy.bincount(radius.ravel(),
+                                weights=numpy.outer(multiplicity, multiplicity).ravel(),
+                                minlength=n_r)[:n_r]
+        planes = numpy.where(numpy.arange(n_z) > 0, 2, 1)
+
+        weighted = numpy.abs(data) * planes[:, None] * voxels[None, :]
+        total = weighted.sum()
+        if total == 0:
+            return n_z, n_r
+
+        limit = (1.0 - energy) / 2 * total
+
+        def get_size(profile):
+            outside = profile.sum() - numpy.cumsum(profile)
+            return int(numpy.argmax(outside <= limit)) + 1
+
+        return get_size(weighted.sum(axis=1)), get_size(weighted.sum(axis=0))
+
+    @property
+    def shape(self):
+        """
+        The shape of the full PSF volume.
+        """
+        n_z, n_r = self.data.shape
+        return 2 * n_z - 1, 2 * n_r - 1, 2 * n_r - 1
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def octant(self):
+        """
+        Get a single octant of the PSF volume, with the origin at index 0.
+
+        :return: a float32 numpy.ndarray
+        """
+        return _psf.zr2zxy(self.data.astype(numpy.float64)).astype(numpy.float32)
+
+    def volume(self):
+        """
+        Get the full PSF volume, centered in the array.
+
+        :return: a float32 Image
+        """
+        return Image(mirror(self.octant()), (self.spacing[0], self.spacing[1], self.spacing[1]))
+
+    def xy(self):
+        """
+        Get the focal plane of the PSF.
+
+        :return: a float32 Image
+        """
+        data = _psf.zr2zxy(self.data[:1].astype(numpy.float64))[0]
+        return Image(mirror(data.astype(numpy.float32)), (self.spacing[1], self.spacing[1]))
+
+    def get_convolver(self, ndim=3, workers=1):
+        """
+        Get a FourierConvolver of the PSF. The OTFs are calculated only when
+        needed, for each block shape.
+
+        :param ndim: 3 for the PSF volume, 2 for the focal plane
+        :param workers: the number of threads to use in a single FFT
+        """
+        assert ndim in (2, 3)
+        psf = self.volume() if ndim == 3 else self.xy()
+        psf /= psf.sum()
+
+        return FourierConvolver(psf, workers=workers)
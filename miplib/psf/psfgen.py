@@ -243,7 +243,7 @@ class PSF(object):
                  ex_wavelen=None, em_wavelen=None, num_aperture=1.2,
                  refr_index=1.333, magnification=1.0, underfilling=1.0,
                  pinhole_radius=None, pinhole_shape='round',
-                 expsf=None, empsf=None, name=None):
+                 expsf=None, empsf=None, name=None, cache=None):
         """Initialize the PSF object.
 
         Arguments
@@ -261,6 +261,9 @@ class PSF(object):
             of the pinhole divided by the magnification of the system.
         pinhole_shape : str
             Either 'round' (default) or 'square'.
+        cache : PSFCache or None
+            If given, the isotropic PSFs are read from the cache, if
+            available, and saved into it after the calculation.
 
         """
         try:
@@ -315,7 +318,20 @@ class PSF(object):
         if pinhole_radius:
             self.pinhole = Pinhole(pinhole_radius, self.dims, pinhole_shape)
 
-        start = time.clock()
+        # The Gaussian approximations are fast to calculate, and not cached.
+        cached = None
+        if cache is not None and psftype & ISOTROPIC:
+            key = cache.get_key(version=__version__, psftype=psftype,
+                                shape=self.shape, dims=self.dims.um,
+                                ex_wavelen=ex_wavelen, em_wavelen=em_wavelen,
+                                num_aperture=num_aperture, refr_index=refr_index,
+                                magnification=magnification,
+                                underfilling=underfilling,
+                                pinhole_radius=pinhole_radius,
+                                pinhole_shape=pinhole_shape)
+            cached = cache.get(key)
+
+        start = time.perf_counter()
         if psftype & GAUSSIAN:
             self.sigma = Dimensions(**self.dims)
             if self.underfilling != 1.0:
@@ -359,53 +375,65 @@ class PSF(object):
             if psftype & EXCITATION or psftype & TWOPHOTON:
                 self.em_wavelen = None
                 self.magnification = None
-                self.data = _psf.psf(0, self.shape, self.dims.ou, 1.0,
-                                     self.sinalpha, self.underfilling, 1.0, 80)
+                if cached is not None:
+                    self.data = cached
+                else:
+                    self.data = _psf.psf(0, self.shape, self.dims.ou, 1.0,
+                                         self.sinalpha, self.underfilling, 1.0, 80)
             elif psftype & EMISSION:
                 self.ex_wavelen = None
                 self.underfilling = None
-                self.data = _psf.psf(1, self.shape, self.dims.ou,
-                                     self.magnification, self.sinalpha,
-                                     1.0, 1.0, 80)
+                if cached is not None:
+                    self.data = cached
+                else:
+                    self.data = _psf.psf(1, self.shape, self.dims.ou,
+                                         self.magnification, self.sinalpha,
+                                         1.0, 1.0, 80)
             elif psftype & CONFOCAL or psftype & WIDEFIELD:
                 if em_wavelen < ex_wavelen:
                     raise ValueError("Excitation > Emission wavelength")
-                # start threads to calculate excitation and emission PSF
-                threads = []
-                if not (self.expsf and
-                        self.expsf.psftype == ISOTROPIC | EXCITATION):
-                    threads.append((
-                        "expsf",
-                        PSFthread(ISOTROPIC | EXCITATION,
-                                  shape, dims, ex_wavelen, None, num_aperture,
-                                  refr_index, 1.0, underfilling)))
-                if not (self.empsf and
-                        self.empsf.psftype == ISOTROPIC | EMISSION):
-                    threads.append((
-                        "empsf",
-                        PSFthread(ISOTROPIC | EMISSION,
-                                  shape, dims, None, em_wavelen, num_aperture,
-                                  refr_index, magnification, 1.0)))
-                for a, t in threads:
-                    t.start()
-                for a, t in threads:
-                    t.join()
-                    setattr(self, a, t.psf)
-                if not (self.expsf.iscompatible(self.empsf)):
-                    raise ValueError(
-                        "Excitation and Emission PSF not compatible")
-                if psftype & WIDEFIELD or (self.pinhole.radius.um > 9.76 *
-                                           self.ex_wavelen / self.num_aperture
-                                           ):
-                    # use widefield approximation for pinholes > 8 AU
-                    self.data = _psf.obsvol(self.expsf.data, self.empsf.data)
+                if cached is not None:
+                    self.data = cached
                 else:
-                    self.data = _psf.obsvol(self.expsf.data, self.empsf.data,
-                                            self.pinhole.kernel())
-
-        if psftype & TWOPHOTON:
-            self.data *= self.data
-        self.time = float(time.clock()-start) * 1e3
+                    # start threads to calculate excitation and emission PSF
+                    threads = []
+                    if not (self.expsf and
+                            self.expsf.psftype == ISOTROPIC | EXCITATION):
+                        threads.append((
+                            "expsf",
+                            PSFthread(ISOTROPIC | EXCITATION,
+                                      shape, dims, ex_wavelen, None, num_aperture,
+                                      refr_index, 1.0, underfilling, cache=cache)))
+                    if not (self.empsf and
+                            self.empsf.psftype == ISOTROPIC | EMISSION):
+                        threads.append((
+                            "empsf",
+                            PSFthread(ISOTROPIC | EMISSION,
+                                      shape, dims, None, em_wavelen, num_aperture,
+                                      refr_index, magnification, 1.0, cache=cache)))
+                    for a, t in threads:
+                        t.start()
+                    for a, t in threads:
+                        t.join()
+                        setattr(self, a, t.psf)
+                    if not (self.expsf.iscompatible(self.empsf)):
+                        raise ValueError(
+                            "Excitation and Emission PSF not compatible")
+                    if psftype & WIDEFIELD or (self.pinhole.radius.um > 9.76 *
+                                               self.ex_wavelen / self.num_aperture
+                                               ):
+                        # use widefield approximation for pinholes > 8 AU
+                        self.data = _psf.obsvol(self.expsf.data, self.empsf.data)
+                    else:
+                        self.data = _psf.obsvol(self.expsf.data, self.empsf.data,
+                                                self.pinhole.kernel())
+
+        if cached is None:
+            if psftype & TWOPHOTON:
+                self.data *= self.data
+            if cache is not None and psftype & ISOTROPIC:
+                cache.put(key, self.data)
+        self.time = float(time.perf_counter()-start) * 1e3
 
     def __getitem__(self, key):
         """Return value of data array at position."""
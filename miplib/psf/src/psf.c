@@ -905,6 +905,7 @@ static PyObject* py_obsvol(
         goto _fail;
     }
 
+    Py_BEGIN_ALLOW_THREADS
     error = obsvol(
         (int)PyArray_DIM(ex_psf, 0),
         (int)PyArray_DIM(ex_psf, 1),
@@ -913,6 +914,7 @@ static PyObject* py_obsvol(
         (double *)PyArray_DATA(ex_psf),
         (double *)PyArray_DATA(em_psf),
         detector ? (double *)PyArray_DATA(detector) : NULL);
+    Py_END_ALLOW_THREADS
 
     if (error != 0) {
         PyErr_Format(PyExc_ValueError, "obsvol() function failed");
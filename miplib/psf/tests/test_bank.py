@@ -0,0 +1,24 @@
+from unittest import TestCase
+
+import numpy
+
+from .. import psfgen
+from ..bank import PSFBank, parameter_grid
+
+
+class TestPSFBank(TestCase):
+    def test_components_are_shared(self):
+        parameters = parameter_grid(shape=(32, 32), dims=(2., 2.), ex_wavelen=488,
+                                    em_wavelen=[520, 600], num_aperture=1.2,
+                                    pinhole_radius=[0.2, 0.4])
+        self.assertEqual(len(parameters), 4)
+
+        bank = PSFBank(psfgen.ISOTROPIC | psfgen.CONFOCAL, parameters, num_workers=2)
+        psfs = bank.execute()
+
+        self.assertEqual(len(set(id(psf.expsf) for psf in psfs)), 1)
+        self.assertEqual(len(set(id(psf.empsf) for psf in psfs)), 2)
+
+        for psf, kwargs in zip(psfs, parameters):
+            expected = psfgen.PSF(psfgen.ISOTROPIC | psfgen.CONFOCAL, **kwargs)
+            numpy.testing.assert_array_equal(psf.data, expected.data)
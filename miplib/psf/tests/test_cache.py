@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+
+from .. import psfgen
+from ..cache import PSFCache
+
+
+class TestPSFCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached_psf_is_reused(self):
+        cache = PSFCache(self.directory)
+        parameters = dict(shape=(32, 32), dims=(2., 2.), ex_wavelen=488,
+                          em_wavelen=550, num_aperture=1.2, pinhole_radius=0.3)
+
+        psf = psfgen.PSF(psfgen.ISOTROPIC | psfgen.CONFOCAL, cache=cache, **parameters)
+        # The excitation and emission PSFs are cached as well
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+
+        cached = psfgen.PSF(psfgen.ISOTROPIC | psfgen.CONFOCAL, cache=cache, **parameters)
+        numpy.testing.assert_array_equal(cached.data, psf.data)
+        self.assertIsNone(cached.expsf)
+
+        # A different pinhole is a different PSF
+        parameters['pinhole_radius'] = 0.5
+        psfgen.PSF(psfgen.ISOTROPIC | psfgen.CONFOCAL, cache=cache, **parameters)
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+
+    def test_least_recently_used_psfs_are_evicted(self):
+        data = numpy.zeros((16, 16))
+        cache = PSFCache(self.directory, max_size=int(2.5 * data.nbytes))
+
+        for i in range(3):
+            cache.put(cache.get_key(index=i), data + i)
+            # Make the access times distinct
+            os.utime(os.path.join(self.directory, "psf_%s.npy" % cache.get_key(index=i)),
+                     (i, i))
+        self.assertIsNone(cache.get(cache.get_key(index=0)))
+        numpy.testing.assert_array_equal(cache.get(cache.get_key(index=2)), 2)
+
+    def test_key_does_not_depend_on_the_number_type(self):
+        self.assertEqual(PSFCache.get_key(shape=(16, 16), num_aperture=1),
+                         PSFCache.get_key(shape=[16., 16.], num_aperture=1.0))
@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+import numpy
+
+from .. import psfgen
+from ..compact import CompactPSF, mirror
+
+
+class TestCompactPSF(TestCase):
+    def setUp(self):
+        self.psf = psfgen.PSF(psfgen.ISOTROPIC | psfgen.CONFOCAL, shape=(32, 32),
+                              dims=(2., 2.), ex_wavelen=488, em_wavelen=550,
+                              num_aperture=1.2, pinhole_radius=0.3)
+
+    def test_volume_matches_the_psf_volume(self):
+        compact = CompactPSF.from_psf(self.psf)
+        volume = compact.volume()
+
+        self.assertEqual(volume.dtype, numpy.float32)
+        self.assertEqual(volume.shape, compact.shape)
+        numpy.testing.assert_allclose(volume, self.psf.volume(), rtol=0, atol=1e-6)
+        numpy.testing.assert_allclose(compact.xy(), volume[31], rtol=0, atol=1e-6)
+
+    def test_support_contains_the_energy(self):
+        full = self.psf.volume().sum()
+        compact = CompactPSF.from_psf(self.psf, energy=0.99)
+
+        self.assertLess(compact.shape[0], 63)
+        self.assertGreaterEqual(compact.volume().sum() / full, 0.99)
+
+    def test_mirror_matches_mirror_symmetry(self):
+        octant = numpy.random.rand(3, 4, 5)
+        numpy.testing.assert_array_equal(mirror(octant), psfgen.mirror_symmetry(octant))
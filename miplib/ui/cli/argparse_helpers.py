@@ -33,6 +33,39 @@ def parse_range_list(rngs):
     return sorted(set(chain(*[parse_range(rng) for rng in rngs.split(',')])))
 
 
+def parse_memory_size(string):
+    """ Converts a memory size string, such as "8G", "512M" or "1.5T" into
+    a number of bytes. A plain number is interpreted as bytes.
+
+    Arguments:
+        string {string} -- The input string
+
+    Raises:
+        argparse.ArgumentTypeError: raises an error if the string cannot be
+        interpreted as a memory size.
+
+    Returns:
+        int -- The memory size in bytes
+    """
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+    value = string.strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    multiplier = 1
+    if value and value[-1] in multipliers:
+        multiplier = multipliers[value[-1]]
+        value = value[:-1]
+    try:
+        size = int(float(value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Not a valid memory size: %s" % string)
+    if size <= 0:
+        raise argparse.ArgumentTypeError("The memory size should be greater than zero")
+
+    return size
+
+
 def parseFromToString(string):
     return list(int(i) for i in string.split("to"))
 
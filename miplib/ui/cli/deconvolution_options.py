@@ -1,4 +1,6 @@
 import argparse
+from miplib.ui.cli.argparse_helpers import parse_memory_size, parse_range_list, \
+    parse_float_tuple
 
 
 def get_deconvolution_options_group(parser):
@@ -37,11 +39,36 @@ def get_deconvolution_options_group(parser):
         choices=['image',
                  'blurred',
                  'image_mean',
-                 'constant'],
+                 'constant',
+                 'pyramid'],
         default='image',
         help='Specify first estimate for iteration.'
     )
 
+    group.add_argument(
+        '--pyramid-levels',
+        type=int,
+        default=2,
+        help="The number of resolution levels with --first-estimate=pyramid, "
+             "including the full resolution. Each level halves the sampling."
+    )
+
+    group.add_argument(
+        '--pyramid-iterations',
+        type=int,
+        default=20,
+        help="The number of iterations at each coarse level, with "
+             "--first-estimate=pyramid."
+    )
+
+    group.add_argument(
+        '--pyramid-detail',
+        action='store_true',
+        help="With --first-estimate=pyramid, multiply the fine details of the "
+             "image, which are lost in the downsampling, back into the "
+             "upsampled coarse estimate. The details include the image noise."
+    )
+
     group.add_argument(
         '--estimate-constant',
         dest='estimate_constant',
@@ -73,6 +100,46 @@ def get_deconvolution_options_group(parser):
              "that the entire image will be used -- you should define a larger"
              "number to optimize memory consumption"
     )
+    group.add_argument(
+        '--max-memory',
+        type=parse_memory_size,
+        default=None,
+        help="Define a memory budget, e.g. 8G, for the deconvolution. If given, the "
+             "block size is chosen automatically, to minimize the FFT work "
+             "within the budget. Overrides --blocks."
+    )
+    group.add_argument(
+        '--num-workers',
+        type=int,
+        default=1,
+        help="The number of threads that are used to process the blocks in "
+             "parallel. With a single block, the threads are used in the FFTs."
+    )
+    group.add_argument(
+        '--parallel-backend',
+        choices=['thread', 'process'],
+        default='thread',
+        help="Process the blocks in worker threads or in worker processes. "
+             "With processes, the image and the estimates are shared through "
+             "memory mapped files in the temporary directory."
+    )
+    group.add_argument(
+        '--skip-background-blocks',
+        type=float,
+        default=0,
+        help="Skip the convolutions in blocks that only contain background. "
+             "The value is the foreground threshold, in units of the "
+             "background noise level, e.g. 5. The background blocks get a "
+             "cheap closed form update instead. By default all the blocks "
+             "are processed."
+    )
+    group.add_argument(
+        '--batch-size',
+        type=int,
+        default=64,
+        help="The number of images that are deconvolved together, when a "
+             "directory or a stack of images is deconvolved with a single PSF."
+    )
     group.add_argument(
         '--stop-tau',
         type=float,
@@ -99,6 +166,41 @@ def get_deconvolution_options_group(parser):
         action='store_true'
     )
 
+    group.add_argument(
+        '--memmap-image',
+        action='store_true',
+        help="Memory map the input TIFF image instead of reading it into "
+             "memory, for images that are larger than the memory. The blocks "
+             "are streamed from the disk. Implies --memmap-estimates."
+    )
+
+    group.add_argument(
+        '--result-file',
+        default=None,
+        help="Write the result directly into a TIFF or HDF5 (.h5) file, "
+             "without loading it into memory."
+    )
+    group.add_argument(
+        '--channels',
+        type=parse_range_list,
+        default=None,
+        help="Deconvolve several channels of a multi-channel image, e.g. 0-2, "
+             "and save the results into a single multi-channel image. The psf "
+             "argument may be a comma separated list of PSF files, one for "
+             "every channel. The channels are deconvolved concurrently, "
+             "sharing the --num-workers threads and the --max-memory budget."
+    )
+
+    group.add_argument(
+        '--psf-depths',
+        type=parse_float_tuple,
+        default=None,
+        help="Deconvolve with a depth-variant PSF. The psf argument is a "
+             "comma separated list of PSF files, measured at these z "
+             "positions, e.g. 0,10,20 (in the units of the image spacing). "
+             "The PSF is interpolated linearly between the depths."
+    )
+
     group.add_argument(
         '--disable-tau1',
         action='store_true'
@@ -109,6 +211,39 @@ def get_deconvolution_options_group(parser):
         action='store_true'
     )
 
+    group.add_argument(
+        '--checkpoint-dir',
+        default=None,
+        help="Save the estimate and the iteration state into this directory "
+             "at regular intervals, and when the iteration is interrupted."
+    )
+    group.add_argument(
+        '--checkpoint-interval',
+        type=int,
+        default=10,
+        help="The number of iterations between checkpoints."
+    )
+    group.add_argument(
+        '--resume',
+        action='store_true',
+        help="Continue from the last checkpoint in --checkpoint-dir."
+    )
+
+    group.add_argument(
+        '--profile-phases',
+        action='store_true',
+        help="Record the time spent in each phase of the iteration (block read, "
+             "FFTs, ratio, regularization, update and tau1) per block, as well "
+             "as the number of bytes read from memory mapped or HDF5 images. "
+             "The phase totals are added to the progress table."
+    )
+    group.add_argument(
+        '--profile-trace',
+        default=None,
+        help="Save the phase timings of --profile-phases into the given file, "
+             "as a JSON trace that can be viewed in chrome://tracing."
+    )
+
     group.add_argument(
         '--rl-background',
         type=float,
@@ -119,12 +254,35 @@ def get_deconvolution_options_group(parser):
         '--rl-auto-background',
         action="store_true"
     )
+    group.add_argument(
+        '--rl-acceleration',
+        choices=['none', 'biggs-andrews'],
+        default='none',
+        help="Accelerate the RL iteration with vector extrapolation. The "
+             "biggs-andrews mode usually reaches the same result with "
+             "considerably fewer iterations."
+    )
     group.add_argument(
         '--rl-frc-stop',
         type=float,
         default=0.0,
         help= "Set a stopping condition for the deconvolution based on FRC"
     )
+    group.add_argument(
+        '--rl-frc-interval',
+        type=int,
+        default=1,
+        help="Evaluate the FRC based stopping condition every N iterations. "
+             "The resolution change is then measured over N iterations."
+    )
+    group.add_argument(
+        '--rl-frc-crop',
+        type=int,
+        default=0,
+        help="Evaluate the FRC based stopping condition on a central crop of "
+             "the given size (in pixels), instead of the whole image. 0 "
+             "disables cropping."
+    )
     return parser
 
 
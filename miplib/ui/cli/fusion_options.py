@@ -2,7 +2,7 @@
 Options for multi-view image fusion
 """
 import argparse
-from miplib.ui.cli.argparse_helpers import parse_range_list
+from miplib.ui.cli.argparse_helpers import parse_range_list, parse_memory_size
 
 def get_fusion_options_group(parser):
     assert isinstance(parser, argparse.ArgumentParser)
@@ -71,8 +71,19 @@ def get_fusion_options_group(parser):
         '--fusion-method',
         dest='fusion_method',
         choices=['multiplicative', 'multiplicative-opt', 'summative',
-                 'summative-opt'],
-        default='summative'
+                 'summative-opt', 'multiplicative-os', 'multiplicative-opt-os',
+                 'summative-os', 'summative-opt-os'],
+        default='summative',
+        help="The -os methods update the estimate after each of the "
+             "--os-subsets subsets of the views (ordered subsets), "
+             "instead of once per pass over all the views."
+    )
+    group.add_argument(
+        '--os-subsets',
+        type=int,
+        default=0,
+        help="The number of ordered subsets of the views, with the -os "
+             "fusion methods. By default every view is a subset of its own."
     )
 
     group.add_argument(
@@ -85,6 +96,14 @@ def get_fusion_options_group(parser):
              "that the entire image will be used -- you should define a larger"
              "number to optimize memory consumption"
     )
+    group.add_argument(
+        '--max-memory',
+        type=parse_memory_size,
+        default=None,
+        help="Define a memory budget, e.g. 8G, for the fusion. If given, the "
+             "block size is chosen automatically, to minimize the FFT work "
+             "within the budget. Overrides --blocks."
+    )
     group.add_argument(
         '--rltv-stop-tau',
         type=float,
@@ -105,6 +124,14 @@ def get_fusion_options_group(parser):
         default=0,
         help='The amount of padding to apply to a fusion block.'
     )
+    group.add_argument(
+        '--rl-acceleration',
+        choices=['none', 'biggs-andrews'],
+        default='none',
+        help="Accelerate the RL iteration with vector extrapolation. The "
+             "biggs-andrews mode usually reaches the same result with "
+             "considerably fewer iterations."
+    )
     group.add_argument(
         '--fuse-views',
         dest='fuse_views',
@@ -115,12 +142,92 @@ def get_fusion_options_group(parser):
         '--memmap-estimates',
         action='store_true'
     )
+    group.add_argument(
+        '--num-workers',
+        type=int,
+        default=1,
+        help="The number of threads that are used to process the blocks of "
+             "a view in parallel."
+    )
+    group.add_argument(
+        '--block-cache-size',
+        type=parse_memory_size,
+        default=None,
+        help="Keep the blocks of the registered views in memory, up to this "
+             "size, e.g. 4G, instead of reading them from the data file at "
+             "every iteration. The least recently used blocks are dropped "
+             "when the cache is full. Counts towards --max-memory."
+    )
+    group.add_argument(
+        '--block-cache-spill',
+        action='store_true',
+        help="Save the blocks that do not fit in the --block-cache-size "
+             "into the temporary directory, instead of dropping them."
+    )
+    group.add_argument(
+        '--parallel-views',
+        action='store_true',
+        help="Process the views of a block at the same time in the "
+             "--num-workers threads, instead of one view at a time. Useful "
+             "when there are fewer blocks than threads. Not used with the "
+             "process backend."
+    )
+    group.add_argument(
+        '--prefetch-depth',
+        type=int,
+        default=0,
+        help="Read the registered view blocks in a background thread, up to "
+             "this many blocks ahead of the block that is being processed. "
+             "Hides the read latency of slow (e.g. network mounted) data "
+             "files. Not used with the process backend."
+    )
+    group.add_argument(
+        '--parallel-backend',
+        choices=['thread', 'process'],
+        default='thread',
+        help="Process the blocks in worker threads or in worker processes. "
+             "With processes, the registered views and the estimates are "
+             "shared through memory mapped files in the temporary directory."
+    )
 
     group.add_argument(
         '--disable-tau1',
         action='store_true'
     )
 
+    group.add_argument(
+        '--checkpoint-dir',
+        default=None,
+        help="Save the estimate and the iteration state into this directory "
+             "at regular intervals, and when the iteration is interrupted."
+    )
+    group.add_argument(
+        '--checkpoint-interval',
+        type=int,
+        default=10,
+        help="The number of iterations between checkpoints."
+    )
+    group.add_argument(
+        '--resume',
+        action='store_true',
+        help="Continue from the last checkpoint in --checkpoint-dir."
+    )
+
+    group.add_argument(
+        '--profile-phases',
+        action='store_true',
+        help="Record the time spent in each phase of the iteration (block read, "
+             "FFTs, ratio, regularization, update and tau1) per block, as well "
+             "as the number of bytes read from memory mapped or HDF5 images. "
+             "The phase totals are added to the progress table."
+    )
+    group.add_argument(
+        '--profile-trace',
+        default=None,
+        help="Save the phase timings of --profile-phases into the given file, "
+             "as a JSON trace that can be viewed in chrome://tracing."
+    )
+
     group.add_argument(
         '--disable-fft-psf-memmap',
         action='store_true'
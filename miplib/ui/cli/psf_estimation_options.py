@@ -7,6 +7,10 @@ def parse_psf_type(args):
         return psfgen.GAUSSIAN | psfgen.CONFOCAL
     elif args == "widefield":
         return psfgen.GAUSSIAN | psfgen.WIDEFIELD
+    elif args == "confocal-isotropic":
+        return psfgen.ISOTROPIC | psfgen.CONFOCAL
+    elif args == "widefield-isotropic":
+        return psfgen.ISOTROPIC | psfgen.WIDEFIELD
     else:
         raise argparse.ArgumentTypeError("Unknown PSF type")
 
@@ -44,6 +48,22 @@ def get_psf_estimation_options_group(parser):
         type=float,
         default=550
     )
+    group.add_argument(
+        '--channel-ex-wl',
+        type=helpers.parse_float_tuple,
+        default=None,
+        help="The excitation wavelengths of the channels, e.g. 488,561, for "
+             "calculating a PSF for every channel with --channels. "
+             "Overrides --ex-wl."
+    )
+    group.add_argument(
+        '--channel-em-wl',
+        type=helpers.parse_float_tuple,
+        default=None,
+        help="The emission wavelengths of the channels, e.g. 520,600, for "
+             "calculating a PSF for every channel with --channels. "
+             "Overrides --em-wl."
+    )
     group.add_argument(
         '--na',
         type=float,
@@ -65,5 +85,43 @@ def get_psf_estimation_options_group(parser):
         default=None
 
     )
+    group.add_argument(
+        '--sted-psf',
+        action='store_true',
+        help="Apply the STED depletion correction to the calculated PSF."
+    )
+    group.add_argument(
+        '--sted-phi',
+        type=float,
+        default=3.22,
+        help="The depletion gradient of the STED correction, per um."
+    )
+    group.add_argument(
+        '--sted-sigma',
+        type=float,
+        default=6.0,
+        help="The saturation factor Isted/Isat of the STED correction."
+    )
+    group.add_argument(
+        '--psf-support-energy',
+        type=float,
+        default=None,
+        help="Crop the calculated PSF to the smallest support that contains "
+             "this fraction of the PSF energy, e.g. 0.999. A smaller PSF "
+             "reduces the block overlap and the FFT sizes."
+    )
+    group.add_argument(
+        '--psf-cache-dir',
+        default=None,
+        help="Save the calculated isotropic PSFs into this directory, and "
+             "reuse them in the following runs with the same parameters."
+    )
+    group.add_argument(
+        '--psf-cache-size',
+        type=helpers.parse_memory_size,
+        default=1 << 30,
+        help="The maximum size of the PSF cache, e.g. 500M. The least "
+             "recently used PSFs are removed first."
+    )
 
     return parser
\ No newline at end of file